@@ -0,0 +1,587 @@
+import asyncio
+from concurrent import futures
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import random
+import socket
+import statistics
+import threading
+import time
+
+import argparse
+import requests
+import telebot
+
+from configs import settings
+from models import extractors, parsers
+from models.db import DBHandler
+from models.dispatcher import UpdateDispatcher
+from models.logger import cprint
+from models.webhook import WebhookServer
+from utils.telegram import TeleBot
+
+
+BENCHMARK_DB_NAME = 'benchmark.sqlite3'
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+FIXTURES = {
+    # path part: recorded page
+    '/commodities/': 'investing_gold.html',
+    '-exchange-rate-calculator': 'freecurrencyrates_usd.html',
+    '/price/bitcoin': 'coindesk_bitcoin.html',
+}
+
+
+
+def timeit(func, *args, **kwargs):
+    """
+    Call function and measure its wall time
+
+    :return:
+        (result, elapsed)(tuple[Any, float]): result and seconds elapsed
+    """
+    start = time.perf_counter()
+    res = func(*args, **kwargs)
+    return res, time.perf_counter() - start
+
+
+def create_benchmark_db(users_count:int):
+    """
+    Create database with `users_count` active users and default rates,
+    every tenth user has '09:00' in check times of BTC
+
+    :arguments:
+        users_count(int): how many users to create
+    :return:
+        db(DBHandler): handler of the created database
+    """
+    if os.path.isfile(BENCHMARK_DB_NAME):
+        os.remove(BENCHMARK_DB_NAME)
+    db = DBHandler(BENCHMARK_DB_NAME)
+    with db.pool.connection() as conn:
+        conn.executemany(
+            'INSERT INTO users(id, is_active) VALUES (?, 1)',
+            ((user_id,) for user_id in range(users_count))
+        )
+        conn.executemany(
+            'INSERT INTO users_rates VALUES (?, ?, ?, ?)',
+            (
+                (user_id, iso, 1, 0.01)
+                for user_id in range(users_count)
+                for iso in settings.CURRENCIES
+            )
+        )
+        conn.executemany(
+            'INSERT INTO rate_check_times VALUES (?, ?, ?)',
+            (
+                (user_id, iso, check_time)
+                for user_id in range(users_count)
+                for iso in settings.CURRENCIES
+                for check_time in (
+                    ['09:00', '15:00', '21:00']
+                    if user_id % 10 == 0 and iso == 'BTC' else
+                    ['11:00', '15:00', '21:00']
+                )
+            )
+        )
+        conn.commit()
+    return db
+
+
+def drop_benchmark_db(db):
+    db.close()
+    os.remove(BENCHMARK_DB_NAME)
+
+
+@contextlib.contextmanager
+def serve_fixtures(latency:float=0, failure_rate:float=0):
+    """
+    Run local HTTP server serving recorded pages from FIXTURES_DIR,
+    works as an HTTP proxy as well
+
+    :arguments:
+        latency(float | Callable[[], float])=0: 
+            seconds to wait before every response
+        failure_rate(float)=0: part of requests answered with 502
+    :return:
+        server(ThreadingHTTPServer): server with `url` and `requests_count`
+    """
+    class FixturesHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server.requests_count += 1
+            time.sleep(latency() if callable(latency) else latency)
+            if random.random() < failure_rate:
+                self.send_error(502)
+                return
+            for part, filename in FIXTURES.items():
+                if part in self.path:
+                    with open(os.path.join(FIXTURES_DIR, filename), 'rb') as f:
+                        body = f.read()
+                    try:
+                        self.send_response(200)
+                        self.send_header(
+                            'Content-Type', 'text/html; charset=utf-8'
+                        )
+                        self.send_header('Content-Length', str(len(body)))
+                        self.end_headers()
+                        self.wfile.write(body)
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass  # client has timed out or got raced response
+                    return
+            self.send_error(404)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixturesHandler)
+    server.daemon_threads = True
+    server.requests_count = 0
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_users_by_check_time(users_counts:list):
+    def legacy_get_users_by_check_time(db, check_time:str):
+        # the N+1 implementation replaced by a joined query
+        return [
+            db.get_user(user_id)
+            for user_id in range(users_count)
+            if any(
+                check_time in rate['check_times']
+                for rate in db.get_user_rates(user_id)
+            )
+        ]
+
+    for users_count in users_counts:
+        db = create_benchmark_db(users_count)
+        candidates = [('joined', db.get_users_by_check_time)]
+        if users_count <= 10_000:
+            # legacy implementation is too slow for bigger counts
+            candidates.append(
+                ('legacy', lambda t: legacy_get_users_by_check_time(db, t))
+            )
+        for name, func in candidates:
+            start_count = db.pool.executed_count
+            users, elapsed = timeit(func, '09:00')
+            cprint(
+                "{:>7} users, {}: {} found, {} queries, {:.3f}s".format(
+                    users_count, name, len(users),
+                    db.pool.executed_count - start_count, elapsed
+                ),
+                'cyan'
+            )
+        drop_benchmark_db(db)
+
+
+def bench_proxies(requests_count:int):
+    def get_dead_proxy():
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return '127.0.0.1:{}'.format(sock.getsockname()[1])
+
+    def flaky_latency():
+        return 1.5 if random.random() < 0.5 else 0.05
+
+    with contextlib.ExitStack() as stack:
+        servers = [
+            *[stack.enter_context(serve_fixtures(0.05)) for _ in range(2)],
+            *[
+                stack.enter_context(serve_fixtures(flaky_latency)) 
+                for _ in range(3)
+            ],
+            *[
+                stack.enter_context(serve_fixtures(0.05, failure_rate=0.8)) 
+                for _ in range(2)
+            ],
+        ]
+        proxies = [
+            server.url.replace('http://', '') for server in servers
+        ] + [get_dead_proxy()]
+        shared_health = parsers.ProxyHealth(proxies)
+        candidates = [
+            # name, hedged requests, function returning proxies' health
+            ('random order', 1, lambda: parsers.ProxyHealth(proxies)),
+            ('health ranked', 1, lambda: shared_health),
+            ('health ranked, hedged', 2, lambda: shared_health),
+        ]
+        for name, hedged_requests, get_health in candidates:
+            parser = parsers.CurrencyParser(
+                'Gold', link='http://fixtures.invalid/commodities/gold', 
+                css_selector='#last_last', proxy_list=None, 
+                timeout=1, deadline=10, hedge_delay=0.2,
+                hedged_requests=hedged_requests
+            )
+            latencies, failures = [], 0
+            for _ in range(requests_count):
+                parser.proxy_health = get_health()
+                try:
+                    _, elapsed = timeit(parser.get_rate)
+                    latencies.append(elapsed)
+                except Exception:
+                    failures += 1
+            quantiles = statistics.quantiles(
+                latencies, n=100, method='inclusive'
+            )
+            cprint(
+                "{:>21}: p50 {:.3f}s, p95 {:.3f}s, p99 {:.3f}s, "
+                "max {:.3f}s, {} failed".format(
+                    name, quantiles[49], quantiles[94], quantiles[98],
+                    max(latencies), failures
+                ),
+                'cyan'
+            )
+        shared_health.set_proxies([])  # stop recording stray requests
+
+
+def bench_extractors(repeat:int):
+    class TwiceSoupExtractor(extractors.SoupExtractor):
+        # testing and parsing the response used to build two soups
+        def extract(self, html, css_selector):
+            super().extract(html, css_selector)
+            return super().extract(html, css_selector)
+
+    pages = [
+        # parser class, recorded page, css selector
+        ('InvestingParser', 'investing_gold.html', '#last_last'),
+        (
+            'FreecurrencyratesParser', 'freecurrencyrates_usd.html', 
+            '#rate-iso-RUB'
+        ),
+        (
+            'BitcoinParser', 'coindesk_bitcoin.html', 
+            "#export-chart-element > div > section > "
+            "div.coin-info-list.price-list > div:nth-child(1) > "
+            "div.data-definition > div"
+        ),
+    ]
+    candidates = [
+        # name, extractor
+        ('html.parser, twice', TwiceSoupExtractor()),
+        ('html.parser', extractors.SoupExtractor()),
+        ('soup strainer', extractors.SoupStrainerExtractor()),
+        ('regex', extractors.RegexExtractor()),
+        *(
+            [('lxml', extractors.LxmlExtractor())] 
+            if extractors.lxml is not None else []
+        ),
+        ('default chain', extractors.get_default_extractor()),
+    ]
+    for parser_name, filename, css_selector in pages:
+        with open(os.path.join(FIXTURES_DIR, filename), encoding='utf-8') as f:
+            html = f.read()
+        cprint(f"{parser_name} ({filename}, {len(html) // 1024}KB):", 'cyan')
+        for name, extractor in candidates:
+            if not extractor.supports(css_selector):
+                continue
+            element, elapsed = timeit(lambda: [
+                extractor.extract(html, css_selector) for _ in range(repeat)
+            ])
+            cprint(
+                "{:>20}: {:.3f}ms per page, found {!r}".format(
+                    name, elapsed / repeat * 1000, 
+                    element[-1].text.strip() or element[-1].get('value')
+                ),
+                'cyan'
+            )
+
+
+def bench_fetch(requests_count:int, latency:float, limit_per_host:int):
+    with serve_fixtures(latency) as server:
+        link = server.url + '/commodities/gold'
+        fetcher = parsers.AsyncFetcher(
+            limit_per_host=limit_per_host
+        ) if parsers.aiohttp else None
+        parser = parsers.CurrencyParser(
+            'Gold', link=link, css_selector='#last_last', proxy_list=None
+        )
+        executor = futures.ThreadPoolExecutor(settings.PARSERS_MAX_WORKERS)
+        candidates = [
+            # name, function returning responses or rates
+            ('requests, serial', lambda: [
+                parser.get_rate() for _ in range(requests_count)
+            ]),
+            ('requests, threads', lambda: list(executor.map(
+                lambda _: parser.get_rate(), range(requests_count)
+            ))),
+            ('requests, threads, fetch only', lambda: list(executor.map(
+                lambda _: parser.session.get(link), range(requests_count)
+            ))),
+        ]
+        if fetcher is not None:
+            async_parser = parsers.CurrencyParser(
+                'Gold', link=link, css_selector='#last_last', 
+                proxy_list=None, fetcher=fetcher
+            )
+            async def gather(coro_function):
+                return await asyncio.gather(*(
+                    coro_function() for _ in range(requests_count)
+                ))
+            candidates.extend([
+                ('aiohttp', lambda: fetcher.run(gather(
+                    async_parser.aget_rate
+                ))),
+                ('aiohttp, fetch only', lambda: fetcher.run(gather(
+                    lambda: fetcher.fetch(link)
+                ))),
+            ])
+        else:
+            cprint("aiohttp is not installed, skipping asyncio backend", 'red')
+        for name, func in candidates:
+            start_count = server.requests_count
+            results, elapsed = timeit(func)
+            cprint(
+                "{:>29}: {} requests, {:.3f}s, {:.1f} per second".format(
+                    name, server.requests_count - start_count,
+                    elapsed, len(results) / elapsed
+                ),
+                'cyan'
+            )
+        executor.shutdown()
+        if fetcher is not None:
+            fetcher.close()
+
+
+
+def bench_webhook(
+        updates_count:int, chats_count:int, latency:float, 
+        concurrency:int, workers_counts:list
+        ):
+    def get_update(update_id:int, chat_id:int) -> dict:
+        user = {'id': chat_id, 'is_bot': False, 'first_name': 'User'}
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id, 'date': 0, 'text': '/today',
+                'chat': {'id': chat_id, 'type': 'private'}, 'from': user
+            }
+        }
+
+    def post_updates(server, updates:list):
+        with requests.Session() as session:
+            for update in updates:
+                session.post(
+                    server.url, json=update, headers={
+                        'X-Telegram-Bot-Api-Secret-Token': server.secret_token
+                    }
+                ).raise_for_status()
+
+    # every poster sends updates of its own chats, so they come in order
+    updates_by_poster = [[] for _ in range(concurrency)]
+    for update_id in range(updates_count):
+        chat_id = update_id % chats_count
+        updates_by_poster[chat_id % concurrency].append(
+            get_update(update_id, chat_id)
+        )
+    for workers in workers_counts:
+        handled = {}  # chat_id: ids of handled updates
+
+        def process(updates:list):
+            time.sleep(latency)  # handler's queries and requests
+            for update in updates:
+                handled.setdefault(update.message.chat.id, []).append(
+                    update.update_id
+                )
+
+        dispatcher = UpdateDispatcher(process, workers=workers)
+        server = WebhookServer(dispatcher, port=0, secret_token='benchmark')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        executor = futures.ThreadPoolExecutor(concurrency)
+        start = time.perf_counter()
+        for result in executor.map(
+                lambda updates: post_updates(server, updates), 
+                updates_by_poster
+                ):
+            pass
+        posted = time.perf_counter() - start
+        dispatcher.join()
+        elapsed = time.perf_counter() - start
+        executor.shutdown()
+        server.shutdown()
+        server.server_close()
+        stats = dispatcher.stats
+        cprint(
+            "{:>3} workers: {} updates, posted in {:.3f}s, handled in "
+            "{:.3f}s, {:.1f} per second, {:.3f}s avg latency, "
+            "order kept: {}".format(
+                workers, stats['processed'], posted, elapsed, 
+                stats['processed'] / elapsed, stats['avg_latency'],
+                all(ids == sorted(ids) for ids in handled.values())
+            ),
+            'cyan'
+        )
+
+
+
+def bench_callbacks(calls_count:int):
+    # old data, predicates and new routes of main_bot's callback handlers
+    handlers = [
+        ('next_prediction_to_{}', ('next', int)),
+        ('previous_prediction_to_{}', ('prev', int)),
+        ('like_prediction_{}', ('like', int)),
+        ('dislike_prediction_{}', ('dislike', int)),
+        ('get_prediction_{}', ('pred', int)),
+        ('ask_delete_prediction_{}', ('ask_del', int)),
+        ('delete_prediction_{}', ('del', int)),
+        ('get_user_predictions_{}', ('preds', int)),
+        ('change_currency_converter_amount_to_{}', ('amount', str)),
+        ('send_message_to_techsupport', ('support',)),
+    ]
+    predicates = [
+        lambda data: (
+            'next_prediction_to_' in data or 'previous_prediction_to_' in data
+        ),
+        lambda data: (
+            'like_prediction_' in data or 'dislike_prediction_' in data
+        ),
+        lambda data: 'get_prediction_' in data,
+        lambda data: 'ask_delete_prediction_' in data,
+        lambda data: 'delete_prediction_' in data,
+        lambda data: 'get_user_predictions_' in data,
+        lambda data: 'change_currency_converter_amount_to_' in data,
+        lambda data: data == 'send_message_to_techsupport',
+    ]
+
+    def get_calls(get_data) -> list:
+        return [
+            telebot.types.CallbackQuery.de_json({
+                'id': str(i), 'chat_instance': '1', 'data': get_data(i),
+                'from': {'id': i, 'is_bot': False, 'first_name': 'User'}
+            })
+            for i in range(calls_count)
+        ]
+
+    def handle(call, *args):
+        handled[0] += 1
+
+    random.seed(0)
+    kinds = [random.randrange(len(handlers)) for _ in range(calls_count)]
+    legacy_bot = telebot.TeleBot('1:token', threaded=False)
+    for predicate in predicates:
+        legacy_bot.callback_query_handler(
+            lambda call, predicate=predicate: predicate(call.data)
+        )(handle)
+    bot = TeleBot('1:token', threaded=False)
+    for old_data, (prefix, *types) in handlers:
+        bot.callback_route(
+            prefix, *types, aliases=(old_data.replace('_{}', ''),)
+        )(handle)
+    candidates = [
+        ('predicates', legacy_bot, get_calls(
+            lambda i: handlers[kinds[i]][0].format(i)
+        )),
+        ('routes', bot, get_calls(
+            lambda i: bot.callback_data(
+                handlers[kinds[i]][1][0], 
+                *[i] * (len(handlers[kinds[i]][1]) - 1)
+            )
+        )),
+        ('routes, old data', bot, get_calls(
+            lambda i: handlers[kinds[i]][0].format(i)
+        )),
+    ]
+    for name, candidate_bot, calls in candidates:
+        handled = [0]
+        _, elapsed = timeit(candidate_bot.process_new_callback_query, calls)
+        cprint(
+            "{:>16}: {} calls, {} handled, {:.3f}s, {:.2f}us per call".format(
+                name, calls_count, handled[0], elapsed, 
+                elapsed / calls_count * 10 ** 6
+            ),
+            'cyan'
+        )
+
+
+
+if __name__ == '__main__':
+    benchmarks = {
+        'users-by-check-time': lambda namespace: bench_users_by_check_time(
+            namespace.counts
+        ),
+        'proxies': lambda namespace: bench_proxies(namespace.requests),
+        'extractors': lambda namespace: bench_extractors(namespace.repeat),
+        'fetch': lambda namespace: bench_fetch(
+            namespace.requests, namespace.latency, namespace.limit_per_host
+        ),
+        'callbacks': lambda namespace: bench_callbacks(namespace.calls),
+        'webhook': lambda namespace: bench_webhook(
+            namespace.updates, namespace.chats, namespace.latency,
+            namespace.concurrency, namespace.workers
+        ),
+    }
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(help="benchmark", dest='benchmark')
+    parser_check_time = subparsers.add_parser(
+        'users-by-check-time',
+        help="load users to be alarmed at some check time"
+    )
+    parser_check_time.add_argument(
+        '-c', '--counts', type=int, nargs="+",
+        default=[100, 1_000, 10_000, 100_000], help="users counts"
+    )
+    parser_proxies = subparsers.add_parser(
+        'proxies', help="parse rates via flaky local proxies"
+    )
+    parser_proxies.add_argument(
+        '-r', '--requests', type=int, default=100, help="requests count"
+    )
+    parser_extractors = subparsers.add_parser(
+        'extractors', help="extract rates from recorded pages"
+    )
+    parser_extractors.add_argument(
+        '-r', '--repeat', type=int, default=20, help="extractions per page"
+    )
+    parser_fetch = subparsers.add_parser(
+        'fetch', help="parse rates from local server with recorded pages"
+    )
+    parser_fetch.add_argument(
+        '-r', '--requests', type=int, default=100, help="requests count"
+    )
+    parser_fetch.add_argument(
+        '-l', '--latency', type=float, default=0.05, 
+        help="seconds of server's latency"
+    )
+    parser_fetch.add_argument(
+        '-p', '--limit-per-host', type=int, 
+        default=settings.PARSER_LIMIT_PER_HOST, 
+        help="max connections of asyncio backend"
+    )
+    parser_callbacks = subparsers.add_parser(
+        'callbacks', help="route synthetic callback queries to handlers"
+    )
+    parser_callbacks.add_argument(
+        '-c', '--calls', type=int, default=100_000, help="calls count"
+    )
+    parser_webhook = subparsers.add_parser(
+        'webhook', help="post synthetic updates to local webhook server"
+    )
+    parser_webhook.add_argument(
+        '-u', '--updates', type=int, default=2000, help="updates count"
+    )
+    parser_webhook.add_argument(
+        '-c', '--chats', type=int, default=200, help="chats count"
+    )
+    parser_webhook.add_argument(
+        '-l', '--latency', type=float, default=0.01, 
+        help="seconds of handling an update"
+    )
+    parser_webhook.add_argument(
+        '--concurrency', type=int, default=8, 
+        help="connections posting updates"
+    )
+    parser_webhook.add_argument(
+        '-w', '--workers', type=int, nargs="+", 
+        default=[1, settings.UPDATES_WORKERS, 32], 
+        help="counts of dispatcher's workers"
+    )
+    namespace = parser.parse_args()
+    if namespace.benchmark is not None:
+        benchmarks[namespace.benchmark](namespace)
+    else:
+        parser.print_help()
@@ -13,6 +13,8 @@ ACCESSIBLE_LINK = "https://t.me/{}?start=support"  # {} - bot username
 
 DB_NAME = 'db.sqlite3'  # database filename
 DUMP_NAME = 'dump.sql'  # default name for database dump
+DB_POOL_SIZE = 5  # max number of open connections to the database
+DB_TIMEOUT = 10  # seconds to wait for a free connection or a locked database
 
 
 CHECK_TIMES = [
@@ -44,6 +46,54 @@ ACCEPTABLE_CURRENCIES_CONVERTION = {
     }
 }
 CURRENCY_RATES_CHANGE_AMOUNTS = ['Reset', '...']
+PARSERS_MAX_WORKERS = 10  # max number of rates fetched concurrently
+PARSER_TIMEOUT = 10  # seconds to wait for a response of a site
+PARSER_DEADLINE = 30  # seconds to spend on all proxies for one response
+PARSERS_REFRESH_TIMEOUT = 60  # seconds to wait for all parsers to refresh
+PARSER_LIMIT_PER_HOST = 4  # max connections to a site (asyncio backend)
+PARSER_HEDGED_REQUESTS = 2  # max proxies raced for one response
+PARSER_HEDGE_DELAY = 2  # seconds to wait before racing the next proxy
+PROXY_EWMA_ALPHA = 0.3  # weight of the latest latency of a proxy
+PROXY_MAX_FAILURES = 3  # failures in a row after which a proxy cools down
+PROXY_COOLDOWN = 5 * 60  # seconds to skip a failing proxy
+PARSERS_ASYNC_BACKEND = False  # parse with aiohttp if it is installed
+RATES_CACHE_TTL = 3 * 60  # seconds while a cached rate is fresh
+RATES_CACHE_STALE_TTL = 10 * 60  # seconds while an expired rate is served
+CURRENCY_EXISTS_TTL = 7 * 24 * 60 * 60  # seconds to trust an existing iso
+CURRENCY_MISSING_TTL = 24 * 60 * 60  # seconds to trust a missing iso
+RATES_SNAPSHOTS_KEEP = 24 * 60 * 60  # seconds to keep rates snapshots
+RATES_HISTORY_RESOLUTIONS = {  # seconds: seconds to keep (None - forever)
+    60: 2 * 24 * 60 * 60,  # 1 minute buckets for 2 days
+    60 * 60: 90 * 24 * 60 * 60,  # 1 hour buckets for 90 days
+    24 * 60 * 60: None,  # 1 day buckets forever
+}
+
+
+# Sending messages
+SEND_GLOBAL_RATE = 30  # messages per second to all chats
+SEND_CHAT_RATE = 1  # messages per second to one chat
+SEND_CHAT_BURST = 3  # messages to one chat sent at once before limiting
+SEND_WORKERS = 8  # threads sending messages
+SEND_MAX_RETRIES = 3  # retries of a message after 429 or network errors
+BROADCAST_BATCH_SIZE = 100  # users sent to between saves of progress
+
+
+# Sessions
+SESSIONS_CACHE_SIZE = 10000  # max number of cached sessions
+SESSIONS_CACHE_TTL = 30 * 60  # seconds to keep a session not used
+SESSIONS_CACHE_MAX_AGE = 60 * 60  # seconds after which a session is reloaded
+
+
+# Receiving updates
+UPDATES_WORKERS = 8  # threads handling updates, one chat is in one thread
+UPDATES_QUEUE_SIZE = 1000  # max updates waiting for a thread (0 - no limit)
+POLLING_TIMEOUT = 20  # seconds of long polling for updates
+WEBHOOK_URL = None  # public HTTPS url of webhook server (without path)
+WEBHOOK_HOST = '127.0.0.1'  # address of webhook server, behind reverse proxy
+WEBHOOK_PORT = 8080  # port of webhook server
+WEBHOOK_PATH = '/telegram'  # path to which Telegram posts updates
+WEBHOOK_SECRET_TOKEN = None  # if None, a random one is set on every start
+WEBHOOK_MAX_CONNECTIONS = 40  # max connections Telegram opens to the server
 
 
 # Check times
@@ -10,16 +10,19 @@ import schedule
 
 from configs import settings
 from models.parsers import *
-from models.user import User, Prediction, Session
+from models.user import User, Prediction, Session, SessionCache
+from models.send_queue import SendQueue
+from models.broadcast import PredictionsBroadcaster
+from models.dispatcher import UpdateDispatcher
 from models import exceptions
 from utils import *
 from utils.translator import translate as _
-from utils.telegram import kbs, inline_kbs
+from utils.telegram import TeleBot, kbs, inline_kbs
 from utils.dt import *
 
 
 telebot.apihelper.ENABLE_MIDDLEWARE = True
-bot = telebot.TeleBot(settings.TOKEN, threaded=False)  # RecursionError
+bot = TeleBot(settings.TOKEN, threaded=False)  # RecursionError
 bot.full_bot_commands = {
     '/start': 'запустить бота',  # Start the bot
     '/me': 'ваша информация',  # Your info
@@ -46,27 +49,77 @@ bot.short_bot_commands = {
 }
 bot.skip_pending = True
 
-currency_parser = CurrencyExchanger(proxy_list=get_proxy_list())
+send_queue = SendQueue()
+send_message = bot.send_message  # sends directly, for SendQueue.submit()
+# replies are sent through the queue too, before scheduled messages
+bot.send_message = send_queue.wrap(
+    send_message, priority=SendQueue.INTERACTIVE
+)
+bot.send_invoice = send_queue.wrap(
+    bot.send_invoice, priority=SendQueue.INTERACTIVE
+)
+bot.forward_message = send_queue.wrap(
+    bot.forward_message, priority=SendQueue.INTERACTIVE
+)
+
+rates_snapshots = RatesSnapshotStore()
+rates_history = RatesHistory()
+# rates are parsed by warm_up(), the last known ones are used until then
+currency_parser = CurrencyExchanger(snapshot=rates_snapshots.load())
+# rates are updated off the schedule thread, see start_update_rates()
+rates_updater = futures.ThreadPoolExecutor(max_workers=1)
+rates_update_lock = threading.Lock()  # held while rates are updating
+
+sessions_cache = SessionCache()
+User.add_change_callback(sessions_cache.on_user_change)
+
+# updates of different chats are handled in parallel, see UpdateDispatcher
+updates_dispatcher = UpdateDispatcher(bot.process_new_updates)
+
+###############################################################################
+
+
+def get_experts_prediction_message(
+        prediction:Prediction, usr:User, has_notifications:bool
+        ) -> dict:
+    if not has_notifications:
+        return {
+            'text': _(
+                "❗ Your limit on receiving predictions has"
+                " expired, contact our support team ❗",
+                usr.language
+            )
+        }
+    return {
+        'text': _(
+            '*⚜ Experts prediction ⚜*\n*Currencies: {}-{}*\n'
+            '*Up to:* {}\n*Predicted value:* {}',
+            usr.language
+        ).format(
+            prediction.iso_from, prediction.iso_to,
+            convert_to_country_format(
+                adapt_datetime(prediction.up_to_date, usr.timezone),
+                usr.language
+            ),
+            prettify_float(prediction.value)
+        ),
+        'parse_mode': 'Markdown'
+    }
+
 
-USERS_SESSIONS = {}
+predictions_broadcaster = PredictionsBroadcaster(
+    send_queue, send_message, get_experts_prediction_message
+)
 
 ###############################################################################
 
 
 def get_or_create_session(chat_id):
-    global USERS_SESSIONS
-    try:
-        session = USERS_SESSIONS.get(chat_id)
-        if not session:
-            session = Session(chat_id)
-            settings.logger.debug(f"{session.user} logged in")
-        USERS_SESSIONS[chat_id] = session
-    except MemoryError:
-        for i in range(50):
-            USERS_SESSIONS.popitem()
-        return get_or_create_session(chat_id)
-    else:
-        return USERS_SESSIONS[chat_id]
+    if (session := sessions_cache.get(chat_id)) is None:
+        session = Session.load_or_create(chat_id)
+        sessions_cache.set(chat_id, session)
+        settings.logger.debug(f"{session.user} logged in")
+    return session
 
 
 # Used not to initialize the user every time, just save their state
@@ -360,49 +413,13 @@ def make_user_currency_prediction(msg):
                 msg_inner, confirm_prediction, buttons
             )
 
-    def resend_prediction_all_users(prediction):
-        for usr in User.get_all_users(if_all=False):
-            if usr.to_notify_by_experts:
-                if Session.db.fetch_count(usr.id) > 0:
-                    bot.send_message(
-                        usr.id,
-                        _(
-                            '*⚜ Experts prediction ⚜*\n*Currencies: {}-{}*\n'
-                            '*Up to:* {}\n*Predicted value:* {}',
-                            usr.language
-                        ).format(
-                            prediction.iso_from, prediction.iso_to,
-                            convert_to_country_format(
-                                adapt_datetime(
-                                    prediction.up_to_date, usr.timezone
-                                ),
-                                usr.language
-                            ),
-                            prettify_float(prediction.value)
-                        ),
-                        parse_mode='Markdown'
-                    )
-                    Session.db.decrease_count(usr.id)
-                else:
-                    bot.send_message(
-                        usr.id,
-                        _(
-                            "❗ Your limit on receiving predictions has"
-                            " expired, contact our support team ❗",
-                            usr.language
-                        )
-                    )
-
     def confirm_prediction(msg_inner, buttons):
         if msg_inner.text == buttons[0]:
             user.create_prediction(
                 iso_from, iso_to, prettify_float(value), date
             )
             if user.is_staff:
-                threading.Thread(
-                    target=resend_prediction_all_users,
-                    args=(user.predictions[-1],), daemon=True
-                ).start()
+                predictions_broadcaster.start(user.predictions[-1].id)
             bot.send_message(
                 msg_inner.chat.id, 
                 _('The forecast has been created!', user.language)
@@ -446,7 +463,7 @@ def see_users_currency_predictions(msg):
 
     def see_self_predictions(msg_inner):
         preds = {
-            x.trepr(user): f'get_prediction_{x.id}' 
+            x.trepr(user): bot.callback_data('pred', x.id)
             for x in user.get_predictions()
         }
         kb_inline = inline_kbs(preds, row_width=1)
@@ -519,13 +536,13 @@ def see_users_currency_predictions(msg):
             closest = rand_pred.get_closest_neighbours()
             previous, nxt = closest['previous'], closest['next']
             inline_buttons = {
-                '👍': f'like_prediction_{rand_pred.id}',
-                '👎': f'dislike_prediction_{rand_pred.id}'
+                '👍': bot.callback_data('like', rand_pred.id),
+                '👎': bot.callback_data('dislike', rand_pred.id)
             }
             if previous:
-                inline_buttons['<<'] = f'previous_prediction_to_{rand_pred.id}'
+                inline_buttons['<<'] = bot.callback_data('prev', rand_pred.id)
             if nxt:
-                inline_buttons['>>'] = f'next_prediction_to_{rand_pred.id}'
+                inline_buttons['>>'] = bot.callback_data('next', rand_pred.id)
             inline_kb = inline_kbs(inline_buttons, row_width=2)
             bot.send_message(
                 msg_inner.chat.id,
@@ -564,26 +581,29 @@ def get_prediction_inline_kb_for_liking(pred):
     closest = pred.get_closest_neighbours()
     previous, nxt = closest['previous'], closest['next']
     inline_buttons = {
-        '👍': f'like_prediction_{pred.id}',
-        '👎': f'dislike_prediction_{pred.id}'
+        '👍': bot.callback_data('like', pred.id),
+        '👎': bot.callback_data('dislike', pred.id)
     }
     if previous:
-        inline_buttons['<<'] = f'previous_prediction_to_{pred.id}'
+        inline_buttons['<<'] = bot.callback_data('prev', pred.id)
     if nxt:
-        inline_buttons['>>'] = f'next_prediction_to_{pred.id}'
+        inline_buttons['>>'] = bot.callback_data('next', pred.id)
     inline_kb = inline_kbs(inline_buttons, row_width=2)
     return inline_kb
 
 
-@bot.callback_query_handler(
-    lambda call: (
-        'next_prediction_to_' in call.data or 
-        'previous_prediction_to_' in call.data
-    )
-)
-def get_closest_prediction(call):
-    action, *data, pred_id = call.data.split('_')
-    start_pred = Prediction(int(pred_id))
+@bot.callback_route('next', int, aliases=('next_prediction_to',))
+def get_next_prediction(call, pred_id:int):
+    return get_closest_prediction(call, pred_id, 'next')
+
+
+@bot.callback_route('prev', int, aliases=('previous_prediction_to',))
+def get_previous_prediction(call, pred_id:int):
+    return get_closest_prediction(call, pred_id, 'previous')
+
+
+def get_closest_prediction(call, pred_id:int, action:str):
+    start_pred = Prediction(pred_id)
     following_pred = start_pred.get_closest_neighbours()[action]
     user = bot.session.user
     inline_kb = get_prediction_inline_kb_for_liking(following_pred)
@@ -595,14 +615,18 @@ def get_closest_prediction(call):
     )
 
 
-@bot.callback_query_handler(
-    lambda call: (
-        'like_prediction_' in call.data or 'dislike_prediction_' in call.data
-    )
-)
-def toggle_user_reaction(call):
-    action, *some_data, pred_id = call.data.split('_')
-    prediction = Prediction(int(pred_id))
+@bot.callback_route('like', int, aliases=('like_prediction',))
+def like_prediction(call, pred_id:int):
+    return toggle_user_reaction(call, pred_id, 'like')
+
+
+@bot.callback_route('dislike', int, aliases=('dislike_prediction',))
+def dislike_prediction(call, pred_id:int):
+    return toggle_user_reaction(call, pred_id, 'dislike')
+
+
+def toggle_user_reaction(call, pred_id:int, action:str):
+    prediction = Prediction(pred_id)
     user = bot.session.user
     reaction = True if action == 'like' else False
     prediction.toggle_like(call.message.chat.id, reaction)
@@ -619,9 +643,8 @@ def toggle_user_reaction(call):
     )
 
 
-@bot.callback_query_handler(lambda call: 'get_prediction_' in call.data)
-def get_prediction_details(call):
-    pred_id = int(call.data.split('_')[-1])
+@bot.callback_route('pred', int, aliases=('get_prediction',))
+def get_prediction_details(call, pred_id:int):
     pred = Prediction(pred_id)
     user = bot.session.user
     bot.edit_message_text(
@@ -629,15 +652,14 @@ def get_prediction_details(call):
         message_id=call.message.message_id,
         text=_(pred.tstr(user), user.language),
         reply_markup=inline_kbs({
-            _('Delete', user.language): f'ask_delete_prediction_{pred_id}',
-            _('Back', user.language): f'get_user_predictions_{pred.user_id}'
+            _('Delete', user.language): bot.callback_data('ask_del', pred_id),
+            _('Back', user.language): bot.callback_data('preds', pred.user_id)
         }, row_width=1)
     )
 
 
-@bot.callback_query_handler(lambda call: 'ask_delete_prediction_' in call.data)
-def ask_delete_prediction(call):
-    pred_id = int(call.data.split('_')[-1])
+@bot.callback_route('ask_del', int, aliases=('ask_delete_prediction',))
+def ask_delete_prediction(call, pred_id:int):
     pred = Prediction(pred_id)
     user = bot.session.user
     if pred.is_actual:
@@ -649,8 +671,10 @@ def ask_delete_prediction(call):
                 user.language
             ).format(pred.trepr(user)),
             reply_markup=inline_kbs({
-                _('Yes', user.language): f'delete_prediction_{pred_id}',
-                _('No', user.language): f'get_user_predictions_{pred.user_id}'
+                _('Yes', user.language): bot.callback_data('del', pred_id),
+                _('No', user.language): bot.callback_data(
+                    'preds', pred.user_id
+                )
             })
         )
     else:
@@ -659,16 +683,15 @@ def ask_delete_prediction(call):
             message_id=call.message.message_id,
             text=_('You cannot delete a verified prediction!', user.language),
             reply_markup=inline_kbs({
-                _(
-                    'Back', user.language
-                ): f'get_user_predictions_{pred.user_id}'
+                _('Back', user.language): bot.callback_data(
+                    'preds', pred.user_id
+                )
             })
         )
 
 
-@bot.callback_query_handler(lambda call: 'delete_prediction_' in call.data)
-def delete_prediction(call):
-    pred_id = int(call.data.split('_')[-1])
+@bot.callback_route('del', int, aliases=('delete_prediction',))
+def delete_prediction(call, pred_id:int):
     prediction = Prediction(pred_id)
     user = bot.session.user
     bot.delete_message(call.message.chat.id, call.message.message_id)
@@ -689,11 +712,11 @@ def delete_prediction(call):
     )
 
 
-@bot.callback_query_handler(lambda call: 'get_user_predictions_' in call.data)
-def get_user_predictions(call):
+@bot.callback_route('preds', int, aliases=('get_user_predictions',))
+def get_user_predictions(call, user_id:int):
     user = bot.session.user
     kb_inline = inline_kbs({
-        x.trepr(user): f'get_prediction_{x.id}'
+        x.trepr(user): bot.callback_data('pred', x.id)
         for x in user.get_predictions()
     }, row_width=1)
     return bot.edit_message_text(
@@ -744,7 +767,7 @@ def convert_currency(msg):
         else:
             markup = inline_kbs(
                 {
-                    i: f"change_currency_converter_amount_to_{i}"
+                    i: bot.callback_data('amount', i)
                     for i in settings.CURRENCY_RATES_CHANGE_AMOUNTS
                 }
             )
@@ -775,17 +798,15 @@ def convert_currency(msg):
     bot.register_next_step_handler(msg, get_isos)
 
 
-@bot.callback_query_handler(
-    lambda call: 'change_currency_converter_amount_to_' in call.data
+@bot.callback_route(
+    'amount', str, aliases=('change_currency_converter_amount_to',)
 )
-def get_callback_for_change_currency_converter_amount(call):
+def get_callback_for_change_currency_converter_amount(call, command:str):
     user = bot.session.user
 
-    def change_currency_converter_amount(call_inner):
+    def change_currency_converter_amount(call_inner, change_amount:float):
         try:
             if call_inner.message:
-                change_amount = call_inner.data.split('_')[-1]
-                change_amount = float(change_amount)
                 iso_from, iso_to = [
                     x.split()
                     for x in call_inner.message.text.split(':')[-1].split('-')
@@ -796,7 +817,7 @@ def get_callback_for_change_currency_converter_amount(call):
                 new_amount = rate * change_amount
                 markup = inline_kbs(
                     {
-                        i: f"change_currency_converter_amount_to_{i}"
+                        i: bot.callback_data('amount', i)
                         for i in settings.CURRENCY_RATES_CHANGE_AMOUNTS
                     }
                 )
@@ -850,7 +871,6 @@ def get_callback_for_change_currency_converter_amount(call):
             to_delete = list(to_delete) + [msg, warning_msg]
             bot.register_next_step_handler(msg, ask_sum, call_inner, to_delete)
         else:
-            call_inner.data = f"change_currency_converter_amount_to_{value}"
             try:
                 # delete messages
                 for msg_ in to_delete:
@@ -859,14 +879,12 @@ def get_callback_for_change_currency_converter_amount(call):
             except Exception as e:
                 # permission to delete messages was not received
                 print(repr(e))
-            return change_currency_converter_amount(call_inner)
+            return change_currency_converter_amount(call_inner, value)
 
     def set_amount_to_1(call_inner):
-        call_inner.data = f"change_currency_converter_amount_to_{1}"
-        return change_currency_converter_amount(call_inner)
+        return change_currency_converter_amount(call_inner, 1.0)
 
     if call.message:
-        command = call.data.split('_')[-1]
         if command == '...':
             # bot.clear_step_handler(call.message)
             msg_to_delete = bot.send_message(
@@ -1593,7 +1611,7 @@ def send_techsupport_message(msg):
                 {
                     _(
                         'Send message to Techsupport', user.language
-                    ): 'send_message_to_techsupport'
+                    ): bot.callback_data('support')
                 }
             )
         )
@@ -1605,9 +1623,7 @@ def send_techsupport_message(msg):
     return start_bot(msg)
 
 
-@bot.callback_query_handler(
-    lambda call: call.data == 'send_message_to_techsupport'
-)
+@bot.callback_route('support', aliases=('send_message_to_techsupport',))
 def send_message_to_techsupport(call):
     def send_message(msg):
         answer_msg = ''
@@ -1666,111 +1682,209 @@ def send_bot_help(msg):
 
 
 @schedule.repeat(schedule.every(3).minutes)
+def start_update_rates():
+    # the update can take over a minute, so it would make the schedule 
+    # thread skip minutes of alarms, the tick is skipped if it still runs
+    if not rates_update_lock.acquire(blocking=False):
+        settings.logger.warning("Rates are still updating, tick is skipped")
+        return
+    rates_updater.submit(update_rates).add_done_callback(
+        lambda future: rates_update_lock.release()
+    )
+
+
+@settings.logger.catch_error
 def update_rates():
-    for parser in currency_parser.parsers.values():
-        if not parser.update_value(safe=True):
-            settings.logger.error(f"Rate {parser.iso}-USD can not be updated")
-    settings.logger.debug("Rates updated")
+    report = currency_parser.refresh_rates()
+    try:
+        currency_parser.refresh_vector()
+    except exceptions.ParsingError:
+        settings.logger.error("Rates vector can not be updated")
+    snapshot = currency_parser.get_snapshot()
+    rates_snapshots.save(snapshot)
+    rates_history.add(snapshot)
+    for iso, res in report.items():
+        if res['status'] != 'ok':
+            settings.logger.error(
+                f"Rate {iso}-USD can not be updated: {res['status']}"
+            )
+    settings.logger.debug(
+        "Rates updated in {:.2f}s ({}), cache: {}".format(
+            max(res['elapsed'] for res in report.values()),
+            ', '.join(
+                "{}: {:.2f}s".format(iso, res['elapsed']) 
+                for iso, res in report.items()
+            ),
+            currency_parser.cache.stats
+        )
+    )
+
+
+@schedule.repeat(schedule.every(10).minutes)
+def log_stats():
+    settings.logger.debug(f"Send queue: {send_queue.stats}")
+    settings.logger.debug(f"Sessions cache: {sessions_cache.stats}")
+    settings.logger.debug(f"Updates dispatcher: {updates_dispatcher.stats}")
+    settings.logger.debug(f"Handlers: {bot.handlers_stats}")
 
 
 @schedule.repeat(schedule.every(10).minutes)
 def update_proxies():
-    proxies = get_proxy_list()
-    for parser in currency_parser.parsers.values():
-        parser.proxy_list = proxies
-    settings.logger.debug(f"Proxies updated, length: {len(proxies)}")
+    currency_parser.proxy_health.set_proxies(get_proxy_list())
+    settings.logger.debug(
+        f"Proxies updated: {currency_parser.proxy_health.stats}"
+    )
 
 
 @schedule.repeat(schedule.every(3).minutes)
 @settings.logger.catch_error
 def check_premium_ended():
-    def check_user_premium_ended(usr):
-        if not check_datetime_in_future(usr.is_pro):
-            bot.send_message(
-                usr.id,
-                _(
-                    'Your premium has expired, but you can always refresh it!',
-                    usr.language
-                )
+    for user in User.get_expired_pro_users():
+        user.delete_premium()
+        send_queue.submit(
+            send_message,
+            user.id,
+            _(
+                'Your premium has expired, but you can always refresh it!',
+                user.language
             )
-            usr.delete_premium()
-            settings.logger.info(f"{usr} lost premium")
-
-    with futures.ThreadPoolExecutor(max_workers=50) as executor:
-        for user in User.get_pro_users(only_temp=True):
-            executor.submit(check_user_premium_ended, user)
+        )
+        settings.logger.info(f"{user} lost premium")
 
 
 @schedule.repeat(schedule.every().minutes.at(':00'))
 @settings.logger.catch_error
 def verify_predictions():
-    for pred in Prediction.get_unverified_predictions():
-        user = User(pred.user_id)
-        try:
-            pred_res = currency_parser.get_rate(pred.iso_from, pred.iso_to)
-        except exceptions.ParserError:
-            settings.logger.error(
-                f"Rate {pred.iso_from}-{pred.iso_to} is unreachable"
-            )
-            user.create_prediction(
-                pred.iso_from,
-                pred.iso_to,
-                pred.value,
-                pred.up_to_date + datetime.timedelta(0, 5*60)  # 5 minutes
-            )
-            bot.send_messsage(
-                pred.user_id,
-                _(
-                    "The rates are unreachable, "
-                    "the prediction `{}` was scheduled for 5 minutes later",
-                    user.language
-                ).format(pred.trepr(user))
-            )
-            pred.delete(force=True)
-        else:
-            pred.update(real_value=pred_res.get(pred.iso_to))
-            diff = currency_parser.calculate_difference(
-                old=pred.value, new=pred.real_value
-            )
-            bot.send_message(
-                pred.user_id,
-                _(
-                    'Results of `{}`:\n*Predicted value:* {}\n'
-                    '*Real value:* {}\n*Percentage difference:* {}',
-                    user.language
-                ).format(
-                    pred.trepr(user),
-                    prettify_float(pred.value),
-                    prettify_float(pred.real_value),
-                    prettify_percent(
-                        diff.get('percentage_difference'), to_sign=True
-                    )
-                ),
-                parse_mode='Markdown'
-            )
-        settings.logger.debug(f"{str(pred)} verified")
+    preds = list(Prediction.get_unverified_predictions())
+    if not preds:
+        return
+    users = {user.id: user for user in User.get_unverified_predictions_users()}
+    pairs = {}
+    for pred in preds:
+        pairs.setdefault((pred.iso_from, pred.iso_to), []).append(pred)
+    with futures.ThreadPoolExecutor(
+            max_workers=min(len(pairs), settings.PARSERS_MAX_WORKERS)
+            ) as executor:
+        # one rate resolution per pair of currencies
+        real_values = dict(zip(pairs, executor.map(
+            get_predictions_real_values, pairs.keys(), pairs.values()
+        )))
+    verified, delayed = {}, {}
+    for pair, pair_preds in pairs.items():
+        for pred in pair_preds:
+            if (real_value := real_values[pair].get(pred.up_to_date)) is None:
+                delayed[pred] = max(
+                    pred.up_to_date, get_now()
+                ) + datetime.timedelta(0, 5*60)  # 5 minutes
+            else:
+                verified[pred] = real_value
+    Prediction.update_many(verified, 'real_value')
+    Prediction.update_many(delayed, 'up_to_date')
+    for pred in delayed:
+        user = users.get(pred.user_id) or User(pred.user_id)
+        send_queue.submit(
+            send_message,
+            pred.user_id,
+            _(
+                "The rates are unreachable, "
+                "the prediction `{}` was scheduled for 5 minutes later",
+                user.language
+            ).format(pred.trepr(user)),
+            parse_mode='Markdown'
+        )
+    for pred in verified:
+        user = users.get(pred.user_id) or User(pred.user_id)
+        diff = currency_parser.calculate_difference(
+            old=pred.value, new=pred.real_value
+        )
+        send_queue.submit(
+            send_message,
+            pred.user_id,
+            _(
+                'Results of `{}`:\n*Predicted value:* {}\n'
+                '*Real value:* {}\n*Percentage difference:* {}',
+                user.language
+            ).format(
+                pred.trepr(user),
+                prettify_float(pred.value),
+                prettify_float(pred.real_value),
+                prettify_percent(
+                    diff.get('percentage_difference'), to_sign=True
+                )
+            ),
+            parse_mode='Markdown'
+        )
+    settings.logger.debug(
+        f"{len(verified)} predictions verified, {len(delayed)} delayed"
+    )
+
+
+def get_predictions_real_values(pair:tuple, preds:list) -> dict:
+    """
+    Get real values of predictions of the pair of currencies, from rates 
+    history at `up_to_date` or the latest rate if it was not saved
+
+    :arguments:
+        pair(tuple[str, str]): iso_from, iso_to
+        preds(list[Prediction]): predictions of the pair
+    :return:
+        real_values(dict[datetime.datetime, float | None]): 
+            up_to_date: real value, None if the rate is unreachable
+    """
+    iso_from, iso_to = pair
+    real_values, latest = {}, None
+    for up_to_date in {pred.up_to_date for pred in preds}:
+        res = rates_history.get_rate(
+            iso_from, iso_to, 
+            up_to_date.replace(tzinfo=datetime.timezone.utc).timestamp()
+        )
+        if res is None and latest is None:
+            try:
+                latest = currency_parser.get_rate(
+                    iso_from, iso_to, max_staleness=settings.RATES_CACHE_TTL
+                )
+            except (
+                    exceptions.ParsingError, 
+                    exceptions.CurrencyDoesNotExistError
+                    ):
+                settings.logger.error(
+                    f"Rate {iso_from}-{iso_to} is unreachable"
+                )
+                latest = {}
+        real_values[up_to_date] = (res or latest).get(iso_to)
+    return real_values
 
 
 @schedule.repeat(schedule.every().minutes.at(':00'))
 @settings.logger.catch_error
 def start_alarms():
     t = get_now().strftime('%H:%M')
+    users = list(User.get_users_by_check_time(t))
+    # fetch every needed rate once per tick, not once per user
+    rates = currency_parser.get_rates(
+        iso for user in users for iso in user.get_currencies_by_check_time(t)
+    )
     with futures.ThreadPoolExecutor(max_workers=50) as executor:
-        for user in User.get_users_by_check_time(t):
-            executor.submit(send_alarm, user, t)
+        for user in users:
+            executor.submit(send_alarm, user, t, rates)
 
 
 @settings.logger.catch_error
-def send_alarm(user, t):
+def send_alarm(user, t, rates):
+    def check_alarm_sent(future):
+        if isinstance(
+                future.exception(), telebot.apihelper.ApiTelegramException
+                ):
+            # from traceback: "Bad Request: chat not found"
+            user.update(is_active=0)
+            settings.logger.warning(f"{str(user)} is not reachable")
+            # not to notify anymore, since chat is not reachable
+
     for k, v in user.get_currencies_by_check_time(t).items():
-        try:
-            rate = currency_parser.check_delta(
-                k, 'USD',
-                v.get('value'), v.get('percent_delta')
-            )
-        except exceptions.ParsingError:
+        if k not in rates:
             settings.logger.error(f"Rate {k}-USD is unreachable")
-            bot.send_message(
+            send_queue.submit(
+                send_message,
                 user.id,
                 _(
                     "The rates are not available, "
@@ -1779,38 +1893,42 @@ def send_alarm(user, t):
                 )
             )
         else:
+            rate = currency_parser.check_delta(
+                k, 'USD',
+                v.get('value'), v.get('percent_delta'), new=rates[k]
+            )
             if rate.get('new', None) is not None:  # WARNING: CAN BE DELETED
                 new, old = rate.get('new'), rate.get('old')
                 user.update_rates(k, value=new)
-                try:
-                    bot.send_message(
-                        user.id,
-                        _(
-                            '*Notification*\n*{}* = *{} USD*\n'
-                            'The change: *{:+} ({})*\n'
-                            'Previous: *{} = {} USD *',
-                            user.language
-                        ).format(
-                            k,
-                            prettify_float(new),
-                            prettify_float(rate.get('difference')),
-                            prettify_percent(
-                                rate.get('percentage_difference'), 
-                                to_sign=True
-                            ),
-                            k,
-                            prettify_float(old)
+                send_queue.submit(
+                    send_message,
+                    user.id,
+                    _(
+                        '*Notification*\n*{}* = *{} USD*\n'
+                        'The change: *{:+} ({})*\n'
+                        'Previous: *{} = {} USD *',
+                        user.language
+                    ).format(
+                        k,
+                        prettify_float(new),
+                        prettify_float(rate.get('difference')),
+                        prettify_percent(
+                            rate.get('percentage_difference'), 
+                            to_sign=True
                         ),
-                        parse_mode='Markdown'
-                    )
-                    settings.logger.debug(
-                        f"Sent '{k}-USD' alarm for {str(user)}"
-                    )
-                except telebot.apihelper.ApiTelegramException:
-                    # from traceback: "Bad Request: chat not found"
-                    user.update(is_active=0)
-                    settings.logger.warning(f"{str(user)} is not reachable")
-                    # not to notify anymore, since chat is not reachable
+                        k,
+                        prettify_float(old)
+                    ),
+                    parse_mode='Markdown'
+                ).add_done_callback(check_alarm_sent)
+                settings.logger.debug(
+                    f"Queued '{k}-USD' alarm for {str(user)}"
+                )
+
+
+def start_background_tasks():
+    currency_parser.start_warm_up()
+    predictions_broadcaster.resume()
 
 
 def schedule_thread():
@@ -1824,8 +1942,11 @@ def main():
     telebot.logger.setLevel(logging.DEBUG)
     settings.logger.set_level('debug')
     settings.logger.info("Bot started")
+    start_background_tasks()
     threading.Thread(target=schedule_thread, daemon=True).start()
-    bot.polling()
+    # getUpdates fails while a webhook is set
+    bot.remove_webhook()
+    updates_dispatcher.poll(bot.get_updates, skip_pending=bot.skip_pending)
     settings.logger.info("Bot stopped")
 
 
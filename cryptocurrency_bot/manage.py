@@ -23,13 +23,26 @@ def is_valid_file(parser, arg, *, ext:str=None, check_exists:bool=True):
         return arg
 
 
-def runbot(level:str):
+def runbot(
+        level:str, mode:str='polling', *, url:str=None, 
+        host:str=settings.WEBHOOK_HOST, port:int=settings.WEBHOOK_PORT
+        ):
     import main_bot
-    targets = [
-        main_bot.schedule_thread,
-        main_bot.bot.infinity_polling,
-    ]
+    from models.webhook import WebhookServer
+    targets = [main_bot.schedule_thread]
     settings.logger.set_level(level)
+    if mode == 'webhook':
+        server = WebhookServer(
+            main_bot.updates_dispatcher, host=host, port=port
+        )
+        server.set_webhook(main_bot.bot.token, url)
+        targets.append(server.serve_forever)
+    else:
+        main_bot.bot.remove_webhook()
+        targets.append(lambda: main_bot.updates_dispatcher.poll(
+            main_bot.bot.get_updates, skip_pending=main_bot.bot.skip_pending
+        ))
+    main_bot.start_background_tasks()
     for target in targets:
         threading.Thread(
             target=infinite_loop, args=(target,), daemon=True
@@ -143,7 +156,10 @@ def load_db_dump(dump_filename:str, db_filename:str):
 
 if __name__ == '__main__':
     commands = {
-        'run': lambda namespace: runbot(namespace.level),
+        'run': lambda namespace: runbot(
+            namespace.level, namespace.mode, url=namespace.url, 
+            host=namespace.host, port=namespace.port
+        ),
         'check-subscribed': lambda namespace: check_subscribed(namespace.ids),
         'give-staff': lambda namespace: give_staff(namespace.ids),
         'remove-staff': lambda namespace: remove_staff(namespace.ids),
@@ -168,6 +184,22 @@ if __name__ == '__main__':
         "-l", "--level", default="info", 
         help="set logger level", type=str, choices=list(Logger.LOG_LEVELS)
     )
+    parser_run.add_argument(
+        "-m", "--mode", default="polling", type=str,
+        help="how to receive updates", choices=['polling', 'webhook']
+    )
+    parser_run.add_argument(
+        "--url", default=settings.WEBHOOK_URL, type=str,
+        help="public HTTPS url of webhook server"
+    )
+    parser_run.add_argument(
+        "--host", default=settings.WEBHOOK_HOST, type=str,
+        help="address of webhook server"
+    )
+    parser_run.add_argument(
+        "--port", default=settings.WEBHOOK_PORT, type=int,
+        help="port of webhook server"
+    )
     parser_subscribed = subparsers.add_parser(
         'check-subscribed', help="check whether user(s) are subscribed"
     )
@@ -228,6 +260,11 @@ if __name__ == '__main__':
         )
     )
     namespace = parser.parse_args()
+    if (
+            namespace.command == 'run' and namespace.mode == 'webhook' 
+            and not namespace.url
+            ):
+        parser_run.error("--url is required in webhook mode")
     if len(namespace.__dict__) > 1:
         commands[namespace.command](namespace)
     else:
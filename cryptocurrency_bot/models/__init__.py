@@ -1,3 +1,9 @@
-from . import db, parsers, user, logger
+from . import (
+    db, extractors, parsers, send_queue, user, broadcast, dispatcher,
+    webhook, logger
+)
 
-__all__ = ['db', 'parsers', 'user', 'logger']
+__all__ = [
+    'db', 'extractors', 'parsers', 'send_queue', 'user', 'broadcast',
+    'dispatcher', 'webhook', 'logger'
+]
@@ -0,0 +1,120 @@
+from concurrent import futures
+import threading
+
+from configs import settings
+from utils.dt import get_now
+from . import exceptions
+from .db import BroadcastDBHandler
+from .send_queue import SendQueue
+from .user import User, Prediction
+
+
+__all__ = ['PredictionsBroadcaster']
+
+
+
+class PredictionsBroadcaster(object):
+    """
+    Sender of experts' predictions to all users, who are notified by
+    experts. Users are processed in batches in order of id,
+    after every batch the progress is saved to the database,
+    so unfinished broadcasts are resumed after restart
+
+    :attributes:
+        send_queue(SendQueue): queue through which messages are sent
+        send(Callable): function sending to the chat, like bot.send_message
+        get_message(Callable[[Prediction, User, bool], dict]):
+            keyword arguments of `send` for the user,
+            the bool is does user have free notifications left
+        db(BroadcastDBHandler): handler of the database
+        batch_size(int)=settings.BROADCAST_BATCH_SIZE: users in a batch
+    """
+
+    def __init__(
+            self, send_queue:SendQueue, send, get_message, *,
+            db_name:str=None, batch_size:int=settings.BROADCAST_BATCH_SIZE
+            ):
+        self.send_queue = send_queue
+        self.send = send
+        self.get_message = get_message
+        self.db = BroadcastDBHandler(db_name)
+        self.batch_size = batch_size
+
+    def start(self, pred_id:int) -> threading.Thread:
+        """
+        Start broadcast of the prediction in background
+
+        :arguments:
+            pred_id(int): id of the prediction to send
+        :return:
+            thread(threading.Thread): started thread
+        """
+        broadcast_id = self.db.add_broadcast(pred_id, get_now())
+        return self.run_in_background(self.db.get_broadcast(broadcast_id))
+
+    def resume(self) -> list:
+        """
+        Resume unfinished broadcasts in background
+
+        :return:
+            threads(list[threading.Thread]): started threads
+        """
+        return [
+            self.run_in_background(broadcast)
+            for broadcast in self.db.get_unfinished_broadcasts()
+        ]
+
+    def run_in_background(self, broadcast:dict) -> threading.Thread:
+        thread = threading.Thread(
+            target=settings.logger.catch_error(self.run),
+            args=(broadcast,), daemon=True
+        )
+        thread.start()
+        return thread
+
+    def run(self, broadcast:dict) -> int:
+        """
+        Send the prediction of broadcast to users after the last one
+
+        :arguments:
+            broadcast(dict): broadcast's data
+        :return:
+            sent_count(int): how many users got the prediction
+        """
+        try:
+            prediction = Prediction(broadcast['pred_id'])
+        except exceptions.PredictionDoesNotExistError:
+            prediction = None
+        last_user_id, sent_count = broadcast['last_user_id'], 0
+        while prediction is not None and (
+                users_data := self.db.get_recipients(
+                    last_user_id, self.batch_size
+                )
+                ):
+            tasks = {}
+            for user_data in users_data:
+                user = User.from_dict(user_data)
+                has_notifications = bool(
+                    user_data['is_pro']
+                    or user_data['free_notifications_count'] > 0
+                )
+                task = self.send_queue.submit(
+                    self.send, user.id,
+                    priority=SendQueue.BROADCAST,
+                    **self.get_message(prediction, user, has_notifications)
+                )
+                tasks[task] = user.id if has_notifications else None
+            futures.wait(tasks)
+            sent_ids = [
+                user_id for task, user_id in tasks.items()
+                if user_id is not None and task.exception() is None
+            ]
+            last_user_id = users_data[-1]['id']
+            self.db.checkpoint(broadcast['id'], last_user_id, sent_ids)
+            sent_count += len(sent_ids)
+        self.db.finish_broadcast(broadcast['id'], get_now())
+        settings.logger.info(
+            f"Broadcast {broadcast['id']} of prediction "
+            f"{broadcast['pred_id']} finished"
+        )
+        return sent_count
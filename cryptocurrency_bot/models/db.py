@@ -1,4 +1,6 @@
 import abc
+import contextlib
+import queue
 import sqlite3
 from datetime import datetime
 import threading
@@ -26,9 +28,156 @@ sqlite3.register_converter(
 )
 
 
+class ConnectionPool(object):
+    """
+    A bounded pool of SQLite connections to one database file.
+    Every handler of the same database shares one pool (see `get_pool`)
+
+    :attributes:
+        db_name(str): database filename
+        size(int)=settings.DB_POOL_SIZE: max number of open connections
+        timeout(float)=settings.DB_TIMEOUT: seconds to wait for a free 
+            connection or for a locked database
+        write_lock(threading.RLock): serializes all writing statements
+        executed_count(int): how many statements were executed
+        local(threading.local): per thread state,
+            `conn` is the connection of the thread's open transaction,
+            `depth` is the number of its nested transactions
+    """
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(
+            self, db_name:str, size:int=settings.DB_POOL_SIZE, 
+            timeout:float=settings.DB_TIMEOUT
+            ):
+        assert size > 0, 'pool size must be positive'
+        self.db_name = db_name
+        self.size = size
+        self.timeout = timeout
+        self.write_lock = threading.RLock()
+        self.executed_count = 0
+        self.local = threading.local()
+        self._idle = queue.LifoQueue()
+        self._opened_count = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls, db_name:str) -> 'ConnectionPool':
+        """
+        Get the pool of database, create it if it does not exist
+        type: classmethod
+
+        :arguments:
+            db_name(str): database filename
+        :return:
+            pool(ConnectionPool)
+        """
+        with cls._pools_lock:
+            if db_name not in cls._pools:
+                cls._pools[db_name] = cls(db_name)
+            return cls._pools[db_name]
+
+    def count_executed(self) -> None:
+        """
+        Increase `executed_count` by 1, it is called from many threads
+
+        :return: None
+        """
+        with self._lock:
+            self.executed_count += 1
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open a new connection to the database
+
+        :return:
+            connection(sqlite3.Connection)
+        """
+        conn = sqlite3.connect(
+            self.db_name, detect_types=sqlite3.PARSE_DECLTYPES,
+            timeout=self.timeout, check_same_thread=False
+        )
+        conn.row_factory = DBHandlerBase.dict_factory
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Check out a connection, open a new one if the pool is not full
+
+        :raise:
+            sqlite3.OperationalError: if no connection was freed in `timeout`
+        :return:
+            connection(sqlite3.Connection)
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_open = self._opened_count < self.size
+            if can_open:
+                self._opened_count += 1
+        if can_open:
+            try:
+                return self.connect()
+            except Exception:
+                with self._lock:
+                    self._opened_count -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"no free connection to {self.db_name} in {self.timeout}s"
+            ) from None
+
+    def release(self, conn:sqlite3.Connection) -> None:
+        """
+        Return a connection to the pool
+
+        :arguments:
+            conn(sqlite3.Connection): connection got from `acquire`
+        :return: None
+        """
+        self._idle.put(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Check out a connection for the `with` block
+        type: contextmanager
+
+        :yield:
+            connection(sqlite3.Connection)
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        """
+        Close all idle connections
+        Checked out connections are closed by the threads which hold them
+
+        :return: None
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened_count -= 1
+
+
 class DBHandlerBase(abc.ABC):
     def __init__(self, db_name:str=None):
         self.DB_NAME = db_name or settings.DB_NAME
+        self.pool = ConnectionPool.get_pool(self.DB_NAME)
         self.setup_db()
 
     @staticmethod
@@ -40,15 +189,107 @@ class DBHandlerBase(abc.ABC):
         pass
 
     def execute(self, sql, params=tuple()):
-        with threading.Lock():
-            with sqlite3.connect(
-                        self.DB_NAME, detect_types=sqlite3.PARSE_DECLTYPES
-                    ) as conn:
-                conn.row_factory = self.dict_factory
+        if (conn := self.get_transaction_connection()) is not None:
+            self.pool.count_executed()
+            return conn.execute(sql, params).fetchall()
+        with self.pool.connection() as conn:
+            self.pool.count_executed()
+            if sql.lstrip().upper().startswith('SELECT'):
                 return conn.execute(sql, params).fetchall()
+            with self.pool.write_lock:
+                try:
+                    res = conn.execute(sql, params).fetchall()
+                except Exception:
+                    conn.rollback()
+                    raise
+                conn.commit()
+                return res
+
+    def executemany(self, sql, seq_of_params):
+        with self.transaction() as conn:
+            conn.executemany(sql, seq_of_params)
+
+    def get_transaction_connection(self):
+        """
+        Get the connection of the transaction opened in the current thread
+
+        :return:
+            connection(sqlite3.Connection | None): None if there is no one
+        """
+        return getattr(self.pool.local, 'conn', None)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Execute statements on the connection in one transaction, 
+        committed at exit or rolled back if an exception is raised.
+        `execute`, `executemany` and nested transactions of handlers 
+        of the same database in the thread join the transaction.
+        A nested transaction is a savepoint, so if its exception is caught, 
+        only its statements are rolled back
+
+        :yield:
+            connection(sqlite3.Connection)
+        """
+        if (conn := self.get_transaction_connection()) is not None:
+            self.pool.count_executed()
+            self.pool.local.depth += 1
+            savepoint = f'sp_{self.pool.local.depth}'
+            conn.execute(f'SAVEPOINT {savepoint}')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute(f'ROLLBACK TO {savepoint}')
+                raise
+            finally:
+                conn.execute(f'RELEASE {savepoint}')
+                self.pool.local.depth -= 1
+            return
+        with self.pool.connection() as conn, self.pool.write_lock:
+            self.pool.count_executed()
+            # begin explicitly, otherwise sqlite3 begins only before 
+            # a data-modifying statement and the first savepoint 
+            # would start its own transaction, committed at its release
+            conn.execute('BEGIN')
+            self.pool.local.conn = conn
+            self.pool.local.depth = 0
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                self.pool.local.conn = None
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Group calls of the handler's methods into one transaction,
+        which is committed at exit or rolled back if an exception is raised
+        Calls of other handlers of the same database are grouped too
 
+        usage:
+        with db.batch():
+            db.add_user(user_id)
+            db.add_user_rates(user_id, {'USD': 1})
 
-@private(['get', 'set'], 'execute')
+        :yield: None
+        """
+        with self.transaction():
+            yield
+
+    def close(self) -> None:
+        """
+        Close idle connections of the database (see ConnectionPool.close)
+
+        :return: None
+        """
+        self.pool.close()
+
+
+@private(['get', 'set'], 'execute', 'executemany', 'transaction')
 class DBHandler(DBHandlerBase):
     """
     DB Format:
@@ -65,9 +306,13 @@ class DBHandler(DBHandlerBase):
         iso: currency's iso-code
         value: A value from which to calculate difference
         percent_delta: A percent delta at which to notify
-        check_times: Times at which to check (in user's time zone)
         !!! Checking of rate is by `iso`-USD rate !!!
 
+    rate_check_times: times at which to check user rate
+        user_id: user's id in Telegram
+        iso: currency's iso-code of user rate
+        check_time: Time at which to check (in UTC, '%H:%M')
+
     currency_predictions: predict rate at some date
         id: just an id
         user_id: user's id in Telegram who made the prediction
@@ -84,6 +329,16 @@ class DBHandler(DBHandlerBase):
         reaction: like/dislike (1/0 respectively)
     """
 
+    USERS_RATES_TABLE = '''CREATE TABLE IF NOT EXISTS %s( 
+            user_id INTEGER NOT NULL,
+            iso VARCHAR(5),
+            value DOUBLE DEFAULT 0,
+            percent_delta REAL DEFAULT 1,
+            UNIQUE(user_id, iso) ON CONFLICT REPLACE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    '''  # % table name
+
     def setup_db(self):
         self.execute(
             '''CREATE TABLE IF NOT EXISTS users( 
@@ -106,17 +361,33 @@ class DBHandler(DBHandlerBase):
             '''
         )
         self.execute(
-            '''CREATE TABLE IF NOT EXISTS users_rates( 
+            # `is_pro` is FALSE, TRUE (infinite premium) or the datetime 
+            # as '%Y-%m-%d %H:%M:%S' blob, so datetimes are sorted in order
+            '''CREATE INDEX IF NOT EXISTS users_is_pro_idx ON users(is_pro)'''
+        )
+        self.execute(self.USERS_RATES_TABLE % 'users_rates')
+        self.execute(
+            '''CREATE TABLE IF NOT EXISTS rate_check_times(
                     user_id INTEGER NOT NULL,
                     iso VARCHAR(5),
-                    value DOUBLE DEFAULT 0,
-                    percent_delta REAL DEFAULT 1,
-                    check_times LIST,
-                    UNIQUE(user_id, iso) ON CONFLICT REPLACE,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                    check_time VARCHAR(5),
+                    FOREIGN KEY (user_id, iso) 
+                        REFERENCES users_rates(user_id, iso) ON DELETE CASCADE
                 )
             '''
         )
+        self.execute(
+            # covering index for looking up users by check time
+            '''CREATE INDEX IF NOT EXISTS rate_check_times_check_time_idx
+                ON rate_check_times(check_time, user_id, iso)
+            '''
+        )
+        self.execute(
+            '''CREATE INDEX IF NOT EXISTS rate_check_times_user_rate_idx
+                ON rate_check_times(user_id, iso)
+            '''
+        )
+        self.migrate_check_times()
         self.execute(
             '''CREATE TABLE IF NOT EXISTS currency_predictions(
                     id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
@@ -141,6 +412,48 @@ class DBHandler(DBHandlerBase):
             )
             '''
         )
+        # sessions are joined to users, see `select_users`
+        SessionDBHandler(self.DB_NAME)
+
+    def migrate_check_times(self):
+        """
+        Move check times from legacy `users_rates.check_times` LIST column
+        to `rate_check_times` table, drop the column, all in one transaction
+        The column is dropped by rebuilding the table, since 
+        `ALTER TABLE ... DROP COLUMN` needs SQLite 3.35+
+
+        :return:
+            success_status(bool): was the migration needed
+        """
+        with self.transaction():
+            columns = [
+                column['name'] 
+                for column in self.execute('PRAGMA table_info(users_rates)')
+            ]
+            if 'check_times' not in columns:
+                return False
+            # clear the rows of possibly interrupted migration
+            self.execute('DELETE FROM rate_check_times')
+            self.executemany(
+                'INSERT INTO rate_check_times VALUES (?, ?, ?)',
+                [
+                    (rate['user_id'], rate['iso'], check_time)
+                    for rate in self.execute(
+                        'SELECT user_id, iso, check_times FROM users_rates'
+                    )
+                    for check_time in (rate['check_times'] or [])
+                    if check_time
+                ]
+            )
+            self.execute('DROP TABLE IF EXISTS users_rates_new')
+            self.execute(self.USERS_RATES_TABLE % 'users_rates_new')
+            self.execute(
+                'INSERT INTO users_rates_new(user_id, iso, value, percent_delta) \
+                SELECT user_id, iso, value, percent_delta FROM users_rates'
+            )
+            self.execute('DROP TABLE users_rates')
+            self.execute('ALTER TABLE users_rates_new RENAME TO users_rates')
+        return True
 
     def add_user(
             self, user_id:int, is_active:bool=True, is_pro=False,
@@ -203,15 +516,67 @@ class DBHandler(DBHandlerBase):
             success_status(bool)=True
         """
         if self.check_user_exists(user_id):
-            self.execute(
-                "INSERT INTO users_rates VALUES (?, ?, ?, ?, ?)",
-                (user_id, iso, value, percent_delta, check_times)
-            )
+            with self.transaction():
+                self.execute(
+                    "INSERT INTO users_rates \
+                    (user_id, iso, value, percent_delta) VALUES (?, ?, ?, ?)",
+                    (user_id, iso, value, percent_delta)
+                )
+                self.set_user_rate_check_times(user_id, iso, check_times)
             return True
         raise exceptions.UserDoesNotExistError(
             f"user id {user_id} does not exist", cause='id'
         )
 
+    def add_user_rates(
+            self, user_id:int, values:dict, percent_delta:float=0.01,
+            check_times:list=settings.DEFAULT_CHECK_TIMES
+            ):
+        """
+        Add many rates to user in one transaction
+
+        :arguments:
+            user_id(int): user's id who add rates to
+            values(dict[str, float]): Rate `iso`-USD: 1 `iso` - `value` USD
+                (0 < value < float('inf'))
+            percent_delta(float)=0.01: percent at which to notify (0<delta<1)
+            check_times(list[str])=settings.DEFAULT_CHECK_TIMES: '%H:%M'
+        :raise:
+            exceptions.UserDoesNotExistError: if no `user_id` in db
+            AssertionError: if invalid value is passed
+            sqlite3.DatabaseError: if invalid types are passed
+        :return:
+            success_status(bool)=True
+        """
+        for iso, value in values.items():
+            assert 0 < value < float('inf'), \
+                f"unexpected value '{value}' for rate '{iso}'"
+        with self.transaction():
+            if not self.check_user_exists(user_id):
+                raise exceptions.UserDoesNotExistError(
+                    f"user id {user_id} does not exist", cause='id'
+                )
+            self.executemany(
+                'DELETE FROM rate_check_times WHERE user_id = ? AND iso = ?',
+                [(user_id, iso) for iso in values]
+            )
+            self.executemany(
+                "INSERT INTO users_rates(user_id, iso, value, percent_delta) \
+                VALUES (?, ?, ?, ?)",
+                [
+                    (user_id, iso, value, percent_delta) 
+                    for iso, value in values.items()
+                ]
+            )
+            self.executemany(
+                'INSERT INTO rate_check_times VALUES (?, ?, ?)',
+                [
+                    (user_id, iso, check_time) 
+                    for iso in values for check_time in check_times
+                ]
+            )
+        return True
+
     @rangetest(value=(0, float("inf")))
     def add_prediction(
             self, user_id:int, iso_from:str, iso_to:str,
@@ -294,23 +659,97 @@ class DBHandler(DBHandlerBase):
 
     def get_users_by_check_time(self, check_time:str) -> list:
         """
-        Get all users, where `check_time` in check times
+        Get all active users, where `check_time` in check times
 
         :arguments:
             check_time(str): check time in format '%H:%M'
         :return:
             users_list(list[dict])
         """
-        return [
-            self.get_user(user_id['id'])
-            for user_id in self.execute(
-                'SELECT DISTINCT id FROM users WHERE is_active = 1'
-            )
-            if any(
-                check_time in rate['check_times'] 
-                for rate in self.get_user_rates(user_id['id'])
-            )
-        ]
+        return self.select_users(
+            "u.is_active = 1 AND u.id IN ( \
+                SELECT user_id FROM rate_check_times WHERE check_time = ? \
+            )",
+            (check_time,)
+        )
+
+    def select_users(
+            self, condition:str, params=tuple(), *, with_session:bool=False
+            ) -> list:
+        """
+        Get data of users with their rates in one query
+
+        :arguments:
+            condition(str): sql condition on users table (aliased as `u`)
+            params(tuple)=(): parameters of the condition
+        :keyword arguments:
+            with_session(bool)=False: to add `free_notifications_count` 
+                of the session, None if user has no session
+        :return:
+            users(list[dict]): data of users, same as `get_user`
+        """
+        session_columns, session_join = (
+            ('s.free_notifications_count,', 
+             'LEFT JOIN sessions s ON s.user_id = u.id')
+            if with_session else 
+            ('', '')
+        )
+        return self.group_users_rows(self.execute(
+            'SELECT u.*, %s \
+            u_r.iso, u_r.value, u_r.percent_delta, t.check_time \
+            FROM users u %s LEFT JOIN users_rates u_r ON u.id = u_r.user_id \
+            LEFT JOIN rate_check_times t \
+            ON t.user_id = u_r.user_id AND t.iso = u_r.iso \
+            WHERE %s ORDER BY u.id, u_r.iso, t.rowid' % (
+                session_columns, session_join, condition
+            ),
+            params
+        ))
+
+    @classmethod
+    def group_users_rows(cls, rows:list) -> list:
+        """
+        Group rows of users joined with their rates by user
+
+        :arguments:
+            rows(list[dict]): users' columns with `iso`, `value`, 
+                `percent_delta` and `check_time` of one rate check time,
+                ordered by user
+        :return:
+            users(list[dict]): data of users with the list of `rates`
+        """
+        rate_columns = ('iso', 'value', 'percent_delta', 'check_time')
+        users = {}
+        for row in rows:
+            if (user := users.get(row['id'])) is None:
+                user = users[row['id']] = {
+                    **{k: v for k, v in row.items() if k not in rate_columns},
+                    'rates': []
+                }
+            cls.add_rate_row(user['rates'], row)
+        return list(users.values())
+
+    @staticmethod
+    def add_rate_row(rates:list, row:dict) -> None:
+        """
+        Add a row of rate check time to rates, ordered by rate
+
+        :arguments:
+            rates(list[dict]): rates to which add the row
+            row(dict): `iso`, `value`, `percent_delta` and `check_time`
+        :return: None
+        """
+        if row['iso'] is None:
+            return
+        if not rates or rates[-1]['iso'] != row['iso']:
+            rates.append({
+                'iso': row['iso'],
+                'value': row['value'],
+                'percent_delta': row['percent_delta'],
+                'check_times': []
+            })
+        if row['check_time'] is not None:
+            rates[-1]['check_times'].append(row['check_time'])
 
     def get_user(self, user_id:int):
         """
@@ -335,6 +774,44 @@ class DBHandler(DBHandlerBase):
             f"user id {user_id} does not exist", cause='id'
         )
 
+    def get_user_with_session(self, user_id:int):
+        """
+        Get all user data (except the predictions) with the session
+        in one query
+
+        :arguments:
+            user_id(int): user's id in Telegram
+        :return:
+            user_data(dict | None): same as `get_user` with 
+                `free_notifications_count` of the session,
+                None if user or the session does not exist
+        """
+        users = self.select_users('u.id = ?', (user_id,), with_session=True)
+        if users and users[0]['free_notifications_count'] is not None:
+            return users[0]
+        return None
+
+    def init_user_with_session(self, user_id:int, rates:dict):
+        """
+        Add user with rates, if user does not exist, 
+        and the session, if it does not exist, in one transaction
+
+        :arguments:
+            user_id(int): user's id in Telegram
+            rates(dict[str, float]): rates of new user, see `add_user_rates`
+        :return:
+            user_data(dict): same as `get_user_with_session`
+        """
+        with self.transaction():
+            if not self.check_user_exists(user_id):
+                self.add_user(user_id)
+                self.add_user_rates(user_id, rates)
+            self.execute(
+                'INSERT OR IGNORE INTO sessions(user_id) VALUES (?)', 
+                (user_id,)
+            )
+            return self.get_user_with_session(user_id)
+
     def get_all_users(self, *, if_all:bool=True):
         """
         :keyword arguments:
@@ -398,6 +875,23 @@ class DBHandler(DBHandlerBase):
             )
         ]
 
+    def get_expired_pro_users(self, now:datetime) -> list:
+        """
+        Get active users whose premium with end datetime has expired,
+        users with infinite premium are not included
+
+        :arguments:
+            now(datetime.datetime): current UTC datetime
+        :return:
+            users(list[dict]): data of users without rates
+        """
+        return self.execute(
+            # numbers (FALSE, TRUE) are less than any blob (X'')
+            "SELECT * FROM users \
+            WHERE is_pro > X'' AND is_pro <= ? AND is_active = TRUE",
+            (now,)
+        )
+
     def get_user_rates(self, user_id:int):
         """
         Get user's rates
@@ -410,13 +904,17 @@ class DBHandler(DBHandlerBase):
             user_rates(dict): all users_rates
         """
         if self.check_user_exists(user_id):
-            return self.execute(
-                'SELECT \
-                u_r.iso, u_r.value, u_r.percent_delta, u_r.check_times \
-                FROM users u JOIN users_rates u_r \
-                ON u.id = u_r.user_id AND u.id = ?',
-                (user_id,)
-            )
+            rates = []
+            for row in self.execute(
+                    'SELECT \
+                    u_r.iso, u_r.value, u_r.percent_delta, t.check_time \
+                    FROM users_rates u_r LEFT JOIN rate_check_times t \
+                    ON t.user_id = u_r.user_id AND t.iso = u_r.iso \
+                    WHERE u_r.user_id = ? ORDER BY u_r.iso, t.rowid',
+                    (user_id,)
+                    ):
+                self.add_rate_row(rates, row)
+            return rates
         raise exceptions.UserDoesNotExistError(
             f"user id {user_id} does not exist", cause='id'
         )
@@ -574,6 +1072,21 @@ class DBHandler(DBHandlerBase):
             WHERE datetime() > datetime(up_to_date) AND real_value is NULL'
         )
 
+    def get_unverified_predictions_users(self):
+        """
+        Get users, who have unverified predictions, without their rates
+
+        :return:
+            users(list[dict]): users' data
+        """
+        return self.execute(
+            'SELECT * FROM users WHERE id IN ( \
+                SELECT user_id FROM currency_predictions \
+                WHERE datetime() > datetime(up_to_date) \
+                AND real_value is NULL \
+            )'
+        )
+
     def change_user(self, user_id:int, **kwargs):
         """
         Change some of user's data
@@ -599,11 +1112,12 @@ class DBHandler(DBHandlerBase):
         """
         if self.check_user_exists(user_id):
             try:
-                for k, v in kwargs.items():
-                    self.execute(
-                        'UPDATE users SET %s = ? WHERE id = ?' % k,
-                        (v, user_id)
-                    )
+                with self.transaction():
+                    for k, v in kwargs.items():
+                        self.execute(
+                            'UPDATE users SET %s = ? WHERE id = ?' % k,
+                            (v, user_id)
+                        )
             except sqlite3.OperationalError:
                 raise KeyError(f'invalid argument {repr(k)}') from None
             except sqlite3.IntegrityError:
@@ -625,7 +1139,7 @@ class DBHandler(DBHandlerBase):
         :keyword arguments:
             value(float): 1 `iso` - `value` USD (0 < value < float('inf'))
             percent_delta(float): percent at which to notify (0<delta<1)
-            check_times(list[dict]): in format ('%H:%M')
+            check_times(list[str]): in format ('%H:%M')
         :raise:
             exceptions.UserDoesNotExistError: if no `user_id` in db
             exceptions.RateDoesNotExistError: if no `iso` in db
@@ -636,12 +1150,16 @@ class DBHandler(DBHandlerBase):
         """
         if self.check_user_rate_exists(user_id, iso):
             try:
-                for k, v in kwargs.items():
-                    self.execute(
-                        'UPDATE users_rates SET %s = ? \
-                        WHERE user_id = ? and iso = ?' % k,
-                        (v, user_id, iso)
-                    )
+                with self.transaction():
+                    for k, v in kwargs.items():
+                        if k == 'check_times':
+                            self.set_user_rate_check_times(user_id, iso, v)
+                            continue
+                        self.execute(
+                            'UPDATE users_rates SET %s = ? \
+                            WHERE user_id = ? and iso = ?' % k,
+                            (v, user_id, iso)
+                        )
             except sqlite3.OperationalError:
                 raise KeyError(f'invalid argument {repr(k)}') from None
             except sqlite3.IntegrityError:
@@ -666,15 +1184,92 @@ class DBHandler(DBHandlerBase):
             success_status(bool)=True
         """
         if self.check_user_rate_exists(user_id, iso):
-            self.execute(
-                'DELETE FROM users_rates WHERE user_id = ? AND iso = ?',
-                (user_id, iso)
-            )
+            with self.transaction():
+                self.execute(
+                    'DELETE FROM users_rates WHERE user_id = ? AND iso = ?',
+                    (user_id, iso)
+                )
+                self.execute(
+                    'DELETE FROM rate_check_times \
+                    WHERE user_id = ? AND iso = ?',
+                    (user_id, iso)
+                )
             return True
         raise exceptions.RateDoesNotExistError(
             f"rate {iso} of user {user_id} does not exist", cause='iso'
         )
 
+    def set_user_rate_check_times(
+            self, user_id:int, iso:str, check_times:list
+            ):
+        """
+        Replace check times of user rate
+
+        :arguments:
+            user_id(int): user's id in Telegram
+            iso(str): currency's iso of the rate
+            check_times(list[str]): in format ('%H:%M')
+        :return:
+            success_status(bool)=True
+        """
+        with self.transaction():
+            self.execute(
+                'DELETE FROM rate_check_times WHERE user_id = ? AND iso = ?',
+                (user_id, iso)
+            )
+            self.executemany(
+                'INSERT INTO rate_check_times VALUES (?, ?, ?)',
+                [(user_id, iso, check_time) for check_time in check_times]
+            )
+        return True
+
+    def set_user_rates_check_times(self, user_id:int, check_times:list):
+        """
+        Replace check times of all user rates in one transaction
+
+        :arguments:
+            user_id(int): user's id in Telegram
+            check_times(list[str]): in format ('%H:%M')
+        :return:
+            success_status(bool)=True
+        """
+        with self.transaction():
+            self.execute(
+                'DELETE FROM rate_check_times WHERE user_id = ?', (user_id,)
+            )
+            self.executemany(
+                'INSERT INTO rate_check_times \
+                SELECT user_id, iso, ? FROM users_rates WHERE user_id = ?',
+                [(check_time, user_id) for check_time in check_times]
+            )
+        return True
+
+    def delete_premium(self, user_id:int) -> True:
+        """
+        Delete user premium in one transaction: set `is_pro` to False,
+        delete rates not in settings.CURRENCIES and set default check times 
+        for the rest
+
+        :arguments:
+            user_id(int): user's id in Telegram
+        :return:
+            success_status(bool)=True
+        """
+        currencies = ', '.join('?' * len(settings.CURRENCIES))
+        with self.transaction():
+            self.execute(
+                'UPDATE users SET is_pro = FALSE WHERE id = ?', (user_id,)
+            )
+            self.execute(
+                'DELETE FROM users_rates \
+                WHERE user_id = ? AND iso NOT IN (%s)' % currencies,
+                (user_id, *settings.CURRENCIES)
+            )
+            self.set_user_rates_check_times(
+                user_id, settings.DEFAULT_CHECK_TIMES
+            )
+        return True
+
     @rangetest(value=(0, float("inf")), real_value=(0, float("inf")))
     def change_prediction(self, pred_id:int, **kwargs):
         """
@@ -725,6 +1320,40 @@ class DBHandler(DBHandlerBase):
             f"prediction id {pred_id} does not exist", cause='id'
         )
 
+    def change_predictions(self, key:str, values:dict):
+        """
+        Change the value of many predictions in one transaction
+
+        :arguments:
+            key(str): column to change, see `change_prediction`
+            values(dict[int, Any]): prediction's id in db: new value
+        :raise:
+            AssertionError: 
+                - key in ('iso_to', 'iso_from', 'user_id', 'id')
+                - `up_to_date` in the past
+            KeyError: if non-existent column name
+            ValueError: if invalid column values
+        :return:
+            success_status(bool)=True
+        """
+        assert key not in (
+            'iso_to', 'iso_from', 'user_id', 'id'
+        ), 'unsupported argument'
+        if key == 'up_to_date':
+            assert all(
+                check_datetime_in_future(v) for v in values.values()
+            ), 'can\'t change `up_to_date` to past datetime'
+        try:
+            self.executemany(
+                'UPDATE currency_predictions SET %s = ? WHERE id = ?' % key,
+                ((v, pred_id) for pred_id, v in values.items())
+            )
+        except sqlite3.OperationalError:
+            raise KeyError(f'invalid argument {repr(key)}') from None
+        except sqlite3.IntegrityError:
+            raise ValueError("invalid values") from None
+        return True
+
     def delete_prediction(self, pred_id:int):
         """
         Delete prediction from db
@@ -857,7 +1486,7 @@ class DBHandler(DBHandlerBase):
         ]  # only actual predictions
 
 
-@private(['get', 'set'], 'execute')
+@private(['get', 'set'], 'execute', 'executemany', 'transaction')
 class SessionDBHandler(DBHandlerBase):
     def setup_db(self):
         self.execute(
@@ -1026,3 +1655,419 @@ class SessionDBHandler(DBHandlerBase):
         raise exceptions.SessionDoesNotExistError(
             f"session with user id {user_id} does not exist", cause='user_id'
         )
+
+
+
+@private(['get', 'set'], 'execute', 'executemany', 'transaction')
+class CurrencyDBHandler(DBHandlerBase):
+    """
+    Currencies table (registry of currencies' isos checked for existence):
+        iso(str): currency's iso in upper case
+        is_existing(bool): does the currency exist
+        checked_at(datetime.datetime): UTC time of the last check
+    """
+
+    def setup_db(self):
+        self.execute(
+            '''CREATE TABLE IF NOT EXISTS currencies(
+                iso TEXT PRIMARY KEY,
+                is_existing BOOLEAN NOT NULL,
+                checked_at DATETIME NOT NULL
+            )'''
+        )
+
+    def get_currencies(self, *, checked_after:datetime=None) -> list:
+        """
+        Get checked currencies from db
+
+        :keyword arguments:
+            checked_after(datetime.datetime | None)=None: 
+                get only currencies checked after the time
+                if None, all currencies are returned
+        :return:
+            currencies(list[dict]): currencies' data
+        """
+        if checked_after is None:
+            return self.execute('SELECT * FROM currencies')
+        return self.execute(
+            'SELECT * FROM currencies WHERE checked_at > ?', (checked_after,)
+        )
+
+    def set_currency(
+            self, iso:str, is_existing:bool, checked_at:datetime
+            ) -> True:
+        """
+        Add or replace result of currency's check
+
+        :arguments:
+            iso(str): currency's iso
+            is_existing(bool): does the currency exist
+            checked_at(datetime.datetime): UTC time of the check
+        :return:
+            success_status(bool)=True
+        """
+        self.execute(
+            'INSERT OR REPLACE INTO currencies VALUES (?, ?, ?)',
+            (iso.upper(), is_existing, checked_at)
+        )
+        return True
+
+    def set_currencies(
+            self, isos:list, is_existing:bool, checked_at:datetime
+            ) -> True:
+        """
+        Add or replace the same result of checks of many currencies
+
+        :arguments:
+            isos(list[str]): currencies' isos
+            is_existing(bool): do the currencies exist
+            checked_at(datetime.datetime): UTC time of the checks
+        :return:
+            success_status(bool)=True
+        """
+        self.executemany(
+            'INSERT OR REPLACE INTO currencies VALUES (?, ?, ?)',
+            ((iso.upper(), is_existing, checked_at) for iso in isos)
+        )
+        return True
+
+
+
+@private(['get', 'set'], 'execute', 'executemany', 'transaction')
+class RatesDBHandler(DBHandlerBase):
+    """
+    Rates snapshots table (append-only log of parsed USD rates):
+        iso(str): currency's iso
+        value(float): USD rate (1 `iso` - `value` USD)
+        updated_at(float): timestamp when the rate was parsed
+    """
+
+    def setup_db(self):
+        self.execute(
+            '''CREATE TABLE IF NOT EXISTS rates_snapshots(
+                iso TEXT NOT NULL,
+                value REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )'''
+        )
+        self.execute(
+            '''CREATE INDEX IF NOT EXISTS rates_snapshots_iso_updated_at 
+            ON rates_snapshots(iso, updated_at)'''
+        )
+
+    def add_snapshot(self, rates:dict) -> True:
+        """
+        Append rates to db
+
+        :arguments:
+            rates(dict[str, tuple[float, float]]): iso: (value, updated_at)
+        :return:
+            success_status(bool)=True
+        """
+        self.executemany(
+            'INSERT INTO rates_snapshots VALUES (?, ?, ?)',
+            (
+                (iso, value, updated_at) 
+                for iso, (value, updated_at) in rates.items()
+            )
+        )
+        return True
+
+    def get_last_snapshot(self) -> dict:
+        """
+        Get the latest rate of every currency in db
+
+        :return:
+            rates(dict[str, tuple[float, float]]): iso: (value, updated_at)
+        """
+        return {
+            row['iso']: (row['value'], row['updated_at'])
+            for row in self.execute(
+                '''SELECT iso, value, MAX(updated_at) AS updated_at 
+                FROM rates_snapshots GROUP BY iso'''
+            )
+        }
+
+    def delete_snapshots(self, *, updated_before:float) -> True:
+        """
+        Delete rates older than the time, the latest rate of every 
+        currency is kept
+
+        :keyword arguments:
+            updated_before(float): timestamp before which to delete
+        :return:
+            success_status(bool)=True
+        """
+        self.execute(
+            '''DELETE FROM rates_snapshots 
+            WHERE updated_at < ? AND rowid NOT IN (
+                SELECT rowid FROM (
+                    SELECT rowid, MAX(updated_at) 
+                    FROM rates_snapshots GROUP BY iso
+                )
+            )''',
+            (updated_before,)
+        )
+        return True
+
+
+
+@private(['get', 'set'], 'execute', 'executemany', 'transaction')
+class RatesHistoryDBHandler(DBHandlerBase):
+    """
+    Rates history table (USD rates rolled up into time buckets):
+        iso(str): currency's iso
+        resolution(int): bucket's length in seconds
+        bucket(int): timestamp of bucket's start
+        open(float), high(float), low(float), close(float): 
+            USD rates in the bucket
+        closed_at(float): timestamp of the latest rate in the bucket
+        count(int): number of rates in the bucket
+    """
+
+    def setup_db(self):
+        self.execute(
+            '''CREATE TABLE IF NOT EXISTS rates_history(
+                iso TEXT NOT NULL,
+                resolution INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                open REAL NOT NULL,
+                high REAL NOT NULL,
+                low REAL NOT NULL,
+                close REAL NOT NULL,
+                closed_at REAL NOT NULL,
+                count INTEGER NOT NULL DEFAULT 1,
+                PRIMARY KEY (iso, resolution, bucket)
+            ) WITHOUT ROWID'''
+        )
+
+    def add_rates(self, rates:list, resolutions:list) -> True:
+        """
+        Add rates to buckets of every resolution
+
+        :arguments:
+            rates(list[tuple[str, float, float]]): 
+                (iso, value, updated_at), in order of `updated_at`
+            resolutions(list[int]): buckets' lengths in seconds
+        :return:
+            success_status(bool)=True
+        """
+        self.executemany(
+            '''INSERT INTO rates_history VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT (iso, resolution, bucket) DO UPDATE SET 
+                high = MAX(high, excluded.high),
+                low = MIN(low, excluded.low),
+                close = CASE WHEN excluded.closed_at >= closed_at 
+                    THEN excluded.close ELSE close END,
+                closed_at = MAX(closed_at, excluded.closed_at),
+                count = count + 1''',
+            (
+                (
+                    iso, resolution, 
+                    int(updated_at // resolution * resolution),
+                    value, value, value, value, updated_at
+                )
+                for iso, value, updated_at in rates
+                for resolution in resolutions
+            )
+        )
+        return True
+
+    def get_history(
+            self, iso:str, resolution:int, start:float, end:float
+            ) -> list:
+        """
+        Get buckets of currency in the time range
+
+        :arguments:
+            iso(str): currency's iso
+            resolution(int): buckets' length in seconds
+            start(float): timestamp from which to get (inclusive)
+            end(float): timestamp up to which to get (inclusive)
+        :return:
+            buckets(list[dict]): buckets' data in order of time
+        """
+        return self.execute(
+            '''SELECT * FROM rates_history 
+            WHERE iso = ? AND resolution = ? AND bucket BETWEEN ? AND ? 
+            ORDER BY bucket''',
+            (iso, resolution, start // resolution * resolution, end)
+        )
+
+    def get_last_bucket(self, iso:str, resolution:int, timestamp:float):
+        """
+        Get the bucket of currency containing the time or the latest before
+
+        :arguments:
+            iso(str): currency's iso
+            resolution(int): buckets' length in seconds
+            timestamp(float): time of the rate
+        :return:
+            bucket(dict | None): bucket's data, None if there is no bucket
+        """
+        rows = self.execute(
+            '''SELECT * FROM rates_history 
+            WHERE iso = ? AND resolution = ? AND bucket <= ? 
+            ORDER BY bucket DESC LIMIT 1''',
+            (iso, resolution, timestamp)
+        )
+        return rows[0] if rows else None
+
+    def delete_history(self, resolution:int, *, updated_before:float) -> True:
+        """
+        Delete buckets of the resolution older than the time
+
+        :arguments:
+            resolution(int): buckets' length in seconds
+        :keyword arguments:
+            updated_before(float): timestamp before which to delete
+        :return:
+            success_status(bool)=True
+        """
+        self.execute(
+            'DELETE FROM rates_history WHERE resolution = ? AND closed_at < ?',
+            (resolution, updated_before)
+        )
+        return True
+
+
+
+@private(['get', 'set'], 'execute', 'executemany', 'transaction')
+class BroadcastDBHandler(DBHandlerBase):
+    """
+    Broadcasts table (progress of sending experts' predictions to users):
+        id(int): just an id
+        pred_id(int): id of the prediction sent
+        last_user_id(int | None): id of the last user the prediction 
+            was sent to, users are sent to in order of id
+        sent_count(int): number of users the prediction was sent to
+        created_at(datetime.datetime): UTC time of the broadcast's start
+        finished_at(datetime.datetime | None): UTC time of the finish
+    """
+
+    def setup_db(self):
+        # recipients are selected from users joined with their sessions
+        DBHandler(self.DB_NAME)
+        SessionDBHandler(self.DB_NAME)
+        self.execute(
+            '''CREATE TABLE IF NOT EXISTS broadcasts(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                pred_id INTEGER NOT NULL,
+                last_user_id INTEGER DEFAULT NULL,
+                sent_count INTEGER NOT NULL DEFAULT 0,
+                created_at DATETIME NOT NULL,
+                finished_at DATETIME DEFAULT NULL
+            )'''
+        )
+
+    def add_broadcast(self, pred_id:int, created_at:datetime) -> int:
+        """
+        Add broadcast to db
+
+        :arguments:
+            pred_id(int): id of the prediction to send
+            created_at(datetime.datetime): UTC time of the start
+        :return:
+            broadcast_id(int)
+        """
+        with self.transaction() as conn:
+            return conn.execute(
+                'INSERT INTO broadcasts(pred_id, created_at) VALUES (?, ?)',
+                (pred_id, created_at)
+            ).lastrowid
+
+    def get_broadcast(self, broadcast_id:int):
+        """
+        Get broadcast data from db
+
+        :arguments:
+            broadcast_id(int): broadcast's id
+        :return:
+            broadcast(dict | None): None if there is no broadcast
+        """
+        rows = self.execute(
+            'SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,)
+        )
+        return rows[0] if rows else None
+
+    def get_unfinished_broadcasts(self) -> list:
+        """
+        Get broadcasts which are not finished
+
+        :return:
+            broadcasts(list[dict]): broadcasts' data
+        """
+        return self.execute(
+            'SELECT * FROM broadcasts WHERE finished_at IS NULL ORDER BY id'
+        )
+
+    def get_recipients(self, after_user_id:int=None, limit:int=100) -> list:
+        """
+        Get users to notify by experts in order of id, 
+        with their count of free notifications
+
+        :arguments:
+            after_user_id(int | None)=None: get users with greater id
+                if None, users are got from the first one
+            limit(int)=100: max number of users
+        :return:
+            users(list[dict]): users' data with `free_notifications_count`
+        """
+        return self.execute(
+            'SELECT u.*, COALESCE(s.free_notifications_count, %s) \
+            AS free_notifications_count \
+            FROM users u LEFT JOIN sessions s ON s.user_id = u.id \
+            WHERE u.is_staff != 1 AND u.to_notify_by_experts = 1 \
+            AND (? IS NULL OR u.id > ?) ORDER BY u.id LIMIT ?' 
+            % settings.DEFAULT_EXPERT_PREDICTIONS_NOTIFICATIONS_NUMBER,
+            (after_user_id, after_user_id, limit)
+        )
+
+    def checkpoint(
+            self, broadcast_id:int, last_user_id:int, sent_ids:list
+            ) -> True:
+        """
+        Save progress of broadcast and decrease free notifications 
+        of users the prediction was sent to, in one transaction
+
+        :arguments:
+            broadcast_id(int): broadcast's id
+            last_user_id(int): id of the last processed user
+            sent_ids(list[int]): ids of users the prediction was sent to
+        :return:
+            success_status(bool)=True
+        """
+        with self.transaction() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO sessions(user_id) VALUES (?)',
+                ((user_id,) for user_id in sent_ids)
+            )
+            conn.executemany(
+                'UPDATE sessions \
+                SET free_notifications_count = free_notifications_count - 1 \
+                WHERE user_id = ?',
+                ((user_id,) for user_id in sent_ids)
+            )
+            conn.execute(
+                'UPDATE broadcasts \
+                SET last_user_id = ?, sent_count = sent_count + ? \
+                WHERE id = ?',
+                (last_user_id, len(sent_ids), broadcast_id)
+            )
+        return True
+
+    def finish_broadcast(self, broadcast_id:int, finished_at:datetime) -> True:
+        """
+        Mark broadcast as finished
+
+        :arguments:
+            broadcast_id(int): broadcast's id
+            finished_at(datetime.datetime): UTC time of the finish
+        :return:
+            success_status(bool)=True
+        """
+        self.execute(
+            'UPDATE broadcasts SET finished_at = ? WHERE id = ?',
+            (finished_at, broadcast_id)
+        )
+        return True
@@ -0,0 +1,192 @@
+import queue
+import threading
+import time
+
+from configs import settings
+
+
+__all__ = ['UpdateDispatcher']
+
+
+
+class UpdateDispatcher(object):
+    """
+    A pool of threads handling Telegram updates. An update is queued
+    to the thread chosen by chat's id, so updates of one chat are
+    handled in order of arrival and updates of different chats in parallel
+
+    :attributes:
+        process(Callable[[list[telebot.types.Update]], Any]):
+            handler of updates, like bot.process_new_updates
+        workers(int)=settings.UPDATES_WORKERS: threads handling updates
+        max_queue_size(int)=settings.UPDATES_QUEUE_SIZE:
+            max updates waiting in a thread's queue, `put` blocks
+            when the queue is full (0 - unlimited)
+        processed(int): how many updates were handled
+        failed(int): how many updates raised errors
+        offset(int | None): id of the next update to get by polling
+    """
+    MAX_POLLING_ERROR_INTERVAL = 60  # seconds
+
+    def __init__(
+            self, process, *, workers:int=settings.UPDATES_WORKERS,
+            max_queue_size:int=settings.UPDATES_QUEUE_SIZE
+            ):
+        assert workers > 0, 'number of workers must be positive'
+        self.process = process
+        self.workers = workers
+        self.processed = self.failed = 0
+        self.total_latency = self.max_latency = 0
+        self.offset = None
+        self._queues = [queue.Queue(max_queue_size) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_chat_id(update) -> int:
+        """
+        Get id of the chat where the update came from
+
+        :arguments:
+            update(telebot.types.Update)
+        :return:
+            chat_id(int | None): id of the chat or of the user in private
+                chat with the bot, None if update has none of them
+        """
+        for message in (
+                update.message, update.edited_message,
+                update.channel_post, update.edited_channel_post
+                ):
+            if message is not None:
+                return message.chat.id
+        if (call := update.callback_query) is not None:
+            return (
+                call.message.chat.id
+                if call.message is not None else
+                call.from_user.id
+            )
+        for query in (
+                update.inline_query, update.chosen_inline_result,
+                update.shipping_query, update.pre_checkout_query
+                ):
+            if query is not None:
+                return query.from_user.id
+        if update.poll_answer is not None:
+            return update.poll_answer.user.id
+        return None
+
+    def start(self) -> None:
+        """
+        Start the threads, if they are not started
+
+        :return: None
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for updates_queue in self._queues:
+                thread = threading.Thread(
+                    target=self.run, args=(updates_queue,), daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def put(self, update) -> None:
+        """
+        Queue the update to the thread of its chat
+
+        :arguments:
+            update(telebot.types.Update): update to handle
+        :return: None
+        """
+        self.start()
+        if (key := self.get_chat_id(update)) is None:
+            key = update.update_id
+        self._queues[hash(key) % self.workers].put((update, time.monotonic()))
+
+    def poll(
+            self, get_updates, *, timeout:int=settings.POLLING_TIMEOUT,
+            skip_pending:bool=False
+            ) -> None:
+        """
+        Get updates by long polling and queue them, network errors
+        are retried with exponential backoff
+
+        :arguments:
+            get_updates(Callable[..., list[telebot.types.Update]]):
+                function getting updates, like bot.get_updates
+        :keyword arguments:
+            timeout(int)=settings.POLLING_TIMEOUT: seconds of long polling
+            skip_pending(bool)=False: to skip updates sent before
+                the first call
+        :return: None
+        """
+        error_interval = 0.25
+        if skip_pending and self.offset is None:
+            # the offset of -1 returns only the last update
+            pending = get_updates(offset=-1, timeout=0)
+            self.offset = pending[-1].update_id + 1 if pending else None
+        while True:
+            try:
+                updates = get_updates(offset=self.offset, timeout=timeout)
+            except Exception as e:
+                settings.logger.warning(
+                    f"Getting updates failed: {e.__class__.__name__}:{e}"
+                )
+                time.sleep(error_interval)
+                error_interval = min(
+                    error_interval * 2, self.MAX_POLLING_ERROR_INTERVAL
+                )
+                continue
+            error_interval = 0.25
+            for update in updates:
+                self.put(update)
+                self.offset = update.update_id + 1
+
+    def run(self, updates_queue:queue.Queue) -> None:
+        """
+        Handle updates of the queue one by one
+
+        :arguments:
+            updates_queue(queue.Queue): queue of (update, queued_at)
+        :return: None
+        """
+        while True:
+            update, queued_at = updates_queue.get()
+            try:
+                self.process([update])
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                settings.logger.error(
+                    f"Update {update.update_id} raised "
+                    f"{e.__class__.__name__}:{e}"
+                )
+            finally:
+                latency = time.monotonic() - queued_at
+                with self._lock:
+                    self.processed += 1
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+                updates_queue.task_done()
+
+    def join(self) -> None:
+        """
+        Wait until all queued updates are handled
+
+        :return: None
+        """
+        for updates_queue in self._queues:
+            updates_queue.join()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'queued': [x.qsize() for x in self._queues],
+            'processed': self.processed,
+            'failed': self.failed,
+            'avg_latency': (
+                self.total_latency / self.processed if self.processed else 0
+            ),
+            'max_latency': self.max_latency
+        }
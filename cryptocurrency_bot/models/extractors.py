@@ -0,0 +1,248 @@
+import abc
+import functools
+import html as html_lib
+import re
+
+from bs4 import BeautifulSoup as bs, SoupStrainer
+try:
+    import lxml.html
+    from lxml.cssselect import CSSSelector
+except ImportError:  # lxml fast path is optional, requires cssselect
+    lxml = None
+
+
+__all__ = [
+    'Element', 'RegexExtractor', 'LxmlExtractor', 'SoupStrainerExtractor',
+    'SoupExtractor', 'ChainExtractor', 'get_default_extractor'
+]
+
+
+ID_SELECTOR = re.compile(r'^#([\w-]+)$')
+LEADING_ID_SELECTOR = re.compile(r'^#([\w-]+)(?=\s|>|$)')
+ATTRIBUTE = re.compile(
+    r'''([^\s"'=/>]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?'''
+)
+TAG = re.compile(r'<[^>]*>')
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'source', 'track', 'wbr'
+}
+
+
+
+class Element(object):
+    """
+    An extracted element, supports the part of bs4.Tag used by parsers
+
+    :attributes:
+        text(str): text of the element and its descendants
+        attrs(dict[str, str]): attributes of the element
+    """
+
+    def __init__(self, text:str, attrs:dict):
+        self.text = text
+        self.attrs = attrs
+
+    def get(self, key:str, default=None):
+        return self.attrs.get(key, default)
+
+    def __repr__(self):
+        return f"Element(text={self.text!r}, attrs={self.attrs!r})"
+
+
+class Extractor(abc.ABC):
+    """
+    Extractor of an element from html by css selector
+
+    :attributes:
+        is_exact(bool):
+            if False, element not found does not mean there is no element
+    """
+    is_exact = True
+
+    def supports(self, css_selector:str) -> bool:
+        """
+        Check if extractor can handle the css selector
+
+        :arguments:
+            css_selector(str): a css selector to needed element
+        :return:
+            success_status(bool)
+        """
+        return True
+
+    @abc.abstractmethod
+    def extract(self, html:str, css_selector:str):
+        """
+        Extract the first element by css selector
+
+        :arguments:
+            html(str): html to extract from
+            css_selector(str): a css selector to needed element
+        :return:
+            element(Element | bs4.Tag | None): None if nothing was found
+        """
+        pass
+
+
+class RegexExtractor(Extractor):
+    """
+    Extractor of elements by id selectors (like '#last_last')
+    with regular expressions, without parsing the whole html.
+    Gives up on elements with nested elements of the same tag
+    """
+    is_exact = False
+
+    def supports(self, css_selector:str) -> bool:
+        return ID_SELECTOR.match(css_selector.strip()) is not None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def compile_id(id_pattern:str):
+        return re.compile(
+            r'<(?P<tag>[a-zA-Z][\w-]*)(?P<attrs>\s[^>]*?(?<![\w-])id\s*=\s*'
+            r'''(?P<quote>["'])(?P<id>%s)(?P=quote)[^>]*)>''' % id_pattern
+        )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def compile_end_tag(tag:str):
+        return re.compile(r'<(/?)%s[\s>/]' % re.escape(tag), re.I)
+
+    def extract(self, html:str, css_selector:str):
+        element_id = ID_SELECTOR.match(css_selector.strip()).group(1)
+        start = self.compile_id(re.escape(element_id)).search(html)
+        return None if start is None else self.build_element(html, start)
+
+    def extract_all(self, html:str, id_prefix:str) -> dict:
+        """
+        Extract all elements with ids starting with the prefix
+
+        :arguments:
+            html(str): html to extract from
+            id_prefix(str): start of elements' ids (like 'rate-iso-')
+        :return:
+            elements(dict[str, Element]): element's id: element
+        """
+        elements = {}
+        pattern = self.compile_id(re.escape(id_prefix) + r'[\w-]*')
+        for start in pattern.finditer(html):
+            if (element := self.build_element(html, start)) is not None:
+                elements.setdefault(start.group('id'), element)
+        return elements
+
+    def build_element(self, html:str, start:re.Match):
+        """
+        Build element from the match of its start tag
+
+        :arguments:
+            html(str): html the match was found in
+            start(re.Match): match of RegexExtractor.compile_id() pattern
+        :return:
+            element(Element | None): None if element has nested elements 
+                of the same tag
+        """
+        tag, attrs_string = start.group('tag').lower(), start.group('attrs')
+        attrs = {
+            match.group(1).lower(): html_lib.unescape(
+                next((x for x in match.groups()[1:] if x is not None), '')
+            )
+            for match in ATTRIBUTE.finditer(attrs_string.rstrip('/'))
+        }
+        if tag in VOID_ELEMENTS or attrs_string.endswith('/'):
+            return Element('', attrs)
+        end = self.compile_end_tag(tag).search(html, start.end())
+        if end is None or not end.group(1):
+            # nested element of the same tag or broken html
+            return None
+        text = TAG.sub('', html[start.end():end.start()])
+        return Element(html_lib.unescape(text), attrs)
+
+
+class LxmlExtractor(Extractor):
+    """
+    Extractor using lxml, requires lxml and cssselect installed
+    """
+
+    def __init__(self):
+        if lxml is None:
+            raise ImportError("lxml and cssselect are required")
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def compile_selector(css_selector:str):
+        return CSSSelector(css_selector)
+
+    def extract(self, html:str, css_selector:str):
+        try:
+            document = lxml.html.fromstring(html)
+        except (ValueError, lxml.etree.ParserError):
+            return None
+        found = self.compile_selector(css_selector)(document)
+        if not found:
+            return None
+        return Element(found[0].text_content(), dict(found[0].attrib))
+
+
+class SoupStrainerExtractor(Extractor):
+    """
+    Extractor for selectors starting with id (like '#chart > div'),
+    only the element with the id is parsed with BeautifulSoup
+    """
+
+    def supports(self, css_selector:str) -> bool:
+        return LEADING_ID_SELECTOR.match(css_selector.strip()) is not None
+
+    def extract(self, html:str, css_selector:str):
+        css_selector = css_selector.strip()
+        soup = bs(html, "html.parser", parse_only=SoupStrainer(
+            id=LEADING_ID_SELECTOR.match(css_selector).group(1)
+        ))
+        return soup.select_one(css_selector)
+
+
+class SoupExtractor(Extractor):
+    """
+    Extractor parsing the whole html with BeautifulSoup
+    """
+
+    def extract(self, html:str, css_selector:str):
+        return bs(html, "html.parser").select_one(css_selector)
+
+
+class ChainExtractor(Extractor):
+    """
+    Extractor trying extractors in order until one of them finds the element
+    or an exact one does not
+
+    :attributes:
+        extractors(list[Extractor]): extractors to try
+    """
+
+    def __init__(self, extractors:list):
+        self.extractors = extractors
+
+    def extract(self, html:str, css_selector:str):
+        for extractor in self.extractors:
+            if not extractor.supports(css_selector):
+                continue
+            element = extractor.extract(html, css_selector)
+            if element is not None or extractor.is_exact:
+                return element
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_extractor() -> ChainExtractor:
+    """
+    Get extractor with the fastest available ways first
+
+    :return:
+        extractor(ChainExtractor)
+    """
+    return ChainExtractor([
+        RegexExtractor(),
+        *([LxmlExtractor()] if lxml is not None else []),
+        SoupStrainerExtractor(),
+        SoupExtractor(),
+    ])
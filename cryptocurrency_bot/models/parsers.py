@@ -1,16 +1,336 @@
+from array import array
+import asyncio
+from concurrent import futures
+import datetime as dt
 import random
+import threading
+import time
 
 import requests
 from bs4 import BeautifulSoup as bs
+try:
+    import aiohttp
+except ImportError:  # asyncio backend is optional
+    aiohttp = None
 
 from utils.agent import get_useragent
 from utils.translator import translate as _
 from utils import get_default_rates, prettify_float, get_proxy_list
+from utils.dt import get_now
 from configs import settings
 from . import exceptions
+from .db import CurrencyDBHandler, RatesDBHandler, RatesHistoryDBHandler
+from .extractors import RegexExtractor, get_default_extractor
 
 
-__all__ = ['CurrencyExchanger']
+__all__ = ['CurrencyExchanger', 'RatesSnapshotStore', 'RatesHistory']
+
+
+
+class FetchedResponse(object):
+    """
+    A response got by AsyncFetcher, 
+    supports the part of requests.Response used by parsers
+
+    :attributes:
+        status_code(int): HTTP status code
+        text(str): decoded body of the response
+        url(str): url of the response
+    """
+
+    def __init__(self, status_code:int, text:str, url:str):
+        self.status_code = status_code
+        self.text = text
+        self.url = url
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+
+class FetchResult(object):
+    """
+    A result of fetching the link, carries the response, its html 
+    and the element extracted from it, so a page is fetched 
+    and parsed only once
+
+    :attributes:
+        response(requests.Response | FetchedResponse): got response
+        css_selector(str | None): a css selector to needed element
+        element(extractors.Element | bs4.Tag | None): extracted element
+            if None, the element is not found or was not extracted
+        proxy(str | None): proxy the response was got through
+        elapsed(float): seconds the request took
+    """
+
+    def __init__(
+            self, response, css_selector:str=None, *, 
+            proxy:str=None, elapsed:float=0
+            ):
+        self.response = response
+        self.css_selector = css_selector
+        self.element = None
+        self.proxy = proxy
+        self.elapsed = elapsed
+
+    @property
+    def html(self) -> str:
+        return self.response.text
+
+    @property
+    def ok(self) -> bool:
+        return self.response.ok
+
+
+class AsyncFetcher(object):
+    """
+    An asyncio HTTP backend for parsers based on aiohttp.
+    Coroutines can be awaited in any event loop, sync callers run them 
+    in the fetcher's background loop with AsyncFetcher.run()
+
+    :attributes:
+        timeout(float)=settings.PARSER_TIMEOUT: 
+            seconds to wait for connecting and for every read of a request,
+            waiting for a free connection is not limited
+        limit_per_host(int)=settings.PARSER_LIMIT_PER_HOST: 
+            max number of simultaneous connections to one host
+        loop(asyncio.AbstractEventLoop): background event loop
+    """
+
+    def __init__(
+            self, *, timeout:float=settings.PARSER_TIMEOUT,
+            limit_per_host:int=settings.PARSER_LIMIT_PER_HOST
+            ):
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for AsyncFetcher")
+        self.timeout = timeout
+        self.limit_per_host = limit_per_host
+        self._sessions = {}  # event loop: aiohttp.ClientSession
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, daemon=True
+        )
+        self._thread.start()
+
+    def get_session(self) -> 'aiohttp.ClientSession':
+        """
+        Get session bound to the running event loop
+
+        :return:
+            session(aiohttp.ClientSession)
+        """
+        loop = asyncio.get_running_loop()
+        if (session := self._sessions.get(loop)) is None or session.closed:
+            session = self._sessions[loop] = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=self.limit_per_host
+                )
+            )
+        return session
+
+    async def fetch(
+            self, url:str, *, proxy:str=None, timeout:float=None
+            ) -> FetchedResponse:
+        """
+        Request the url
+
+        :arguments:
+            url(str): url to request
+        :keyword arguments:
+            proxy(str | None)=None: HTTP proxy, format: xxx.xxx.xxx.xxx:yyyy
+            timeout(float | None)=None: 
+                seconds to wait for connecting and for every read
+                if None, `timeout` is used
+        :raise:
+            aiohttp.ClientError: if request failed
+            asyncio.TimeoutError: if request timed out
+        :return:
+            response(FetchedResponse)
+        """
+        async with self.get_session().get(
+                url, headers={"User-Agent": get_useragent()},
+                proxy='http://' + proxy if proxy else None,
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=timeout or self.timeout,
+                    sock_read=timeout or self.timeout
+                )) as response:
+            return FetchedResponse(
+                response.status, await response.text(), str(response.url)
+            )
+
+    def run(self, coro, timeout:float=None):
+        """
+        Run coroutine in the background loop and wait for its result
+
+        :arguments:
+            coro(Coroutine): coroutine to run
+            timeout(float | None)=None: seconds to wait for the result
+                if None, wait until done
+        :return:
+            result(Any): result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(
+            timeout
+        )
+
+    async def aclose(self) -> None:
+        """
+        Close session bound to the running event loop
+
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        if (session := self._sessions.pop(loop, None)) is not None:
+            await session.close()
+
+    def close(self) -> None:
+        """
+        Close session of the background loop and stop the loop
+
+        :return: None
+        """
+        if (session := self._sessions.pop(self.loop, None)) is not None:
+            self.run(session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+
+class ProxyHealth(object):
+    """
+    A tracker of proxies' health shared by parsers.
+    Proxies are ranked by expected time of a valid response: 
+    EWMA of latency divided by success rate, 
+    proxies which failed `max_failures` times in a row are skipped 
+    for `cooldown` seconds
+
+    :attributes:
+        proxies(list[str]): tracked HTTP proxies
+            proxy format: xxx.xxx.xxx.xxx:yyyy
+        alpha(float)=settings.PROXY_EWMA_ALPHA: weight of the latest latency
+        cooldown(float)=settings.PROXY_COOLDOWN: 
+            seconds to skip the failing proxy
+        max_failures(int)=settings.PROXY_MAX_FAILURES: 
+            failures in a row after which the proxy is skipped
+    """
+
+    def __init__(
+            self, proxies:list=None, *, 
+            alpha:float=settings.PROXY_EWMA_ALPHA,
+            cooldown:float=settings.PROXY_COOLDOWN,
+            max_failures:int=settings.PROXY_MAX_FAILURES
+            ):
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.max_failures = max_failures
+        self.proxies = []
+        # proxy: {successes, failures, failures_in_row, latency, cooldown_until}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.set_proxies(proxies or [])
+
+    def set_proxies(self, proxies:list) -> None:
+        """
+        Replace tracked proxies, keeping stats of the remaining ones
+
+        :arguments:
+            proxies(list[str]): new HTTP proxies
+        :return: None
+        """
+        with self._lock:
+            self.proxies = list(proxies)
+            self._stats = {
+                proxy: self._stats.get(proxy) or {
+                    'successes': 0, 'failures': 0, 'failures_in_row': 0,
+                    'latency': None, 'cooldown_until': 0
+                }
+                for proxy in self.proxies
+            }
+
+    def record_success(self, proxy:str, latency:float) -> None:
+        """
+        Record a valid response got through the proxy
+
+        :arguments:
+            proxy(str): used proxy
+            latency(float): seconds the response took
+        :return: None
+        """
+        with self._lock:
+            if (stats := self._stats.get(proxy)) is None:
+                return
+            stats['successes'] += 1
+            stats['failures_in_row'] = 0
+            stats['latency'] = latency if stats['latency'] is None else (
+                self.alpha * latency + (1 - self.alpha) * stats['latency']
+            )
+
+    def record_failure(self, proxy:str) -> None:
+        """
+        Record an error or invalid response got through the proxy
+
+        :arguments:
+            proxy(str): used proxy
+        :return: None
+        """
+        with self._lock:
+            if (stats := self._stats.get(proxy)) is None:
+                return
+            stats['failures'] += 1
+            stats['failures_in_row'] += 1
+            if stats['failures_in_row'] >= self.max_failures:
+                stats['failures_in_row'] = 0
+                stats['cooldown_until'] = time.monotonic() + self.cooldown
+
+    def get_score(self, proxy:str) -> float:
+        """
+        Get expected seconds of getting a valid response via the proxy,
+        the less the better
+
+        :arguments:
+            proxy(str): tracked proxy
+        :return:
+            score(float)
+        """
+        stats = self._stats[proxy]
+        # a new proxy is as good as the best one, so it is tried soon
+        latency = stats['latency'] or min(
+            (x['latency'] for x in self._stats.values() if x['latency']),
+            default=0
+        )
+        success_rate = (stats['successes'] + 1) / (
+            stats['successes'] + stats['failures'] + 2
+        )
+        return latency / success_rate
+
+    def get_ranked(self) -> list:
+        """
+        Get proxies not in cooldown, the best ones first
+
+        :return:
+            proxies(list[str])
+        """
+        now = time.monotonic()
+        with self._lock:
+            proxies = [
+                proxy for proxy in self.proxies 
+                if self._stats[proxy]['cooldown_until'] <= now
+            ]
+            random.shuffle(proxies)  # proxies with equal scores are shuffled
+            return sorted(proxies, key=self.get_score)
+
+    @property
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'total': len(self.proxies),
+                'cooling_down': sum(
+                    x['cooldown_until'] > now for x in self._stats.values()
+                ),
+                'successes': sum(x['successes'] for x in self._stats.values()),
+                'failures': sum(x['failures'] for x in self._stats.values()),
+            }
 
 
 
@@ -21,55 +341,280 @@ class Parser(object):
     :attributes:
         link(str): link which to parse
         css_selector(str): a css selector to needed element
-        proxy_list(list[str] | None)=utils.get_proxy_list(): HTTP proxies 
+        proxy_list(list[str] | None)=None: HTTP proxies 
             proxy format: xxx.xxx.xxx.xxx:yyyy
             if None, no proxies will be used
+        proxy_health(ProxyHealth | None)=None: tracker of proxies' health
+            if None, a tracker of `proxy_list` is created
+        timeout(float)=settings.PARSER_TIMEOUT: seconds to wait for a request
+        deadline(float)=settings.PARSER_DEADLINE: 
+            seconds to spend on trying proxies for one response
+        hedged_requests(int)=settings.PARSER_HEDGED_REQUESTS: 
+            max number of proxies raced for one response, 
+            if 1, proxies are tried one by one
+        hedge_delay(float)=settings.PARSER_HEDGE_DELAY: 
+            seconds to wait for a response before racing the next proxy
+        extractor(extractors.Extractor | None)=None: 
+            extractor of the element from html
+            if None, extractors.get_default_extractor() is used
+        fetcher(AsyncFetcher | None)=None: asyncio backend
+            if None, only sync API is available and requests is used
     """
 
     def __init__(
             self, link:str, css_selector:str, *, 
-            proxy_list:list=get_proxy_list()
+            proxy_list:list=None,
+            proxy_health:ProxyHealth=None,
+            timeout:float=settings.PARSER_TIMEOUT,
+            deadline:float=settings.PARSER_DEADLINE,
+            hedged_requests:int=settings.PARSER_HEDGED_REQUESTS,
+            hedge_delay:float=settings.PARSER_HEDGE_DELAY,
+            extractor=None, fetcher:AsyncFetcher=None
             ):
         self.session = requests.Session()
         self.link = link
         self.css_selector = css_selector
-        self.proxy_list = proxy_list
+        self.proxy_health = proxy_health or ProxyHealth(proxy_list)
+        self.timeout = timeout
+        self.deadline = deadline
+        self.hedged_requests = hedged_requests
+        self.hedge_delay = hedge_delay
+        self.extractor = extractor or get_default_extractor()
+        self.fetcher = fetcher
 
-    def get_response(self) -> requests.Response:
+    @property
+    def proxy_list(self):
+        return self.proxy_health.proxies
+
+    @proxy_list.setter
+    def proxy_list(self, proxies:list):
+        self.proxy_health.set_proxies(proxies or [])
+
+    def get_proxies(self) -> list:
+        """
+        Get proxies in order of trying, the direct connection (None) is 
+        tried after all proxies
+
+        :return:
+            proxies(list[str | None])
         """
-        Get response from requesting the link
+        return self.proxy_health.get_ranked() + [None] * 5
 
+    def request(
+            self, link:str, css_selector:str, proxy:str, timeout:float
+            ) -> FetchResult:
+        """
+        Request the link via the proxy and record proxy's health
+
+        :arguments:
+            link(str): link to request
+            css_selector(str | None): a css selector to needed element
+            proxy(str | None): HTTP proxy, if None, no proxy is used
+            timeout(float): seconds to wait for the request
         :return:
-            response(requests.Response)
+            result(FetchResult | None): None if request failed
         """
-        lambda_get = lambda x, p: self.session.get(
-            x, headers={"User-Agent": get_useragent()}, 
-            proxies={'http': 'http://' + p} if p else None
+        start = time.monotonic()
+        try:
+            response = self.session.get(
+                link, headers={"User-Agent": get_useragent()}, 
+                proxies={
+                    'http': 'http://' + proxy, 'https': 'http://' + proxy
+                } if proxy else None, 
+                timeout=timeout
+            )
+        except (requests.ConnectionError, requests.Timeout):
+            self.record_proxy_health(proxy, None)
+            return None
+        result = self.process(
+            response, css_selector, proxy=proxy, 
+            elapsed=time.monotonic() - start
         )
-        if (proxies := (self.proxy_list or [])):
-            random.shuffle(proxies)
-        proxies.extend([None] * 5)
-        for proxy in proxies:
-            try:
-                q = lambda_get(self.link, proxy)
-                if self.test_response(q):
+        self.record_proxy_health(proxy, result)
+        return result
+
+    def record_proxy_health(self, proxy:str, result:FetchResult) -> None:
+        """
+        Record result of the request in `proxy_health`
+
+        :arguments:
+            proxy(str | None): used proxy, if None, nothing is recorded
+            result(FetchResult | None): result, if None, request failed
+        :return: None
+        """
+        if proxy is None:
+            return
+        if result is not None and self.test_result(result):
+            self.proxy_health.record_success(proxy, result.elapsed)
+        else:
+            self.proxy_health.record_failure(proxy)
+
+    def fetch(self, link:str=None, css_selector:str=None) -> FetchResult:
+        """
+        Request the link and extract the element from the response, 
+        the best proxies are tried first (see ProxyHealth), 
+        up to `hedged_requests` proxies are raced 
+
+        :arguments:
+            link(str | None)=None: link to request
+                if None, `link` is used
+            css_selector(str | None)=None: a css selector to needed element
+                if None, `css_selector` is used
+        :raise:
+            exceptions.ParsingError: if no response was got before `deadline`
+        :return:
+            result(FetchResult): the first suitable result or the last one
+        """
+        if self.fetcher is not None:
+            return self.fetcher.run(self.afetch(link, css_selector))
+        link = link or self.link
+        proxies = iter(self.get_proxies())
+        executor = futures.ThreadPoolExecutor(self.hedged_requests)
+        pending = set()
+        last_result = None
+        started = time.monotonic()
+
+        def start_next():
+            if (proxy := next(proxies, False)) is not False:
+                pending.add(executor.submit(
+                    self.request, link, css_selector, proxy, 
+                    min(self.timeout, remaining)
+                ))
+
+        try:
+            remaining = self.deadline
+            start_next()
+            while pending:
+                remaining = self.deadline - (time.monotonic() - started)
+                if remaining <= 0:
                     break
-            except requests.ConnectionError:
-                self.session = requests.Session()
-        return q
+                done, pending = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED,
+                    timeout=(
+                        min(remaining, self.hedge_delay) 
+                        if len(pending) < self.hedged_requests else 
+                        remaining
+                    )
+                )
+                for task in done:
+                    if (result := task.result()) is None:
+                        continue
+                    if self.test_result(result):
+                        return result
+                    last_result = result
+                # start the next proxy instead of the failed one or 
+                # race it with the slow one
+                if not pending or len(pending) < self.hedged_requests:
+                    start_next()
+        finally:
+            # raced requests finish in background, recording proxies' health
+            executor.shutdown(wait=False)
+        if last_result is None:
+            raise exceptions.ParsingError(
+                f'can not get response from "{link}"', cause="network"
+            )
+        return last_result
+
+    async def afetch(
+            self, link:str=None, css_selector:str=None
+            ) -> FetchResult:
+        """
+        Awaitable Parser.fetch(), requires `fetcher`,
+        proxies are tried one by one
+        """
+        link = link or self.link
+        last_result = None
+        started = time.monotonic()
+        for proxy in self.get_proxies():
+            remaining = self.deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            start = time.monotonic()
+            try:
+                # waiting for a free connection also counts to `deadline`
+                response = await asyncio.wait_for(self.fetcher.fetch(
+                    link, proxy=proxy, timeout=min(self.timeout, remaining)
+                ), remaining)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.record_proxy_health(proxy, None)
+                continue
+            result = self.process(
+                response, css_selector, proxy=proxy, 
+                elapsed=time.monotonic() - start
+            )
+            self.record_proxy_health(proxy, result)
+            if self.test_result(result):
+                return result
+            last_result = result
+        if last_result is None:
+            raise exceptions.ParsingError(
+                f'can not get response from "{link}"', cause="network"
+            )
+        return last_result
+
+    def process(
+            self, response:requests.Response, css_selector:str=None, *,
+            proxy:str=None, elapsed:float=0
+            ) -> FetchResult:
+        """
+        Extract the element from the response
+
+        :arguments:
+            response(requests.Response | FetchedResponse): got response
+            css_selector(str | None)=None: a css selector to needed element
+                if None, `css_selector` is used
+        :keyword arguments:
+            proxy(str | None)=None: proxy the response was got through
+            elapsed(float)=0: seconds the request took
+        :return:
+            result(FetchResult)
+        """
+        result = FetchResult(
+            response, css_selector or self.css_selector, 
+            proxy=proxy, elapsed=elapsed
+        )
+        if result.ok and result.css_selector:
+            result.element = self.extract(result.html, result.css_selector)
+        return result
+
+    def test_result(self, result:FetchResult) -> bool:
+        """
+        Test if result is suitable for parsing
+
+        :arguments:
+            result(FetchResult): result to test
+        :return:
+            success_status(bool): is suitable for parsing
+        """
+        return result.ok and result.element is not None
+
+    def get_response(self) -> requests.Response:
+        """
+        Get response from requesting the link (see Parser.fetch)
+
+        :raise:
+            exceptions.ParsingError: if no response was got before `deadline`
+        :return:
+            response(requests.Response | FetchedResponse)
+        """
+        return self.fetch().response
+
+    async def aget_response(self, link:str=None) -> FetchedResponse:
+        """
+        Awaitable Parser.get_response(), requires `fetcher`
+        """
+        return (await self.afetch(link)).response
 
     def test_response(self, response:requests.Response) -> bool:
         """
-        Test if response is suitable for parsing
+        Test if response is suitable for parsing (see Parser.test_result)
 
         :arguments:
             response(requests.Response): response to test
         :return:
             success_status(bool): is suitable for parsing
         """
-        return response.ok and self.get_element(
-            soup=self.get_soup(html=self.get_html(response=response))
-        ) is not None
+        return self.test_result(self.process(response))
 
     def get_html(self, *, response:requests.Response=None) -> str:
         """
@@ -81,7 +626,9 @@ class Parser(object):
         :return:
             html(str)
         """
-        return (response or self.get_response()).text
+        return (
+            response if response is not None else self.get_response()
+        ).text
 
     def get_soup(self, *, html:str=None) -> bs:
         """
@@ -95,17 +642,46 @@ class Parser(object):
         """
         return bs(html or self.get_html(), "html.parser")
 
+    def extract(self, html:str, css_selector:str=None):
+        """
+        Extract element from html with `extractor`
+
+        :arguments:
+            html(str): html to extract from
+            css_selector(str | None)=None: a css selector to needed element
+                if None, `css_selector` is used
+        :return:
+            element(extractors.Element | bs4.Tag | None): selected element
+        """
+        return self.extractor.extract(html, css_selector or self.css_selector)
+
     def get_element(self, *, soup:bs=None):
         """
-        Get element from soup by css selector
+        Get element by css selector
 
         :keyword arguments:
             soup(bs4.BeautifulSoup | None)=None: soup to select from
-                if None, Parser.get_soup() will be used
+                if None, Parser.fetch() will be used
+        :return:
+            element(extractors.Element | bs4.Tag | None): selected element
+        """
+        if soup is not None:
+            return soup.select_one(self.css_selector)
+        return self.fetch().element
+
+    async def aget_element(self, *, link:str=None, css_selector:str=None):
+        """
+        Awaitable Parser.get_element(), requires `fetcher`
+
+        :keyword arguments:
+            link(str | None)=None: link to request
+                if None, `link` is used
+            css_selector(str | None)=None: a css selector to needed element
+                if None, `css_selector` is used
         :return:
-            element(bs4.Tag): selected element
+            element(extractors.Element | bs4.Tag | None): selected element
         """
-        return (soup or self.get_soup()).select_one(self.css_selector)
+        return (await self.afetch(link, css_selector)).element
 
 
 class CurrencyParser(Parser):
@@ -119,16 +695,24 @@ class CurrencyParser(Parser):
         default_value(float | None)=utils.get_default_rates(`iso`): 
             default value used if parsing failed
         value(float | None): last parsed exchange rate
+        updated_at(float | None): timestamp of the last successful parsing
+        to_update(bool)=True: to parse the value on creation
+            if False, `default_value` is used until update_value()
     """
 
-    def __init__(self, iso:str, *args, default_value:float=None, **kwargs):
+    def __init__(
+            self, iso:str, *args, default_value:float=None, 
+            to_update:bool=True, **kwargs
+            ):
         super().__init__(*args, **kwargs)
         self.iso = iso
         self.default_value = default_value or get_default_rates(
             iso or '', to_print=False
         ).get(iso)
-        self.value = None
-        self.update_value(safe=True)
+        self.value = self.default_value
+        self.updated_at = None
+        if to_update:
+            self.update_value(safe=True)
 
     def to_string(self, *, to_update:bool=True):
         """
@@ -159,7 +743,25 @@ class CurrencyParser(Parser):
         :return:
             exchange_rate(dict[str, float | int])
         """
-        span = self.get_element()
+        return self.parse_rate(self.get_element())
+
+    async def aget_rate(self) -> dict:
+        """
+        Awaitable CurrencyParser.get_rate(), requires `fetcher`
+        """
+        return self.parse_rate(await self.aget_element())
+
+    def parse_rate(self, span) -> dict:
+        """
+        Get exchange rate from parsed element
+
+        :arguments:
+            span(extractors.Element | bs4.Tag | None): element with the rate
+        :raise:
+            exceptions.ParsingError: if parsing failed
+        :return:
+            exchange_rate(dict[str, float | int])
+        """
         if span is None:
             raise exceptions.ParsingError(
                 f'can not parse currency of "{self.iso}"', cause="empty soup"
@@ -212,6 +814,7 @@ class CurrencyParser(Parser):
         """
         try:
             self.value = self.get_rate().get('USD')
+            self.updated_at = time.time()
             return True
         except exceptions.ParsingError as e:
             if not safe:
@@ -271,12 +874,78 @@ class BitcoinParser(CurrencyParser):
 
 
 
+class RatesVector(object):
+    """
+    USD rates of many currencies got at once, 
+    rate of any pair of them is computed as a ratio
+
+    :attributes:
+        index(dict[str, int]): position of currency's iso in `rates`
+        rates(array.array[float]): `rates[index[iso]]` USD = 1 iso
+        created_at(float): timestamp of getting the rates
+    """
+
+    def __init__(self, usd_rates:dict, created_at:float=None):
+        self.index = {iso: i for i, iso in enumerate(usd_rates)}
+        self.rates = array('d', usd_rates.values())
+        self.created_at = time.time() if created_at is None else created_at
+
+    def __contains__(self, iso:str):
+        return iso.upper() in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def items(self):
+        return zip(self.index, self.rates)
+
+    def get_usd_rate(self, iso:str) -> float:
+        """
+        Get USD rate of currency
+
+        :arguments:
+            iso(str): currency's iso
+        :raise:
+            KeyError: if currency is not in the vector
+        :return:
+            rate(float): 1 `iso` = `rate` USD
+        """
+        return self.rates[self.index[iso.upper()]]
+
+    def get_rate(self, iso_from:str, iso_to:str) -> float:
+        """
+        Get rate of the pair of currencies
+
+        :arguments:
+            iso_from(str): currency's iso from which to convert
+            iso_to(str): currency's iso to which to convert
+        :raise:
+            KeyError: if any of currencies is not in the vector
+        :return:
+            rate(float): 1 `iso_from` = `rate` `iso_to`
+        """
+        return self.get_usd_rate(iso_from) / self.get_usd_rate(iso_to)
+
+
+
 class FreecurrencyratesParser(Parser):
-    def __init__(self, *args, **kwargs):
+    """
+    Parser for 'https://freecurrencyrates.com', can parse any pair of 
+    currencies supported by the site
+
+    :attributes:
+        super().__init__()
+        registry(CurrencyRegistry | None)=None: 
+            registry of checked currencies' isos
+            if None, existence of currencies is checked every time
+    """
+
+    def __init__(self, *args, registry:'CurrencyRegistry'=None, **kwargs):
         self.start_link = (
             "https://freecurrencyrates.com/ru/{}-exchange-rate-calculator"
         )
         self.start_css_selector = "#rate-iso-{}"
+        self.registry = registry
         super().__init__(link=None, css_selector=None, *args, **kwargs)
 
     def get_rate(self, iso_from:str, iso_to:str="USD"):
@@ -286,39 +955,138 @@ class FreecurrencyratesParser(Parser):
         iso_from, iso_to = iso_from.upper(), iso_to.upper()
         if iso_from == iso_to:
             return {iso_from: 1}
-        self.link = self.start_link.format(iso_from)
-        self.css_selector = self.start_css_selector.format(iso_to)
-        rate = self.get_element()
+        return self.parse_rate(iso_from, iso_to, self.fetch(
+            link=self.start_link.format(iso_from),
+            css_selector=self.start_css_selector.format(iso_to)
+        ).element)
+
+    async def aget_rate(self, iso_from:str, iso_to:str="USD"):
+        """
+        Awaitable FreecurrencyratesParser.get_rate(), requires `fetcher`
+        """
+        iso_from, iso_to = iso_from.upper(), iso_to.upper()
+        if iso_from == iso_to:
+            return {iso_from: 1}
+        return self.parse_rate(iso_from, iso_to, (await self.afetch(
+            link=self.start_link.format(iso_from),
+            css_selector=self.start_css_selector.format(iso_to)
+        )).element)
+
+    def parse_rate(self, iso_from:str, iso_to:str, rate) -> dict:
+        """
+        Get exchange rate from parsed element
+
+        :arguments:
+            iso_from(str): currency's iso from which to convert
+            iso_to(str): currency's iso to which to convert
+            rate(extractors.Element | bs4.Tag | None): input element
+        :raise:
+            exceptions.ParsingError: if parsing failed
+        :return:
+            exchange_rate(dict[str, float | int])
+        """
         if rate is None:
             raise exceptions.ParsingError(
                 "some of the currencies do not exist", cause="iso"
             )
         number = float(rate.get("value").strip().replace(",", "."))
+        if self.registry is not None:
+            for iso in (iso_from, iso_to):
+                if self.registry.get(iso) is None:
+                    self.registry.set(iso, True)
         return {iso_from: 1, iso_to: number}
 
+    def get_rates_vector(self, base:str="USD") -> RatesVector:
+        """
+        Get rates of all currencies on the page of `base` currency at once
+
+        :arguments:
+            base(str)="USD": currency's iso which page to parse
+        :raise:
+            exceptions.ParsingError: if parsing failed
+        :return:
+            vector(RatesVector)
+        """
+        base = base.upper()
+        result = self.fetch(link=self.start_link.format(base))
+        if not result.ok:
+            raise exceptions.ParsingError(
+                f"can not get rates of {base}", cause="network"
+            )
+        return self.parse_rates_vector(base, result.html)
+
+    def parse_rates_vector(self, base:str, html:str) -> RatesVector:
+        """
+        Get rates vector from the page of `base` currency
+
+        :arguments:
+            base(str): currency's iso of the page
+            html(str): html of the page
+        :raise:
+            exceptions.ParsingError: if no rates are on the page
+        :return:
+            vector(RatesVector)
+        """
+        prefix = self.start_css_selector.format('').lstrip('#')
+        base_rates = {}  # 1 `base` = value iso
+        for element_id, element in RegexExtractor().extract_all(
+                html, prefix
+                ).items():
+            try:
+                value = float(
+                    element.get("value", "").strip()
+                    .replace("\xa0", "").replace(" ", "").replace(",", ".")
+                )
+            except ValueError:
+                continue
+            if value > 0:
+                base_rates[element_id[len(prefix):].upper()] = value
+        if "USD" not in base_rates:
+            raise exceptions.ParsingError(
+                f"no rates on the page of {base}", cause="empty soup"
+            )
+        usd_in_base = base_rates["USD"]  # 1 `base` = `usd_in_base` USD
+        vector = RatesVector({
+            iso: usd_in_base / value for iso, value in base_rates.items()
+        })
+        if self.registry is not None:
+            self.registry.set_many(
+                [iso for iso in vector.index if self.registry.get(iso) is None], 
+                True
+            )
+        return vector
+
     def check_currency_exists(self, currency:str):
         """
-        Check if currency exists
+        Check if currency exists, the result is looked up in `registry` 
+        and the site is requested only for unknown currencies.
+        Only definitive answers are recorded: the page of currency 
+        is loaded or not found (404)
 
         arguments:
             currency(str): currency's iso code
         :return:
             success_status(bool): does currency exist
         """
+        currency = currency.upper()
+        if self.registry is not None:
+            if (is_existing := self.registry.get(currency)) is not None:
+                return is_existing
         try:
-            self.link = self.start_link.format(currency.upper())
-            res = self.get_response()
-            return res.ok
+            res = self.fetch(link=self.start_link.format(currency)).response
         except Exception:
+            # network errors say nothing about the currency, do not record
             return False
-        finally:
-            self.link = None
+        # errors of proxies (403, 407), 429 etc. say nothing either
+        if self.registry is not None and (res.ok or res.status_code == 404):
+            self.registry.set(currency, res.ok)
+        return res.ok
 
-    def test_response(self, q:requests.Response) -> bool:
+    def test_result(self, result:FetchResult) -> bool:
         """
-        Override Parser.test_response()
+        Override Parser.test_result()
         """
-        return q.ok
+        return result.ok
 
     def check_delta(
             self, iso_from:str, iso_to:str, value:float=1, 
@@ -377,28 +1145,653 @@ class InvestingParser(CurrencyParser):
 
 
 
+class RatesCache(object):
+    """
+    A cache of USD rates by currency's iso with stale-while-revalidate:
+    rates younger than `ttl` are returned as they are,
+    rates younger than `ttl` + `stale_ttl` are returned and refreshed 
+    in background, older rates are fetched before returning
+
+    :attributes:
+        fetch(Callable[[str], float]): get the latest USD rate of iso
+        ttl(float)=settings.RATES_CACHE_TTL: seconds while rate is fresh
+        stale_ttl(float)=settings.RATES_CACHE_STALE_TTL: 
+            seconds while expired rate can still be returned
+        hits(int): how many times fresh rate was returned
+        stale_hits(int): how many times expired rate was returned
+        misses(int): how many times rate was fetched before returning
+    """
+
+    def __init__(
+            self, fetch, *, ttl:float=settings.RATES_CACHE_TTL,
+            stale_ttl:float=settings.RATES_CACHE_STALE_TTL
+            ):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = self.stale_hits = self.misses = 0
+        self._rates = {}  # iso: (value, timestamp)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, iso:str, *, max_staleness:float=None) -> float:
+        """
+        Get USD rate of currency
+
+        :arguments:
+            iso(str): currency's iso
+        :keyword arguments:
+            max_staleness(float | None)=None: max age of rate in seconds
+                if None, `ttl` + `stale_ttl` is used
+        :raise:
+            `fetch` errors
+        :return:
+            rate(float)
+        """
+        tolerated_age = (
+            self.ttl + self.stale_ttl 
+            if max_staleness is None else 
+            max_staleness
+        )
+        with self._lock:
+            value, timestamp = self._rates.get(iso, (None, None))
+        if value is not None:
+            age = time.time() - timestamp
+            if age <= min(self.ttl, tolerated_age):
+                with self._lock:
+                    self.hits += 1
+                return value
+            if age <= tolerated_age:
+                with self._lock:
+                    self.stale_hits += 1
+                self.refresh(iso)
+                return value
+        with self._lock:
+            self.misses += 1
+        value = self.fetch(iso)
+        self.set(iso, value)
+        return value
+
+    def set(self, iso:str, value:float, timestamp:float=None) -> None:
+        """
+        Set USD rate of currency
+
+        :arguments:
+            iso(str): currency's iso
+            value(float): USD rate
+            timestamp(float | None)=None: when the rate was got
+                if None, current time is used
+        :return: None
+        """
+        with self._lock:
+            self._rates[iso] = (value, timestamp or time.time())
+
+    def refresh(self, iso:str) -> bool:
+        """
+        Fetch rate of currency in background, if it is not being fetched
+
+        :arguments:
+            iso(str): currency's iso
+        :return:
+            success_status(bool): was the refresh started
+        """
+        def refresh_inner():
+            try:
+                self.set(iso, self.fetch(iso))
+            except Exception as e:
+                settings.logger.debug(f"Rate {iso}-USD was not refreshed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(iso)
+
+        with self._lock:
+            if iso in self._refreshing:
+                return False
+            self._refreshing.add(iso)
+        threading.Thread(target=refresh_inner, daemon=True).start()
+        return True
+
+    @property
+    def stats(self) -> dict:
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            'size': len(self._rates),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_ratio': (self.hits + self.stale_hits) / total if total else 0
+        }
+
+
+
+class CurrencyRegistry(object):
+    """
+    A registry of currencies' isos checked for existence, 
+    kept in memory and persisted to the database.
+    Results expire after `ttl` for existing currencies 
+    and after `missing_ttl` for missing ones
+
+    :attributes:
+        db(CurrencyDBHandler): handler of the database
+        ttl(float)=settings.CURRENCY_EXISTS_TTL: 
+            seconds while existing currency is trusted
+        missing_ttl(float)=settings.CURRENCY_MISSING_TTL: 
+            seconds while missing currency is trusted
+    """
+
+    def __init__(
+            self, db_name:str=None, *, 
+            ttl:float=settings.CURRENCY_EXISTS_TTL, 
+            missing_ttl:float=settings.CURRENCY_MISSING_TTL
+            ):
+        self.db = CurrencyDBHandler(db_name)
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self._currencies = {}  # iso: (is_existing, checked_at)
+        self._lock = threading.Lock()
+        self.warm_up()
+
+    def warm_up(self) -> int:
+        """
+        Load unexpired results of checks from the database
+
+        :return:
+            loaded_count(int): how many currencies were loaded
+        """
+        currencies = self.db.get_currencies(
+            checked_after=get_now() - dt.timedelta(seconds=max(
+                self.ttl, self.missing_ttl
+            ))
+        )
+        with self._lock:
+            for currency in currencies:
+                self._currencies[currency['iso']] = (
+                    bool(currency['is_existing']), currency['checked_at']
+                )
+        return len(currencies)
+
+    def get(self, iso:str):
+        """
+        Get the result of currency's check
+
+        :arguments:
+            iso(str): currency's iso
+        :return:
+            is_existing(bool | None): does the currency exist
+                if None, currency is unknown or the result is expired
+        """
+        try:
+            is_existing, checked_at = self._currencies[iso.upper()]
+        except KeyError:
+            return None
+        ttl = self.ttl if is_existing else self.missing_ttl
+        if (get_now() - checked_at).total_seconds() > ttl:
+            return None
+        return is_existing
+
+    def set(self, iso:str, is_existing:bool) -> None:
+        """
+        Record the result of currency's check
+
+        :arguments:
+            iso(str): currency's iso
+            is_existing(bool): does the currency exist
+        :return: None
+        """
+        checked_at = get_now()
+        with self._lock:
+            self._currencies[iso.upper()] = (is_existing, checked_at)
+        self.db.set_currency(iso, is_existing, checked_at)
+
+    def set_many(self, isos:list, is_existing:bool) -> None:
+        """
+        Record the same result of checks of many currencies
+
+        :arguments:
+            isos(list[str]): currencies' isos
+            is_existing(bool): do the currencies exist
+        :return: None
+        """
+        if not isos:
+            return
+        checked_at = get_now()
+        with self._lock:
+            for iso in isos:
+                self._currencies[iso.upper()] = (is_existing, checked_at)
+        self.db.set_currencies(isos, is_existing, checked_at)
+
+
+
+class RatesSnapshotStore(object):
+    """
+    An append-only store of USD rates persisted to the database, 
+    the last snapshot is used to start with accurate rates after restart
+
+    :attributes:
+        db(RatesDBHandler): handler of the database
+        keep(float)=settings.RATES_SNAPSHOTS_KEEP: 
+            seconds to keep rates, the latest rate of every currency is kept
+    """
+
+    def __init__(
+            self, db_name:str=None, *, keep:float=settings.RATES_SNAPSHOTS_KEEP
+            ):
+        self.db = RatesDBHandler(db_name)
+        self.keep = keep
+        self._saved = {}  # iso: updated_at of the last saved rate
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """
+        Load the latest rate of every currency
+
+        :return:
+            snapshot(dict[str, tuple[float, float]]): 
+                iso: (value, updated_at)
+        """
+        snapshot = self.db.get_last_snapshot()
+        with self._lock:
+            self._saved.update(
+                {iso: updated_at for iso, (_, updated_at) in snapshot.items()}
+            )
+        return snapshot
+
+    def save(self, snapshot:dict) -> int:
+        """
+        Append rates which are newer than the saved ones 
+        and delete rates older than `keep`
+
+        :arguments:
+            snapshot(dict[str, tuple[float, float]]): 
+                iso: (value, updated_at)
+        :return:
+            saved_count(int): how many rates were appended
+        """
+        with self._lock:
+            new = {
+                iso: (value, updated_at)
+                for iso, (value, updated_at) in snapshot.items()
+                if updated_at > self._saved.get(iso, 0)
+            }
+            if not new:
+                return 0
+            self.db.add_snapshot(new)
+            self._saved.update(
+                {iso: updated_at for iso, (_, updated_at) in new.items()}
+            )
+        self.db.delete_snapshots(updated_before=time.time() - self.keep)
+        return len(new)
+
+
+
+class RatesHistory(object):
+    """
+    A history of USD rates persisted to the database, rates are rolled up 
+    into buckets of every resolution on adding
+
+    :attributes:
+        db(RatesHistoryDBHandler): handler of the database
+        resolutions(dict[int, float | None])=
+            settings.RATES_HISTORY_RESOLUTIONS: 
+            bucket's length in seconds: seconds to keep buckets
+            if None, buckets are kept forever
+        prune_interval(float)=60*60: seconds between deletions of old buckets
+    """
+
+    def __init__(
+            self, db_name:str=None, *, 
+            resolutions:dict=settings.RATES_HISTORY_RESOLUTIONS,
+            prune_interval:float=60 * 60
+            ):
+        self.db = RatesHistoryDBHandler(db_name)
+        self.resolutions = resolutions
+        self.prune_interval = prune_interval
+        self._added = {}  # iso: updated_at of the last added rate
+        self._pruned_at = 0
+        self._lock = threading.Lock()
+
+    def add(self, snapshot:dict) -> int:
+        """
+        Add rates which are newer than the added ones
+
+        :arguments:
+            snapshot(dict[str, tuple[float, float]]): 
+                iso: (value, updated_at)
+        :return:
+            added_count(int): how many rates were added
+        """
+        with self._lock:
+            new = sorted(
+                (
+                    (iso, value, updated_at)
+                    for iso, (value, updated_at) in snapshot.items()
+                    if updated_at > self._added.get(iso, 0)
+                ),
+                key=lambda x: x[2]
+            )
+            if new:
+                self.db.add_rates(new, list(self.resolutions))
+                self._added.update(
+                    {iso: updated_at for iso, _, updated_at in new}
+                )
+        if time.time() - self._pruned_at > self.prune_interval:
+            self.prune()
+        return len(new)
+
+    def prune(self) -> None:
+        """
+        Delete buckets older than their resolution is kept
+
+        :return: None
+        """
+        self._pruned_at = time.time()
+        for resolution, keep in self.resolutions.items():
+            if keep is not None:
+                self.db.delete_history(
+                    resolution, updated_before=self._pruned_at - keep
+                )
+
+    def get_range(
+            self, iso:str, start:float, end:float=None, *, 
+            resolution:int=None
+            ) -> list:
+        """
+        Get rates of currency in the time range
+
+        :arguments:
+            iso(str): currency's iso
+            start(float): timestamp from which to get
+            end(float | None)=None: timestamp up to which to get
+                if None, current time is used
+        :keyword arguments:
+            resolution(int | None)=None: buckets' length in seconds
+                if None, the finest resolution kept since `start` is used
+        :return:
+            buckets(list[dict]): 
+                bucket, open, high, low, close, closed_at, count
+        """
+        if end is None:
+            end = time.time()
+        if resolution is None:
+            resolution = self.get_resolution(start)
+        return self.db.get_history(iso.upper(), resolution, start, end)
+
+    def get_resolution(self, timestamp:float) -> int:
+        """
+        Get the finest resolution which buckets are kept since the time
+
+        :arguments:
+            timestamp(float): time of the rate
+        :return:
+            resolution(int): bucket's length in seconds
+        """
+        age = time.time() - timestamp
+        return min(
+            (
+                resolution for resolution, keep in self.resolutions.items()
+                if keep is None or keep >= age
+            ),
+            default=max(self.resolutions)
+        )
+
+    def get_usd_rate(
+            self, iso:str, timestamp:float, *, 
+            tolerance:float=settings.RATES_CACHE_TTL
+            ):
+        """
+        Get USD rate of currency at the time
+
+        :arguments:
+            iso(str): currency's iso
+            timestamp(float): time of the rate
+        :keyword arguments:
+            tolerance(float)=settings.RATES_CACHE_TTL: 
+                max seconds between the time and the latest rate before it
+        :return:
+            rate(float | None): None if there is no rate at the time
+        """
+        iso = iso.upper()
+        if iso == "USD":
+            return 1
+        resolution = self.get_resolution(timestamp)
+        bucket = self.db.get_last_bucket(iso, resolution, timestamp)
+        if bucket is None or bucket['closed_at'] < timestamp - max(
+                tolerance, resolution
+                ):
+            return None
+        return bucket['close']
+
+    def get_rate(
+            self, iso_from:str, iso_to:str, timestamp:float, *, 
+            tolerance:float=settings.RATES_CACHE_TTL
+            ):
+        """
+        Get rate by currencies at the time
+
+        :arguments:
+            iso_from(str): currency's iso from which to convert
+            iso_to(str): currency's iso to which to convert
+            timestamp(float): time of the rate
+        :keyword arguments:
+            tolerance(float)=settings.RATES_CACHE_TTL: 
+                see RatesHistory.get_usd_rate()
+        :return:
+            exchange_rate(dict[str, float | int] | None): 
+                None if there is no rate at the time
+        """
+        rate_from = self.get_usd_rate(iso_from, timestamp, tolerance=tolerance)
+        rate_to = self.get_usd_rate(iso_to, timestamp, tolerance=tolerance)
+        if rate_from is None or rate_to is None:
+            return None
+        return {iso_from: 1, iso_to: prettify_float(rate_from / rate_to)}
+
+
+
 class CurrencyExchanger(CurrencyParser):
-    def __init__(self, *, proxy_list:list=get_proxy_list()):
+    """
+    Exchanger of currencies using all parsers.
+    Nothing is parsed on creation, rates start with `snapshot` or default 
+    values until CurrencyExchanger.warm_up()
+
+    :attributes:
+        proxy_list(list[str] | None)=None: HTTP proxies shared by parsers
+            if None, proxies are got by CurrencyExchanger.warm_up()
+        registry(CurrencyRegistry | None)=None: registry of currencies
+            if None, CurrencyRegistry of the default database is used
+        fetcher(AsyncFetcher | None)=None: asyncio backend
+            if None, it is created if settings.PARSERS_ASYNC_BACKEND is set
+        snapshot(dict[str, tuple[float, float]] | None)=None: 
+            iso: (USD rate, timestamp) to start with, like the last known 
+            rates, the parsers' default values are used for missing isos
+        warmed_up(threading.Event): is set when warm up is finished
+    """
+
+    def __init__(
+            self, *, proxy_list:list=None, 
+            registry:CurrencyRegistry=None, fetcher:AsyncFetcher=None,
+            snapshot:dict=None
+            ):
+        if (
+                fetcher is None and settings.PARSERS_ASYNC_BACKEND 
+                and aiohttp is not None
+                ):
+            fetcher = AsyncFetcher()
+        self.fetcher = fetcher
+        self.proxy_health = ProxyHealth(proxy_list)
+        parser_kwargs = {
+            'proxy_health': self.proxy_health, 'fetcher': fetcher, 
+            'to_update': False
+        }
         self.parsers = {
             parser.iso: parser 
             for parser in [
-                RTSParser(proxy_list=proxy_list), 
-                BitcoinParser(proxy_list=proxy_list), 
+                RTSParser(**parser_kwargs), 
+                BitcoinParser(**parser_kwargs), 
                 *[
-                    InvestingParser(x, proxy_list=proxy_list) 
+                    InvestingParser(x, **parser_kwargs) 
                     for x in InvestingParser.AVAILABLE_PRODUCTS
                 ]
             ]
         }
-        self.default_parser = FreecurrencyratesParser(proxy_list=proxy_list)
+        self.registry = CurrencyRegistry() if registry is None else registry
+        self.default_parser = FreecurrencyratesParser(
+            registry=self.registry, proxy_health=self.proxy_health,
+            fetcher=fetcher
+        )
+        self.cache = RatesCache(self.fetch_usd_rate)
+        for iso, (value, updated_at) in (snapshot or {}).items():
+            if iso in self.parsers:
+                parser = self.parsers[iso]
+                parser.value, parser.updated_at = value, updated_at
+            self.cache.set(iso, value, updated_at)
+        # replaced as a whole, so readers never see a half-updated table
+        self.rates = {
+            iso: parser.value for iso, parser in self.parsers.items()
+        }
+        self.vector = None
+        self._vector_lock = threading.Lock()
+        self.warmed_up = threading.Event()
+
+    def get_snapshot(self) -> dict:
+        """
+        Get parsed USD rates of all parsers and of the rates vector
+
+        :return:
+            snapshot(dict[str, tuple[float, float]]): 
+                iso: (value, updated_at)
+        """
+        snapshot = {}
+        if (vector := self.vector) is not None:
+            snapshot.update(
+                {iso: (rate, vector.created_at) for iso, rate in vector.items()}
+            )
+        snapshot.update({
+            iso: (parser.value, parser.updated_at)
+            for iso, parser in self.parsers.items()
+            if parser.updated_at is not None
+        })
+        return snapshot
+
+    def warm_up(self, *, to_update_proxies:bool=None) -> dict:
+        """
+        Get proxies, parse rates of all parsers and the rates vector
+
+        :keyword arguments:
+            to_update_proxies(bool | None)=None: to get the proxy list
+                if None, it is got only if there are no proxies
+        :return:
+            report(dict[str, dict]): see CurrencyExchanger.refresh_rates()
+        """
+        if to_update_proxies is None:
+            to_update_proxies = not self.proxy_health.proxies
+        if to_update_proxies:
+            try:
+                self.proxy_health.set_proxies(get_proxy_list())
+            except Exception as e:
+                settings.logger.error(f"Proxies can not be got: {e}")
+        report = self.refresh_rates()
+        try:
+            self.refresh_vector()
+        except exceptions.ParsingError:
+            settings.logger.error("Rates vector can not be got")
+        self.warmed_up.set()
+        return report
+
+    def start_warm_up(self, **kwargs) -> threading.Thread:
+        """
+        Run CurrencyExchanger.warm_up() in background
+
+        :keyword arguments:
+            see CurrencyExchanger.warm_up()
+        :return:
+            thread(threading.Thread): started thread
+        """
+        thread = threading.Thread(
+            target=settings.logger.catch_error(self.warm_up), 
+            kwargs=kwargs, daemon=True
+        )
+        thread.start()
+        return thread
+
+    def refresh_vector(self) -> RatesVector:
+        """
+        Get rates of all currencies of `default_parser` from one page 
+        and put them to `cache`
+
+        :raise:
+            exceptions.ParsingError: if parsing failed
+        :return:
+            vector(RatesVector)
+        """
+        vector = self.default_parser.get_rates_vector()
+        for iso, rate in vector.items():
+            if iso not in self.parsers:
+                self.cache.set(iso, rate, vector.created_at)
+        self.vector = vector
+        return vector
+
+    def get_vector(self, max_age:float=settings.RATES_CACHE_TTL):
+        """
+        Get rates vector, refreshing it if it is older than `max_age`
+
+        :arguments:
+            max_age(float)=settings.RATES_CACHE_TTL: max age in seconds
+        :raise:
+            exceptions.ParsingError: if parsing failed
+        :return:
+            vector(RatesVector)
+        """
+        with self._vector_lock:
+            if (
+                    self.vector is None or 
+                    time.time() - self.vector.created_at > max_age
+                    ):
+                self.refresh_vector()
+            return self.vector
+
+    def fetch_usd_rate(self, iso:str) -> float:
+        """
+        Parse the latest USD rate of currency, 
+        currencies of `default_parser` are read from the rates vector
+
+        :arguments:
+            iso(str): currency's iso
+        :raise:
+            exceptions.ParsingError: if parsing failed
+        :return:
+            rate(float): 1 `iso` - `rate` USD
+        """
+        if iso in self.parsers:
+            return self.parsers[iso].get_rate()["USD"]
+        try:
+            if iso in (vector := self.get_vector()):
+                return vector.get_usd_rate(iso)
+        except exceptions.ParsingError:
+            pass
+        return self.default_parser.get_rate(iso)["USD"]
+
+    async def afetch_usd_rate(self, iso:str) -> float:
+        """
+        Awaitable CurrencyExchanger.fetch_usd_rate(), requires `fetcher`
+        """
+        parser = self.parsers.get(iso, self.default_parser)
+        rate = await (
+            parser.aget_rate(iso) 
+            if getattr(parser, 'iso', None) is None else 
+            parser.aget_rate()
+        )
+        return rate["USD"]
 
-    def get_rate(self, iso_from:str, iso_to:str):
+    def get_rate(self, iso_from:str, iso_to:str, *, max_staleness:float=None):
         """
         Get rate by currencies
 
         arguments:
             iso_from(str): currency's iso from which to convert
             iso_to(str): currency's iso to which to convert
+        :keyword arguments:
+            max_staleness(float | None)=None: max age of rates in seconds
+                if None, default of RatesCache.get() is used
         :raise:
             exceptions.CurrencyDoesNotExistError: if isos do not exist
             exceptions.ParsingError: if parsing failed
@@ -407,24 +1800,12 @@ class CurrencyExchanger(CurrencyParser):
             raise exceptions.CurrencyDoesNotExistError(
                 "some of the currencies do not exist", cause="iso"
             )
-        p_from = self.parsers.get(iso_from, self.default_parser)
-        p_to = self.parsers.get(iso_to, self.default_parser)
         try:
-            rate_from = (
-                p_from.get_rate(iso_from) 
-                if getattr(p_from, 'iso', None) is None else 
-                p_from.get_rate()
-            )
-            rate_to = (
-                p_to.get_rate(iso_to) 
-                if getattr(p_to, 'iso', None) is None else 
-                p_to.get_rate()
-            )
+            rate_from = self.cache.get(iso_from, max_staleness=max_staleness)
+            rate_to = self.cache.get(iso_to, max_staleness=max_staleness)
             return {
                 iso_from: 1, 
-                iso_to: prettify_float(
-                    (1 / rate_to["USD"]) * rate_from.get("USD")
-                )
+                iso_to: prettify_float((1 / rate_to) * rate_from)
             }
         except Exception:
             raise exceptions.ParsingError(
@@ -432,15 +1813,128 @@ class CurrencyExchanger(CurrencyParser):
                 "network cannot be reached"
             ) from None
 
-    def update_value(self, *args, **kwargs):
-        for curr in self.parsers:
-            self.parsers[curr].update_value(*args, **kwargs)
+    def get_rates(self, isos, iso_to:str="USD") -> dict:
+        """
+        Get rates of currencies concurrently, fetching each currency once
+
+        :arguments:
+            isos(Iterable[str]): currencies' isos from which to convert
+            iso_to(str)="USD": currency's iso to which to convert
+        :return:
+            rates(dict[str, float]): `iso`-`iso_to` rates, 
+                currencies which rates can not be got are omitted
+        """
+        def get_rate_safe(iso):
+            try:
+                return self.get_rate(iso, iso_to).get(iso_to)
+            except (
+                    exceptions.ParsingError, 
+                    exceptions.CurrencyDoesNotExistError
+                    ):
+                return None
+
+        isos = list(set(isos))
+        if not isos:
+            return {}
+        with futures.ThreadPoolExecutor(
+                max_workers=min(len(isos), settings.PARSERS_MAX_WORKERS)
+                ) as executor:
+            rates = dict(zip(isos, executor.map(get_rate_safe, isos)))
+        return {iso: rate for iso, rate in rates.items() if rate is not None}
+
+    def refresh_rates(
+            self, *, timeout:float=settings.PARSERS_REFRESH_TIMEOUT
+            ) -> dict:
+        """
+        Parse rates of all parsers concurrently and apply them at once.
+        Parsers which failed or did not finish before `timeout` keep 
+        their previous values
+
+        :keyword arguments:
+            timeout(float)=settings.PARSERS_REFRESH_TIMEOUT: 
+                seconds to wait for all parsers
+        :return:
+            report(dict[str, dict]): iso: {'status', 'elapsed'}
+                status is one of 'ok', 'failed', 'timeout'
+        """
+        def parse(parser):
+            start = time.perf_counter()
+            try:
+                value = parser.get_rate().get('USD')
+                return value, time.time(), time.perf_counter() - start
+            except Exception:
+                return None, None, time.perf_counter() - start
+
+        started = time.perf_counter()
+        executor = futures.ThreadPoolExecutor(
+            max_workers=min(len(self.parsers), settings.PARSERS_MAX_WORKERS)
+        )
+        tasks = {
+            executor.submit(parse, parser): iso 
+            for iso, parser in self.parsers.items()
+        }
+        done = futures.wait(tasks, timeout=timeout).done
+        # do not wait for hanging parsers, they finish in background
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False)
+        report, updated = {}, {}
+        for task, iso in tasks.items():
+            if task not in done:
+                report[iso] = {
+                    'status': 'timeout', 
+                    'elapsed': time.perf_counter() - started
+                }
+                continue
+            value, updated_at, elapsed = task.result()
+            if value is None:
+                report[iso] = {'status': 'failed', 'elapsed': elapsed}
+                continue
+            report[iso] = {'status': 'ok', 'elapsed': elapsed}
+            updated[iso] = (value, updated_at)
+        rates = self.rates.copy()
+        for iso, (value, updated_at) in updated.items():
+            parser = self.parsers[iso]
+            parser.value, parser.updated_at = value, updated_at
+            self.cache.set(iso, value, updated_at)
+            rates[iso] = value
+        for iso, value in rates.items():
+            if value is None:
+                rates[iso] = self.parsers[iso].default_value
+        self.rates = rates
+        return report
+
+    def update_value(self, *, safe:bool=False) -> bool:
+        """
+        Override CurrencyParser.update_value(), see refresh_rates()
+        """
+        report = self.refresh_rates()
+        failed = [iso for iso, res in report.items() if res['status'] != 'ok']
+        if failed and not safe:
+            raise exceptions.ParsingError(
+                f"can not parse currencies {', '.join(failed)}"
+            )
+        return not failed
 
     def check_delta(
             self, iso_from:str, iso_to:str, old:float, 
-            percent_delta:float=0.01
+            percent_delta:float=0.01, new:float=None
             ):
-        new = self.get_rate(iso_from, iso_to).get(iso_to)
+        """
+        Check delta between the old rate and the latest one
+
+        :arguments:
+            iso_from(str): currency's iso from which to convert
+            iso_to(str): currency's iso to which to convert
+            old(float): the previous value
+            percent_delta(float)=0.01: min delta at which to include the new
+            new(float | None)=None: the latest value
+                if None, CurrencyExchanger.get_rate() will be used
+        :return:
+            delta(dict)
+        """
+        if new is None:
+            new = self.get_rate(iso_from, iso_to).get(iso_to)
         rate = self.calculate_difference(old, new)
         rate['currency_from'] = iso_from
         rate['currency_to'] = iso_to
@@ -449,6 +1943,16 @@ class CurrencyExchanger(CurrencyParser):
         return rate
 
     def check_rate_exists(self, iso_from:str, iso_to:str):
+        """
+        Check if both currencies exist, known currencies are checked 
+        in memory (see CurrencyRegistry)
+
+        :arguments:
+            iso_from(str): currency's iso from which to convert
+            iso_to(str): currency's iso to which to convert
+        :return:
+            success_status(bool): do both currencies exist
+        """
         return all(
             x in self.parsers or self.default_parser.check_currency_exists(x)
             for x in [iso_from, iso_to]
@@ -457,11 +1961,11 @@ class CurrencyExchanger(CurrencyParser):
     def to_string(self, *, to_update:bool=False):
         return '\n'.join([
             "{} = {} USD".format(
-                parser.iso, prettify_float(
-                    parser.value if not to_update else parser.rate
+                iso, prettify_float(
+                    self.rates[iso] if not to_update else parser.rate["USD"]
                 )
             ) 
-            for parser in self.parsers.values()
+            for iso, parser in self.parsers.items()
         ])
 
     def to_telegram_string(self, user_language:str):
@@ -478,7 +1982,7 @@ class CurrencyExchanger(CurrencyParser):
                 "{:<{max_length}s}".format(
                     (curr if curr in main_currs else curr.title()), 
                     max_length=biggest_length + 2
-                ) + f"= {prettify_float(self.parsers[curr].value)}"
+                ) + f"= {prettify_float(self.rates[curr])}"
             )
             for curr in main_currs + other_currs
         ])
@@ -0,0 +1,321 @@
+from concurrent import futures
+import heapq
+import itertools
+import threading
+import time
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+from configs import settings
+
+
+__all__ = ['TokenBucket', 'SendQueue']
+
+
+
+class TokenBucket(object):
+    """
+    A token bucket limiting the rate of actions
+
+    :attributes:
+        rate(float): tokens added per second
+        capacity(float)=`rate`: max number of tokens, i.e. the max burst
+    """
+
+    def __init__(self, rate:float, capacity:float=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def consume(self, tokens:float=1) -> float:
+        """
+        Take tokens if there are enough of them
+
+        :arguments:
+            tokens(float)=1: number of tokens to take
+        :return:
+            wait(float): 0 if tokens were taken,
+                else seconds after which they will be available
+        """
+        with self._lock:
+            self.refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    @property
+    def is_full(self) -> bool:
+        with self._lock:
+            self.refill()
+            return self.tokens >= self.capacity
+
+
+class SendTask(object):
+    """
+    A call of Telegram API queued in SendQueue
+
+    :attributes:
+        func(Callable): function sending to the chat, like bot.send_message
+        chat_id(int): chat's id in Telegram, the first argument of `func`
+        args(tuple): other arguments of `func`
+        kwargs(dict): keyword arguments of `func`
+        priority(int): one of SendQueue's priorities
+        future(concurrent.futures.Future): result of `func`
+        retries(int): how many times the call was retried
+        created_at(float): when the task was queued (time.monotonic)
+    """
+
+    def __init__(
+            self, func, chat_id:int, args:tuple, kwargs:dict, priority:int
+            ):
+        self.func = func
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = futures.Future()
+        self.retries = 0
+        self.created_at = time.monotonic()
+
+
+class SendQueue(object):
+    """
+    A queue of Telegram API calls limited by token buckets
+    to all chats and to every chat. Calls are made in order of priority,
+    calls failed with 429 (Too Many Requests) are retried after
+    `retry_after`, calls failed with network errors are retried
+    with exponential backoff
+
+    :attributes:
+        INTERACTIVE(int): priority of replies to users
+        NOTIFICATION(int): priority of scheduled notifications
+        BROADCAST(int): priority of messages sent to many users
+        global_bucket(TokenBucket): limit of calls to all chats
+        chat_rate(float)=settings.SEND_CHAT_RATE: calls per second to a chat
+        chat_burst(int)=settings.SEND_CHAT_BURST:
+            calls to a chat made at once before limiting
+        workers(int)=settings.SEND_WORKERS: threads making calls
+        max_retries(int)=settings.SEND_MAX_RETRIES:
+            max retries of a call before failing
+    """
+    INTERACTIVE, NOTIFICATION, BROADCAST = range(3)
+    MAX_CHAT_BUCKETS = 10000  # full buckets are dropped above the number
+
+    def __init__(
+            self, *, global_rate:float=settings.SEND_GLOBAL_RATE,
+            chat_rate:float=settings.SEND_CHAT_RATE,
+            chat_burst:int=settings.SEND_CHAT_BURST,
+            workers:int=settings.SEND_WORKERS,
+            max_retries:int=settings.SEND_MAX_RETRIES
+            ):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.sent = self.failed = self.retried = self.rate_limited = 0
+        self.total_latency = 0
+        self._stats_lock = threading.Lock()
+        self._chat_buckets = {}
+        self._queue = []  # heap of (priority, seq, task)
+        self._delayed = []  # heap of (ready_at, seq, task)
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = None
+        self._thread = None
+
+    def start(self) -> None:
+        """
+        Start the dispatching thread and workers, if they are not started
+
+        :return: None
+        """
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._executor = futures.ThreadPoolExecutor(
+                max_workers=self.workers
+            )
+            self._thread = threading.Thread(
+                target=self.dispatch, daemon=True
+            )
+            self._thread.start()
+
+    def submit(
+            self, func, chat_id:int, *args, priority:int=None, **kwargs
+            ) -> futures.Future:
+        """
+        Queue the call of Telegram API
+
+        :arguments:
+            func(Callable): function sending to the chat, like bot.send_message
+            chat_id(int): chat's id in Telegram, the first argument of `func`
+            *args: other arguments of `func`
+        :keyword arguments:
+            priority(int | None)=None: one of SendQueue's priorities
+                if None, SendQueue.NOTIFICATION is used
+            **kwargs: keyword arguments of `func`
+        :return:
+            result(concurrent.futures.Future): result of `func`
+        """
+        self.start()
+        task = SendTask(
+            func, chat_id, args, kwargs,
+            self.NOTIFICATION if priority is None else priority
+        )
+        self.put(task)
+        return task.future
+
+    def wrap(self, func, *, priority:int=None):
+        """
+        Make a function calling `func` through the queue
+        and waiting for its result
+
+        :arguments:
+            func(Callable): function sending to the chat, like bot.send_message
+        :keyword arguments:
+            priority(int | None)=None: see SendQueue.submit()
+        :return:
+            wrapper(Callable): function with the same signature as `func`
+        """
+        def wrapper(chat_id, *args, **kwargs):
+            return self.submit(
+                func, chat_id, *args, priority=priority, **kwargs
+            ).result()
+
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def put(self, task:SendTask, delay:float=0) -> None:
+        with self._condition:
+            if delay > 0:
+                heapq.heappush(
+                    self._delayed,
+                    (time.monotonic() + delay, next(self._seq), task)
+                )
+            else:
+                heapq.heappush(
+                    self._queue, (task.priority, next(self._seq), task)
+                )
+            self._condition.notify()
+
+    def get(self) -> SendTask:
+        """
+        Wait for the most prior task which is ready to be made
+
+        :return:
+            task(SendTask)
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, seq, task = heapq.heappop(self._delayed)
+                    heapq.heappush(self._queue, (task.priority, seq, task))
+                if self._queue:
+                    return heapq.heappop(self._queue)[2]
+                self._condition.wait(
+                    self._delayed[0][0] - now if self._delayed else None
+                )
+
+    def get_chat_bucket(self, chat_id:int) -> TokenBucket:
+        with self._condition:
+            if (bucket := self._chat_buckets.get(chat_id)) is None:
+                if len(self._chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                    self._chat_buckets = {
+                        k: v for k, v in self._chat_buckets.items()
+                        if not v.is_full
+                    }
+                bucket = self._chat_buckets[chat_id] = TokenBucket(
+                    self.chat_rate, self.chat_burst
+                )
+            return bucket
+
+    def dispatch(self) -> None:
+        """
+        Pass ready tasks to workers within limits of chats and of all chats
+
+        :return: None
+        """
+        while True:
+            task = self.get()
+            if wait := self.get_chat_bucket(task.chat_id).consume():
+                self.put(task, wait)
+                continue
+            while wait := self.global_bucket.consume():
+                time.sleep(wait)
+            self._executor.submit(self.run, task)
+
+    def run(self, task:SendTask) -> None:
+        """
+        Make the call of the task, retry it or set its result
+
+        :arguments:
+            task(SendTask): task to make
+        :return: None
+        """
+        try:
+            result = task.func(task.chat_id, *task.args, **task.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and task.retries < self.max_retries:
+                with self._stats_lock:
+                    self.rate_limited += 1
+                return self.retry(
+                    task,
+                    e.result_json.get('parameters', {}).get('retry_after', 1)
+                )
+            self.fail(task, e)
+        except requests.RequestException as e:
+            if task.retries < self.max_retries:
+                return self.retry(task, 2 ** task.retries)
+            self.fail(task, e)
+        except Exception as e:
+            self.fail(task, e)
+        else:
+            with self._stats_lock:
+                self.sent += 1
+                self.total_latency += time.monotonic() - task.created_at
+            task.future.set_result(result)
+
+    def retry(self, task:SendTask, delay:float) -> None:
+        task.retries += 1
+        with self._stats_lock:
+            self.retried += 1
+        self.put(task, delay)
+
+    def fail(self, task:SendTask, error:Exception) -> None:
+        with self._stats_lock:
+            self.failed += 1
+        settings.logger.warning(
+            f"Sending to {task.chat_id} failed: {error.__class__.__name__}:"
+            f"{error}"
+        )
+        task.future.set_exception(error)
+
+    @property
+    def stats(self) -> dict:
+        with self._condition:
+            queued, delayed = len(self._queue), len(self._delayed)
+        with self._stats_lock:
+            return {
+                'queued': queued,
+                'delayed': delayed,
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'rate_limited': self.rate_limited,
+                'avg_latency': (
+                    self.total_latency / self.sent if self.sent else 0
+                )
+            }
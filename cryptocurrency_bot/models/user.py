@@ -1,10 +1,13 @@
+import collections
 from datetime import datetime
+import threading
+import time
 
 from .db import DBHandler, SessionDBHandler
 from configs import settings
 from utils import prettify_percent, get_default_rates, prettify_float
 from utils.dt import (
-    check_datetime_in_future, 
+    check_datetime_in_future, get_now,
     adapt_datetime, convert_to_country_format
 )
 from . import exceptions
@@ -79,6 +82,7 @@ class UserBase(object):
 
 class User(UserBase):
     db = DBHandler(settings.DB_NAME)
+    change_callbacks = []  # called with the user after their data changes
 
     def __init__(self, user_id:int):
         if not self.__class__.exists(user_id):
@@ -101,6 +105,7 @@ class User(UserBase):
         for k, v in kwargs.items():
             if k in self.__dict__:
                 self.__dict__[k] = v
+        self.notify_changed()
 
     @classmethod
     def from_dict(cls, data:dict) -> 'User':
@@ -108,6 +113,28 @@ class User(UserBase):
         super(cls, bare_user).__init__(data)
         return bare_user
 
+    @classmethod
+    def add_change_callback(cls, callback) -> None:
+        """
+        Register a function to call after data of any user changes
+        type: classmethod
+
+        :arguments:
+            callback(Callable[[User], Any]): function to call with the user
+        :return: None
+        """
+        cls.change_callbacks.append(callback)
+
+    def notify_changed(self) -> None:
+        """
+        Call change callbacks with the user (see User.add_change_callback)
+        type: instancemethod
+
+        :return: None
+        """
+        for callback in self.change_callbacks:
+            callback(self)
+
     def get_currencies_by_check_time(self, check_time:str, /) -> dict:
         """
         Get currencies info where its check time equals some check_time
@@ -160,6 +187,7 @@ class User(UserBase):
         """
         self.db.change_user_rate(self.id, iso, **kwargs)
         self.rates = self.normalize_rates(self.db.get_user_rates(self.id))
+        self.notify_changed()
 
     def create_prediction(
             self, iso_from:str, iso_to:str, value:float, 
@@ -204,6 +232,7 @@ class User(UserBase):
         """
         self.db.add_user_rate(self.id, iso, **kwargs)
         self.rates = self.normalize_rates(self.db.get_user_rates(self.id))
+        self.notify_changed()
         return True
 
     def delete_rate(self, iso: str) -> True:
@@ -228,6 +257,7 @@ class User(UserBase):
             raise KeyError(f"can't delete non-present currency {iso}")
         self.db.delete_user_rate(self.id, iso)
         del self.rates[iso]
+        self.notify_changed()
         return True
 
     @classmethod
@@ -244,11 +274,15 @@ class User(UserBase):
         """
         if not cls.exists(user_id):
             # if user not exists, create user and all his rates
-            cls.db.add_user(user_id)
             defaults = get_default_rates(*settings.CURRENCIES, to_print=False)
-            for currency in settings.CURRENCIES:
-                cls.db.add_user_rate(
-                    user_id, currency, value=defaults.get(currency)
+            with cls.db.batch():
+                cls.db.add_user(user_id)
+                cls.db.add_user_rates(
+                    user_id, 
+                    {
+                        currency: defaults.get(currency) 
+                        for currency in settings.CURRENCIES
+                    }
                 )
             return True
         raise exceptions.UserAlreadyExistsError(
@@ -280,6 +314,30 @@ class User(UserBase):
         for user_data in cls.db.get_pro_users(*args, **kwargs):
             yield cls.from_dict(user_data)
 
+    @classmethod
+    def get_expired_pro_users(cls):
+        """
+        Get users whose premium with end datetime has expired, without rates
+        type: classmethod
+
+        :yield:
+            user(User): some user
+        """
+        for user_data in cls.db.get_expired_pro_users(get_now()):
+            yield cls.from_dict(user_data)
+
+    @classmethod
+    def get_unverified_predictions_users(cls):
+        """
+        Get users, who have unverified predictions, without their rates
+        type: classmethod
+
+        :yield:
+            user(User): some user
+        """
+        for user_data in cls.db.get_unverified_predictions_users():
+            yield cls.from_dict(user_data)
+
     @classmethod
     def get_all_users(cls, *args, **kwargs):
         """
@@ -324,7 +382,8 @@ class User(UserBase):
         """
         Init user premium (`is_pro`),
         set all possible check times for all rates,
-        add infinite experts notification count (see Session)
+        add infinite experts notification count (see Session),
+        all in one transaction
         type: instancemethod
 
         :arguments:
@@ -332,9 +391,12 @@ class User(UserBase):
         :return:
             success_status(bool)=True
         """
-        self.update(is_pro=up_to_datetime)
-        for k, v in self.rates.items():
-            self.update_rates(k, check_times=settings.CHECK_TIMES)
+        with self.db.batch():
+            self.update(is_pro=up_to_datetime)
+            self.db.set_user_rates_check_times(self.id, settings.CHECK_TIMES)
+        for v in self.rates.values():
+            v['check_times'] = list(settings.CHECK_TIMES)
+        self.notify_changed()
         return True
 
     def delete_premium(self) -> True:
@@ -342,53 +404,61 @@ class User(UserBase):
         Delete user premium (`is_pro`=False),
         set default check times for all rates,
         remove all additional rates,
-        set default experts notification count (see Session)
+        set default experts notification count (see Session),
+        all in one transaction
         type: instancemethod
         
         :return:
             success_status(bool)=True
         """
-        self.update(is_pro=0)
-        try:
-            Session.db.set_count(
-                self.id, 
-                settings.DEFAULT_EXPERT_PREDICTIONS_NOTIFICATIONS_NUMBER
-            )
-        except exceptions.SessionDoesNotExistError:
-            pass
-        for k, v in self.rates.items():
-            if k not in settings.CURRENCIES:
-                self.delete_rate(k)
-            else:
-                self.update_rates(k, check_times=settings.DEFAULT_CHECK_TIMES)
+        with self.db.batch():
+            self.db.delete_premium(self.id)
+            if Session.exists(self.id):
+                Session.db.set_count(
+                    self.id, 
+                    settings.DEFAULT_EXPERT_PREDICTIONS_NOTIFICATIONS_NUMBER
+                )
+        self.is_pro = 0
+        self.rates = self.normalize_rates(self.db.get_user_rates(self.id))
+        self.notify_changed()
         return True
 
     def init_staff(self) -> True:
         """
         Init all `init_premium` features,
-        set actual predictions `is_by_experts` to True (see Prediction)
+        set actual predictions `is_by_experts` to True (see Prediction),
+        all in one transaction
 
         :return:
             success_status(bool)=True
         """
-        self.init_premium(True)
-        self.update(is_staff=1)
-        for prediction in self.get_predictions(only_actual=True):
-            prediction.update(is_by_experts=1)
+        with self.db.batch():
+            self.init_premium(True)
+            self.update(is_staff=1)
+            Prediction.update_many(
+                dict.fromkeys(self.get_predictions(only_actual=True), 1),
+                'is_by_experts'
+            )
+        self.notify_changed()
         return True
 
     def delete_staff(self) -> True:
         """
         Remove all `init_premium` features,
-        set actual predictions `is_by_experts` to False (see Prediction)
+        set actual predictions `is_by_experts` to False (see Prediction),
+        all in one transaction
 
         :return: 
             success_status(bool)=True
         """
-        self.delete_premium()
-        self.update(is_staff=0)
-        for prediction in self.get_predictions(only_actual=True):
-            prediction.update(is_by_experts=0)
+        with self.db.batch():
+            self.delete_premium()
+            self.update(is_staff=0)
+            Prediction.update_many(
+                dict.fromkeys(self.get_predictions(only_actual=True), 0),
+                'is_by_experts'
+            )
+        self.notify_changed()
         return True
 
     def __str__(self):
@@ -466,6 +536,25 @@ class Prediction(object):
             if k in self.__dict__:
                 self.__dict__[k] = v
 
+    @classmethod
+    def update_many(cls, values:dict, key:str) -> None:
+        """
+        Update the attribute of many predictions in one transaction
+        type: classmethod
+
+        :arguments:
+            values(dict[Prediction, Any]): prediction: new value
+            key(str): attribute to update, see Prediction.update()
+        :raise:
+            DBHandler.change_predictions errors
+        :return: None
+        """
+        cls.db.change_predictions(
+            key, {pred.id: value for pred, value in values.items()}
+        )
+        for pred, value in values.items():
+            pred.__dict__[key] = value
+
     def get_closest_neighbours(self) -> dict:
         """
         Get closest unverified prediction before and next the prediction id
@@ -616,6 +705,28 @@ class Session(object):
         if not self.__class__.exists(user_id):
             self.db.add_session(user_id)
 
+    @classmethod
+    def load_or_create(cls, user_id:int) -> 'Session':
+        """
+        Get the session of user in one query, if it does not exist,
+        create the user with default rates and the session in one transaction
+        type: classmethod
+
+        :arguments:
+            user_id(int): user's id in Telegram
+        :return:
+            session(Session)
+        """
+        data = User.db.get_user_with_session(user_id)
+        if data is None:
+            data = User.db.init_user_with_session(
+                user_id, 
+                get_default_rates(*settings.CURRENCIES, to_print=False)
+            )
+        session = cls.__new__(cls)
+        session.user = User.from_dict(data)
+        return session
+
     @classmethod
     def exists(cls, user_id:int):
         """
@@ -649,3 +760,137 @@ class Session(object):
         :return: None
         """
         self.db.set_count(self.user.user_id, count)
+
+
+
+class SessionCache(object):
+    """
+    A bounded cache of sessions by chat's id. The least recently used
+    session is evicted when the cache is full, a session is reloaded
+    after `ttl` seconds without use or `max_age` seconds after loading
+
+    :attributes:
+        max_size(int)=settings.SESSIONS_CACHE_SIZE: max number of sessions
+        ttl(float)=settings.SESSIONS_CACHE_TTL: 
+            seconds to keep a session not used
+        max_age(float)=settings.SESSIONS_CACHE_MAX_AGE: 
+            seconds to keep a session since loading, so changes made 
+            by other processes (e.g. manage.py) are seen
+        hits(int): how many times a session was found
+        misses(int): how many times no session was found
+        evictions(int): how many sessions were evicted as least recently used
+        expirations(int): how many sessions expired
+        invalidations(int): how many sessions were dropped after changes
+    """
+
+    def __init__(
+            self, *, max_size:int=settings.SESSIONS_CACHE_SIZE,
+            ttl:float=settings.SESSIONS_CACHE_TTL,
+            max_age:float=settings.SESSIONS_CACHE_MAX_AGE
+            ):
+        assert max_size > 0, 'cache size must be positive'
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_age = max_age
+        self.hits = self.misses = self.evictions = 0
+        self.expirations = self.invalidations = 0
+        # chat_id: [session, loaded_at, used_at], least recently used first
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, chat_id:int) -> Session:
+        """
+        Get the session of the chat, if it is cached and not expired
+
+        :arguments:
+            chat_id(int): chat's id in Telegram
+        :return:
+            session(Session | None)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(chat_id)
+            if entry is not None and (
+                    now - entry[2] > self.ttl or now - entry[1] > self.max_age
+                    ):
+                del self._sessions[chat_id]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entry[2] = now
+            self._sessions.move_to_end(chat_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, chat_id:int, session:Session) -> None:
+        """
+        Cache the session of the chat, evict sessions over `max_size`
+
+        :arguments:
+            chat_id(int): chat's id in Telegram
+            session(Session): session to cache
+        :return: None
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[chat_id] = [session, now, now]
+            self._sessions.move_to_end(chat_id)
+            # sessions are ordered by use, so idle ones are first
+            while self._sessions:
+                used_at = next(iter(self._sessions.values()))[2]
+                if len(self._sessions) > self.max_size:
+                    self.evictions += 1
+                elif now - used_at > self.ttl:
+                    self.expirations += 1
+                else:
+                    break
+                self._sessions.popitem(last=False)
+
+    def invalidate(self, chat_id:int) -> bool:
+        """
+        Drop the session of the chat
+
+        :arguments:
+            chat_id(int): chat's id in Telegram
+        :return:
+            success_status(bool): was the session cached
+        """
+        with self._lock:
+            if self._sessions.pop(chat_id, None) is None:
+                return False
+            self.invalidations += 1
+            return True
+
+    def on_user_change(self, user:User) -> None:
+        """
+        Drop the session of the user if it holds another User object,
+        which became stale (see User.add_change_callback)
+
+        :arguments:
+            user(User): changed user
+        :return: None
+        """
+        with self._lock:
+            entry = self._sessions.get(user.id)
+            if entry is None or entry[0].user is user:
+                return
+            del self._sessions[user.id]
+            self.invalidations += 1
+
+    @property
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._sessions),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'hit_ratio': self.hits / total if total else 0
+        }
@@ -0,0 +1,137 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hmac
+import json
+import secrets
+import threading
+
+from telebot import apihelper, types
+
+from configs import settings
+from .dispatcher import UpdateDispatcher
+
+
+__all__ = ['WebhookServer']
+
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Telegram keeps connections alive
+    SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+    MAX_BODY_SIZE = 1024 * 1024  # bytes
+
+    def do_POST(self):
+        if self.path != self.server.path:
+            return self.reply(404)
+        if not hmac.compare_digest(
+                self.headers.get(self.SECRET_TOKEN_HEADER, ''),
+                self.server.secret_token
+                ):
+            self.server.count('rejected')
+            return self.reply(403)
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if not 0 <= length <= self.MAX_BODY_SIZE:
+            # the body is not read, so the connection can not be reused
+            self.close_connection = True
+            return self.reply(400 if length < 0 else 413)
+        try:
+            update = types.Update.de_json(
+                json.loads(self.rfile.read(length))
+            )
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self.reply(400)
+        self.server.count('received')
+        self.server.dispatcher.put(update)
+        self.reply(200)
+
+    def reply(self, code:int) -> None:
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    HTTP server receiving Telegram updates posted to the webhook
+    and passing them to the dispatcher. Telegram requires HTTPS,
+    so the server is meant to be behind a reverse proxy terminating TLS
+
+    :attributes:
+        dispatcher(UpdateDispatcher): dispatcher of received updates
+        path(str)=settings.WEBHOOK_PATH: path to which updates are posted
+        secret_token(str)=settings.WEBHOOK_SECRET_TOKEN:
+            token Telegram sends in every request, if None,
+            a random one is generated
+        received(int): how many updates were received
+        rejected(int): how many requests had a wrong secret token
+    """
+    daemon_threads = True
+
+    def __init__(
+            self, dispatcher:UpdateDispatcher, *,
+            host:str=settings.WEBHOOK_HOST, port:int=settings.WEBHOOK_PORT,
+            path:str=settings.WEBHOOK_PATH,
+            secret_token:str=settings.WEBHOOK_SECRET_TOKEN
+            ):
+        self.dispatcher = dispatcher
+        self.path = path
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self.received = self.rejected = 0
+        self._lock = threading.Lock()
+        super().__init__((host, port), WebhookRequestHandler)
+
+    def count(self, counter:str) -> None:
+        """
+        Increase the counter by 1, requests are handled in many threads
+
+        :arguments:
+            counter(str): 'received' or 'rejected'
+        :return: None
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{self.path}'
+
+    def set_webhook(
+            self, token:str, url:str, *,
+            max_connections:int=settings.WEBHOOK_MAX_CONNECTIONS
+            ) -> bool:
+        """
+        Make Telegram post updates of the bot to the server
+
+        :arguments:
+            token(str): bot's token
+            url(str): public HTTPS url of the server (without `path`)
+        :keyword arguments:
+            max_connections(int)=settings.WEBHOOK_MAX_CONNECTIONS:
+                max connections Telegram opens to deliver updates
+        :raise:
+            telebot.apihelper.ApiException: if the webhook was not set
+        :return:
+            success_status(bool)
+        """
+        # the installed pyTelegramBotAPI does not support `secret_token`
+        return apihelper._make_request(
+            token, 'setWebhook', params={
+                'url': url.rstrip('/') + self.path,
+                'secret_token': self.secret_token,
+                'max_connections': max_connections
+            }
+        )
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'received': self.received,
+            'rejected': self.rejected,
+            **self.dispatcher.stats
+        }
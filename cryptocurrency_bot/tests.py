@@ -1,12 +1,18 @@
 import os
 import sqlite3
+import threading
 import unittest
 import time
 import datetime as dt
+import http.client
+
+import requests
+import telebot
 
 import models
 import configs
 import utils
+from benchmarks import serve_fixtures
 
 
 class BasicTestCase(unittest.TestCase):
@@ -15,6 +21,7 @@ class BasicTestCase(unittest.TestCase):
         self.session_db = models.db.SessionDBHandler(configs.settings.DB_NAME)
 
     def tearDown(self):
+        self.db.close()
         os.remove(configs.settings.DB_NAME)
 
 
@@ -23,6 +30,24 @@ class DBTestCase(BasicTestCase):
         with self.assertRaises(TypeError):
             self.db.execute("SELECT * FROM users")
 
+    def test_connection_pool(self):
+        self.assertIs(self.db.pool, self.session_db.pool)
+        self.db.add_user(0)
+        threads = [
+            threading.Thread(target=self.db.add_user_rate, args=(0, str(i)))
+            for i in range(configs.settings.DB_POOL_SIZE * 4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            len(self.db.get_user_rates(0)), configs.settings.DB_POOL_SIZE * 4
+        )
+        self.assertLessEqual(
+            self.db.pool._opened_count, configs.settings.DB_POOL_SIZE
+        )
+
     def test_add_user(self):
         self.assertFalse(self.db.check_user_exists(0))
         self.db.add_user(0)
@@ -70,6 +95,64 @@ class DBTestCase(BasicTestCase):
             rate['check_times'], configs.settings.DEFAULT_CHECK_TIMES
         )
 
+    def test_add_user_rates(self):
+        self.db.add_user(2)
+        self.db.add_user_rate(2, 'BRENT', 55.0, check_times=['01:00'])
+        self.db.add_user_rates(2, {'BRENT': 60.0, 'EUR': 1.2})
+        rates = {x['iso']: x for x in self.db.get_user_rates(2)}
+        self.assertEqual(len(rates), 2)
+        self.assertEqual(rates['BRENT']['value'], 60.0)
+        self.assertEqual(rates['EUR']['value'], 1.2)
+        for rate in rates.values():
+            self.assertEqual(
+                rate['check_times'], configs.settings.DEFAULT_CHECK_TIMES
+            )
+        with self.assertRaises(AssertionError):
+            self.db.add_user_rates(2, {'RUB': -1})
+        with self.assertRaises(models.exceptions.UserDoesNotExistError):
+            self.db.add_user_rates(-1, {'RUB': 0.01})
+
+    def test_batch(self):
+        count = self.db.pool.executed_count
+        with self.db.batch():
+            self.db.add_user(0)
+            self.db.add_user_rate(0, 'BRENT', 55.0)
+            self.session_db.add_session(0)
+        self.assertTrue(self.db.check_user_exists(0))
+        self.assertEqual(len(self.db.get_user_rates(0)), 1)
+        self.assertTrue(self.session_db.check_session_exists(0))
+        self.assertGreater(self.db.pool.executed_count, count)
+        with self.assertRaises(KeyError):
+            with self.db.batch():
+                self.db.add_user(1)
+                self.db.change_user_rate(0, 'BRENT', value=60.0)
+                self.db.change_user(0, asdfasdf=1)
+        # nothing of the failed batch is committed
+        self.assertFalse(self.db.check_user_exists(1))
+        self.assertEqual(self.db.get_user_rates(0)[0]['value'], 55.0)
+        # caught exception rolls back only the nested transaction
+        with self.db.batch():
+            self.db.add_user(1)
+            try:
+                self.db.change_user(0, language='ru', asdfasdf=1)
+            except KeyError:
+                pass
+            self.db.change_user_rate(0, 'BRENT', value=60.0)
+        self.assertTrue(self.db.check_user_exists(1))
+        self.assertEqual(self.db.get_user(0)['language'], 'en')
+        self.assertEqual(self.db.get_user_rates(0)[0]['value'], 60.0)
+        # other threads do not join the batch
+        with self.db.batch():
+            self.db.add_user(3)
+            exists = []
+            thread = threading.Thread(
+                target=lambda: exists.append(self.db.check_user_exists(3))
+            )
+            thread.start()
+            thread.join()
+        self.assertListEqual(exists, [False])
+        self.assertTrue(self.db.check_user_exists(3))
+
     def test_change_user_rate(self):
         self.db.add_user(0)
         self.db.add_user_rate(0, 'BRENT', 55.0)
@@ -171,6 +254,28 @@ class DBTestCase(BasicTestCase):
         self.assertEqual(len(self.db.get_unverified_predictions()), 0)
         time.sleep(3)
         self.assertEqual(len(self.db.get_unverified_predictions()), 1)        
+        self.assertListEqual(
+            [x['id'] for x in self.db.get_unverified_predictions_users()], [0]
+        )
+
+    def test_change_predictions(self):
+        self.db.add_user(0)
+        d = utils.dt.get_now().replace(year=2120)
+        for value in (0.007, 0.008):
+            self.db.add_prediction(0, 'RUB', 'USD', value, d)
+        self.db.change_predictions('real_value', {1: 0.0075, 2: 0.0085})
+        self.assertListEqual(
+            [self.db.get_prediction(x)['real_value'] for x in (1, 2)],
+            [0.0075, 0.0085]
+        )
+        with self.assertRaises(AssertionError):
+            self.db.change_predictions('user_id', {1: 1})
+        with self.assertRaises(AssertionError):
+            self.db.change_predictions(
+                'up_to_date', {1: d, 2: d.replace(year=2000)}
+            )
+        with self.assertRaises(KeyError):
+            self.db.change_predictions('asdfasdf', {1: 1})
 
     def test_get_experts_predictions(self):
         self.db.add_user(0)
@@ -233,6 +338,73 @@ class DBTestCase(BasicTestCase):
         self.assertEqual(len(self.db.get_users_by_check_time('15:10')), 1)
         self.assertEqual(len(self.db.get_users_by_check_time('13:10')), 0)
 
+    def test_get_users_by_check_time_data(self):
+        self.db.add_user(0)
+        self.db.add_user(1, is_active=False)
+        for user_id in (0, 1):
+            self.db.add_user_rate(user_id, 'BRENT', 55.0)
+            self.db.add_user_rate(
+                user_id, 'BTC', 31000.0, check_times=['10:00']
+            )
+        users = self.db.get_users_by_check_time('10:00')
+        self.assertEqual(len(users), 1)
+        self.assertDictEqual(users[0], self.db.get_user(0))
+        self.assertEqual(len(users[0]['rates']), 2)
+        self.assertEqual(self.db.get_users_by_check_time('10:0'), [])
+
+    def test_init_user_with_session(self):
+        db_name = 'sessions_' + configs.settings.DB_NAME
+        db = models.db.DBHandler(db_name)
+        try:
+            self.assertIsNone(db.get_user_with_session(0))
+            user = db.init_user_with_session(0, {'BRENT': 55.0})
+            self.assertEqual(
+                user['free_notifications_count'],
+                configs.settings.DEFAULT_EXPERT_PREDICTIONS_NOTIFICATIONS_NUMBER
+            )
+            self.assertEqual(user['rates'][0]['iso'], 'BRENT')
+            self.assertEqual(db.get_user_with_session(0), user)
+        finally:
+            db.close()
+            os.remove(db_name)
+
+    def test_migrate_check_times(self):
+        legacy_db_name = 'legacy_' + configs.settings.DB_NAME
+        with sqlite3.connect(legacy_db_name) as conn:
+            conn.execute(
+                'CREATE TABLE users_rates(user_id INTEGER NOT NULL, \
+                iso VARCHAR(5), value DOUBLE DEFAULT 0, \
+                percent_delta REAL DEFAULT 1, check_times LIST, \
+                UNIQUE(user_id, iso) ON CONFLICT REPLACE)'
+            )
+            conn.execute(
+                "INSERT INTO users_rates VALUES \
+                (0, 'BRENT', 55, 0.01, '09:00,15:00,21:00')"
+            )
+        conn.close()
+        legacy_db = models.db.DBHandler(legacy_db_name)
+        try:
+            legacy_db.add_user(0)
+            self.assertListEqual(
+                legacy_db.get_user_rates(0)[0]['check_times'], 
+                ['09:00', '15:00', '21:00']
+            )
+            self.assertEqual(len(legacy_db.get_users_by_check_time('15:00')), 1)
+            self.assertFalse(legacy_db.migrate_check_times())
+            with sqlite3.connect(legacy_db_name) as conn:
+                columns = [
+                    x[1] for x in conn.execute('PRAGMA table_info(users_rates)')
+                ]
+            conn.close()
+            self.assertListEqual(
+                columns, ['user_id', 'iso', 'value', 'percent_delta']
+            )
+            legacy_db.add_user_rate(0, 'BRENT', 60)
+            self.assertEqual(len(legacy_db.get_user_rates(0)), 1)
+        finally:
+            legacy_db.close()
+            os.remove(legacy_db_name)
+
     def test_predictions_reactions(self):
         self.db.add_user(0)
         self.db.add_prediction(
@@ -279,6 +451,19 @@ class DBTestCase(BasicTestCase):
         self.db.change_user(0, is_pro=0)   
         self.assertEqual(len(self.db.get_pro_users()), 1)
 
+    def test_get_expired_pro_users(self):
+        now = utils.dt.get_now()
+        self.db.add_user(0, is_pro=now - dt.timedelta(0, 60))
+        self.db.add_user(1, is_pro=now + dt.timedelta(0, 60))
+        self.db.add_user(2, is_pro=True)
+        self.db.add_user(3)
+        self.db.add_user(4, is_pro=now - dt.timedelta(0, 60), is_active=False)
+        self.assertListEqual(
+            [x['id'] for x in self.db.get_expired_pro_users(now)], [0]
+        )
+        self.db.delete_premium(0)
+        self.assertListEqual(self.db.get_expired_pro_users(now), [])
+
     def test_get_staff_users(self):
         self.assertEqual(len(self.db.get_staff_users()), 0)
         self.db.add_user(0)
@@ -392,13 +577,25 @@ class UserModelTestCase(BasicTestCase):
             self.assertEqual(
                 v.get('check_times'), configs.settings.CHECK_TIMES
             )
+        user.add_rate('UAH', value=0.036, check_times=['01:00'])
+        self.session_db.add_session(4)
+        self.session_db.set_count(4, 0)
         user.delete_premium()
         self.assertEqual(user.is_pro, 0)
         self.assertEqual(user.is_staff, 0)
+        self.assertNotIn('UAH', user.rates)
+        self.assertSetEqual(set(user.rates), set(configs.settings.CURRENCIES))
         for k, v in user.rates.items():
             self.assertEqual(
                 v.get('check_times'), configs.settings.DEFAULT_CHECK_TIMES
             )
+        self.assertEqual(
+            models.user.User(4).rates, user.rates
+        )
+        self.assertEqual(
+            self.session_db.get_session(4)['free_notifications_count'],
+            configs.settings.DEFAULT_EXPERT_PREDICTIONS_NOTIFICATIONS_NUMBER
+        )
 
     def test_staff_dbuser(self):
         user = models.user.User(5)
@@ -588,6 +785,558 @@ class PredictionModelTestCase(BasicTestCase):
 
 
 
+class RatesCacheTestCase(unittest.TestCase):
+    def test_rates_cache(self):
+        fetched = []
+        def fetch(iso):
+            fetched.append(iso)
+            return len(fetched)
+        cache = models.parsers.RatesCache(fetch, ttl=0.5, stale_ttl=0.5)
+        self.assertEqual(cache.get('BTC'), 1)
+        self.assertEqual(cache.get('BTC'), 1)
+        self.assertEqual(fetched, ['BTC'])
+        time.sleep(0.6)
+        # stale rate is returned and refreshed in background
+        self.assertEqual(cache.get('BTC'), 1)
+        time.sleep(0.1)
+        self.assertEqual(cache.get('BTC'), 2)
+        self.assertEqual(cache.get('BTC', max_staleness=0), 3)
+        self.assertEqual(
+            (cache.hits, cache.stale_hits, cache.misses), (2, 1, 2)
+        )
+
+
+
+class ExtractorsTestCase(unittest.TestCase):
+    def test_regex_extractor(self):
+        extractor = models.extractors.RegexExtractor()
+        html = (
+            '<div data-id="price">0</div>'
+            '<span class="big" id="price"> 1,812.35 <b>&amp;</b></span>'
+            "<input id='rate' value=\"0,0135\">"
+            '<div id="nested"><div>1</div></div>'
+        )
+        self.assertFalse(extractor.supports('#chart > div'))
+        self.assertEqual(
+            extractor.extract(html, '#price').text, ' 1,812.35 &'
+        )
+        self.assertEqual(extractor.extract(html, '#price').get('class'), 'big')
+        self.assertEqual(
+            extractor.extract(html, '#rate').get('value'), '0,0135'
+        )
+        self.assertIsNone(extractor.extract(html, '#nested'))
+        self.assertIsNone(extractor.extract(html, '#missing'))
+        # nested elements are extracted by the next extractors
+        self.assertEqual(
+            models.extractors.get_default_extractor().extract(
+                html, '#nested'
+            ).text, 
+            '1'
+        )
+
+
+
+class ParserTestCase(unittest.TestCase):
+    class CountingExtractor(models.extractors.ChainExtractor):
+        def __init__(self):
+            super().__init__([models.extractors.SoupExtractor()])
+            self.count = 0
+
+        def extract(self, html, css_selector):
+            self.count += 1
+            return super().extract(html, css_selector)
+
+    def test_get_rate_fetches_once(self):
+        extractor = self.CountingExtractor()
+        with serve_fixtures() as server:
+            parser = models.parsers.CurrencyParser(
+                'Gold', link=server.url + '/commodities/gold',
+                css_selector='#last_last', proxy_list=None, 
+                extractor=extractor
+            )
+            self.assertEqual(parser.value, 1868.3)
+            self.assertEqual((server.requests_count, extractor.count), (1, 1))
+            self.assertDictEqual(
+                parser.get_rate(), {'Gold': 1, 'USD': 1868.3}
+            )
+            self.assertEqual((server.requests_count, extractor.count), (2, 2))
+
+            parser = models.parsers.FreecurrencyratesParser(
+                proxy_list=None, extractor=extractor
+            )
+            parser.start_link = server.url + '/{}-exchange-rate-calculator'
+            self.assertDictEqual(
+                parser.get_rate('USD', 'RUB'), {'USD': 1, 'RUB': 73.6108}
+            )
+            self.assertEqual((server.requests_count, extractor.count), (3, 3))
+            with self.assertRaises(models.exceptions.ParsingError):
+                parser.get_rate('USD', 'XYZ')
+
+    def test_rates_vector(self):
+        with serve_fixtures() as server:
+            parser = models.parsers.FreecurrencyratesParser(proxy_list=None)
+            parser.start_link = server.url + '/{}-exchange-rate-calculator'
+            vector = parser.get_rates_vector()
+            self.assertEqual(server.requests_count, 1)
+        self.assertGreater(len(vector), 150)
+        self.assertIn('rub', vector)
+        self.assertNotIn('XYZ', vector)
+        self.assertEqual(vector.get_usd_rate('USD'), 1)
+        self.assertAlmostEqual(vector.get_rate('USD', 'RUB'), 73.6108)
+        self.assertAlmostEqual(
+            vector.get_rate('RUB', 'EUR'), 0.8223 / 73.6108
+        )
+
+
+
+class ProxyHealthTestCase(unittest.TestCase):
+    def test_proxy_health(self):
+        health = models.parsers.ProxyHealth(
+            ['fast:1', 'slow:1', 'dead:1'], cooldown=60, max_failures=2
+        )
+        health.record_success('fast:1', 0.1)
+        health.record_success('slow:1', 2)
+        health.record_failure('dead:1')
+        self.assertEqual(health.get_ranked()[0], 'fast:1')
+        self.assertEqual(health.get_ranked()[-1], 'slow:1')
+        health.record_failure('dead:1')
+        self.assertEqual(health.get_ranked(), ['fast:1', 'slow:1'])
+        # stats of the remaining proxies are kept
+        health.set_proxies(['slow:1', 'new:1'])
+        self.assertDictEqual(
+            health.stats, 
+            {'total': 2, 'cooling_down': 0, 'successes': 1, 'failures': 0}
+        )
+        self.assertCountEqual(health.get_ranked(), ['slow:1', 'new:1'])
+
+
+
+class CurrencyRegistryTestCase(BasicTestCase):
+    def test_currency_registry(self):
+        registry = models.parsers.CurrencyRegistry(
+            configs.settings.DB_NAME, ttl=60, missing_ttl=0
+        )
+        self.assertIsNone(registry.get('UAH'))
+        registry.set('uah', True)
+        registry.set('XYZ', False)
+        self.assertTrue(registry.get('UAH'))
+        time.sleep(1)
+        # missing currency is expired
+        self.assertIsNone(registry.get('XYZ'))
+        registry = models.parsers.CurrencyRegistry(
+            configs.settings.DB_NAME, ttl=60, missing_ttl=60
+        )
+        self.assertTrue(registry.get('UAH'))
+        self.assertFalse(registry.get('XYZ'))
+
+    def test_check_currency_exists(self):
+        registry = models.parsers.CurrencyRegistry(configs.settings.DB_NAME)
+        parser = models.parsers.FreecurrencyratesParser(
+            proxy_list=None, registry=registry
+        )
+        for iso, status_code in [
+                ('UAH', 200), ('XYZ', 404), ('ABC', 407), ('DEF', 429)
+                ]:
+            parser.fetch = lambda link, status_code=status_code: (
+                models.parsers.FetchResult(
+                    models.parsers.FetchedResponse(status_code, '', link)
+                )
+            )
+            self.assertEqual(
+                parser.check_currency_exists(iso), status_code < 400
+            )
+        self.assertTrue(registry.get('UAH'))
+        self.assertFalse(registry.get('XYZ'))
+        # errors of proxies and rate limits are not recorded
+        self.assertIsNone(registry.get('ABC'))
+        self.assertIsNone(registry.get('DEF'))
+
+    def test_exchanger_starts_without_parsing(self):
+        now = time.time()
+        exchanger = models.parsers.CurrencyExchanger(
+            registry=models.parsers.CurrencyRegistry(configs.settings.DB_NAME),
+            snapshot={'BTC': (40000, now), 'UAH': (0.036, now)}
+        )
+        self.assertFalse(exchanger.warmed_up.is_set())
+        self.assertEqual(exchanger.rates['BTC'], 40000)
+        self.assertEqual(
+            exchanger.rates['RTS'], exchanger.parsers['RTS'].default_value
+        )
+        self.assertIsNone(exchanger.parsers['RTS'].updated_at)
+        self.assertEqual(exchanger.cache.get('UAH'), 0.036)
+        self.assertEqual(exchanger.cache.stats['misses'], 0)
+
+
+
+class RatesSnapshotStoreTestCase(BasicTestCase):
+    def test_rates_snapshot_store(self):
+        store = models.parsers.RatesSnapshotStore(
+            configs.settings.DB_NAME, keep=60
+        )
+        now = time.time()
+        self.assertDictEqual(store.load(), {})
+        self.assertEqual(
+            store.save({'BTC': (30000, now - 120), 'RTS': (140, now - 120)}),
+            2
+        )
+        self.assertEqual(
+            store.save({'BTC': (40000, now), 'RTS': (140, now - 120)}), 1
+        )
+        store = models.parsers.RatesSnapshotStore(
+            configs.settings.DB_NAME, keep=60
+        )
+        self.assertDictEqual(
+            store.load(), {'BTC': (40000, now), 'RTS': (140, now - 120)}
+        )
+        # older rates are deleted, except the latest ones
+        self.assertEqual(store.db.get_last_snapshot()['RTS'], (140, now - 120))
+        self.assertEqual(store.save({'RTS': (140, now - 120)}), 0)
+
+
+
+class RatesHistoryTestCase(BasicTestCase):
+    def test_rates_history(self):
+        history = models.parsers.RatesHistory(
+            configs.settings.DB_NAME, resolutions={60: 2 * 60 * 60, 3600: None}
+        )
+        start = time.time() // 3600 * 3600 - 3600
+        for minutes, btc in [(0, 100), (1, 120), (30, 90), (31, 110)]:
+            self.assertEqual(history.add({
+                'BTC': (btc, start + minutes * 60),
+                'EUR': (1.25, start + minutes * 60)
+            }), 2)
+        self.assertEqual(history.add({'EUR': (1.25, start + 31 * 60)}), 0)
+        self.assertListEqual(
+            [x['close'] for x in history.get_range('btc', start)],
+            [100, 120, 90, 110]
+        )
+        hour, = history.get_range('BTC', start, resolution=3600)
+        self.assertEqual(
+            (hour['open'], hour['high'], hour['low'], hour['close']),
+            (100, 120, 90, 110)
+        )
+        self.assertEqual(hour['count'], 4)
+        self.assertEqual(history.get_usd_rate('BTC', start + 90), 120)
+        self.assertDictEqual(
+            history.get_rate('BTC', 'EUR', start + 30 * 60 + 5),
+            {'BTC': 1, 'EUR': 72}
+        )
+        self.assertIsNone(history.get_usd_rate('BTC', start - 60))
+        # too far from the latest rate
+        self.assertIsNone(
+            history.get_usd_rate('BTC', start + 90 * 60, tolerance=60)
+        )
+
+
+
+class SendQueueTestCase(unittest.TestCase):
+    def test_token_bucket(self):
+        bucket = models.send_queue.TokenBucket(10, 2)
+        self.assertEqual(bucket.consume(), 0)
+        self.assertEqual(bucket.consume(), 0)
+        self.assertAlmostEqual(bucket.consume(), 0.1, places=2)
+        time.sleep(0.1)
+        self.assertEqual(bucket.consume(), 0)
+
+    def test_send_queue(self):
+        queue = models.send_queue.SendQueue(
+            global_rate=100, chat_rate=5, chat_burst=1, workers=1
+        )
+        sent, limited = [], set()
+
+        def send(chat_id, text):
+            if text == 'limited' and text not in limited:
+                limited.add(text)
+                raise telebot.apihelper.ApiTelegramException(
+                    'sendMessage', None, {
+                        'error_code': 429, 'description': 'Too Many Requests',
+                        'parameters': {'retry_after': 0.3}
+                    }
+                )
+            sent.append((chat_id, text))
+            return text
+
+        blocker = threading.Event()
+        # keeps the only worker busy, so the rest is queued
+        queue.submit(lambda chat_id: blocker.wait(), -1)
+        time.sleep(0.05)
+        results = [
+            queue.submit(send, 1, 'broadcast', priority=queue.BROADCAST),
+            queue.submit(send, 2, 'limited'),
+            queue.submit(send, 1, 'notification'),
+            queue.submit(send, 1, 'reply', priority=queue.INTERACTIVE),
+        ]
+        blocker.set()
+        self.assertListEqual(
+            [x.result(timeout=5) for x in results],
+            ['broadcast', 'limited', 'notification', 'reply']
+        )
+        # chat 1 is limited after the reply, chat 2 is retried after 429
+        self.assertListEqual(
+            sent, [
+                (1, 'reply'), (1, 'notification'),
+                (2, 'limited'), (1, 'broadcast')
+            ]
+        )
+        self.assertEqual(queue.stats['sent'], 5)
+        self.assertEqual(queue.stats['rate_limited'], 1)
+        with self.assertRaises(TypeError):
+            queue.wrap(lambda chat_id: None + 1)(3)
+        self.assertEqual(queue.stats['failed'], 1)
+
+
+
+class UpdateDispatcherTestCase(unittest.TestCase):
+    @staticmethod
+    def get_update(update_id:int, chat_id:int) -> dict:
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id, 'date': 0, 'text': 'text',
+                'chat': {'id': chat_id, 'type': 'private'}
+            }
+        }
+
+    def test_dispatcher(self):
+        handled = {}
+        lock = threading.Lock()
+
+        def process(updates):
+            update = updates[0]
+            if update.update_id == 0:
+                raise ValueError('broken update')
+            # the first chat is slow, but does not block the others
+            time.sleep(0.05 if update.message.chat.id == 0 else 0)
+            with lock:
+                handled.setdefault(update.message.chat.id, []).append(
+                    (update.update_id, time.monotonic())
+                )
+
+        dispatcher = models.dispatcher.UpdateDispatcher(process, workers=4)
+        for i in range(40):
+            dispatcher.put(
+                telebot.types.Update.de_json(self.get_update(i, i % 4))
+            )
+        dispatcher.join()
+        self.assertEqual(dispatcher.stats['processed'], 40)
+        self.assertEqual(dispatcher.stats['failed'], 1)
+        for chat_id, updates in handled.items():
+            ids = [x[0] for x in updates]
+            self.assertListEqual(ids, sorted(ids))
+        self.assertLess(handled[1][-1][1], handled[0][-1][1])
+
+    def test_poll(self):
+        class StopPolling(BaseException):
+            pass
+
+        requested_offsets = []
+        responses = [
+            [1, 2], ConnectionError('no connection'), [3, 4], StopPolling()
+        ]
+
+        def get_updates(offset=None, timeout=None):
+            requested_offsets.append(offset)
+            response = responses.pop(0)
+            if isinstance(response, BaseException):
+                raise response
+            return [
+                telebot.types.Update.de_json(self.get_update(i, i))
+                for i in response
+            ]
+
+        received = []
+        dispatcher = models.dispatcher.UpdateDispatcher(received.extend)
+        with self.assertRaises(StopPolling):
+            dispatcher.poll(get_updates, skip_pending=True)
+        dispatcher.join()
+        # 2 is the last pending update, so it is skipped with 1
+        self.assertListEqual(requested_offsets, [-1, 3, 3, 5])
+        self.assertListEqual(
+            sorted(x.update_id for x in received), [3, 4]
+        )
+
+    def test_bot_handlers(self):
+        bot = utils.telegram.TeleBot('1:token', threaded=False)
+        steps = []
+
+        def ask(message):
+            steps.append(('ask', message.chat.id))
+            bot.register_next_step_handler(message, answer)
+
+        def answer(message):
+            time.sleep(0.01)
+            steps.append(('answer', message.chat.id))
+
+        bot.message_handler(commands=['ask'])(ask)
+        dispatcher = models.dispatcher.UpdateDispatcher(
+            bot.process_new_updates, workers=4
+        )
+        for i in range(20):
+            update = self.get_update(i, i % 10)
+            update['message']['text'] = '/ask' if i < 10 else 'answer'
+            dispatcher.put(telebot.types.Update.de_json(update))
+        dispatcher.join()
+        for chat_id in range(10):
+            self.assertListEqual(
+                [x[0] for x in steps if x[1] == chat_id], ['ask', 'answer']
+            )
+        self.assertEqual(bot.handlers_stats['ask']['count'], 10)
+        self.assertEqual(bot.handlers_stats['answer']['count'], 10)
+        self.assertGreaterEqual(
+            bot.handlers_stats['answer']['max_latency'], 0.01
+        )
+
+    def test_webhook(self):
+        received = []
+        dispatcher = models.dispatcher.UpdateDispatcher(received.extend)
+        server = models.webhook.WebhookServer(
+            dispatcher, port=0, secret_token='secret'
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        header = 'X-Telegram-Bot-Api-Secret-Token'
+        res = requests.post(
+            server.url, json=self.get_update(1, 1), headers={header: 'wrong'}
+        )
+        self.assertEqual(res.status_code, 403)
+        res = requests.post(
+            server.url + 'wrong', json=self.get_update(1, 1), 
+            headers={header: 'secret'}
+        )
+        self.assertEqual(res.status_code, 404)
+        res = requests.post(
+            server.url, data='not json', headers={header: 'secret'}
+        )
+        self.assertEqual(res.status_code, 400)
+        for length in ('abc', '-1'):
+            conn = http.client.HTTPConnection(*server.server_address[:2])
+            conn.putrequest('POST', server.path)
+            conn.putheader(header, 'secret')
+            conn.putheader('Content-Length', length)
+            conn.endheaders()
+            self.assertEqual(conn.getresponse().status, 400)
+            conn.close()
+        res = requests.post(
+            server.url, json=self.get_update(1, 1), headers={header: 'secret'}
+        )
+        self.assertEqual(res.status_code, 200)
+        dispatcher.join()
+        self.assertListEqual([x.update_id for x in received], [1])
+        self.assertEqual(server.stats['rejected'], 1)
+        self.assertEqual(server.stats['received'], 1)
+
+
+class CallbackRouterTestCase(unittest.TestCase):
+    @staticmethod
+    def get_call(data:str):
+        return telebot.types.CallbackQuery.de_json({
+            'id': '1', 'chat_instance': '1', 'data': data,
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'User'}
+        })
+
+    def test_router(self):
+        router = utils.telegram.CallbackRouter()
+        get = router.register('get', int, aliases=('get_prediction',))(
+            lambda call, pred_id: pred_id
+        )
+        ask = router.register('ask', int, aliases=('ask_delete_prediction',))(
+            lambda call, pred_id: pred_id
+        )
+        support = router.register('support', aliases=('send_to_support',))(
+            lambda call: None
+        )
+        with self.assertRaises(AssertionError):
+            router.register('get', int)
+        with self.assertRaises(AssertionError):
+            router.register('get:all')
+        self.assertEqual(router.encode('get', 5), 'get:5')
+        self.assertEqual(router.decode('get:5'), (get, [5]))
+        self.assertEqual(router.decode('ask:5'), (ask, [5]))
+        self.assertEqual(router.encode('support'), 'support')
+        self.assertEqual(router.decode('support'), (support, []))
+        # data of old format
+        self.assertEqual(router.decode('get_prediction_5'), (get, [5]))
+        self.assertEqual(router.decode('ask_delete_prediction_5'), (ask, [5]))
+        self.assertEqual(router.decode('send_to_support'), (support, []))
+        for data in ['get:x', 'get:5:6', 'get', 'unknown:5', 'other_5', None]:
+            self.assertIsNone(router.decode(data))
+        with self.assertRaises(ValueError):
+            router.encode('get', 'x' * 64)
+
+    def test_bot_callbacks(self):
+        bot = utils.telegram.TeleBot('1:token', threaded=False)
+        handled = []
+
+        @bot.callback_route('pred', int)
+        def get_prediction(call, pred_id):
+            handled.append(('pred', pred_id))
+
+        @bot.callback_query_handler(lambda call: call.data == 'other')
+        def other(call):
+            handled.append(('other', call.data))
+
+        bot.process_new_callback_query([
+            self.get_call(x) 
+            for x in [bot.callback_data('pred', 1), 'other', 'unknown']
+        ])
+        self.assertListEqual(handled, [('pred', 1), ('other', 'other')])
+        self.assertEqual(bot.handlers_stats['get_prediction']['count'], 1)
+
+
+class BroadcastTestCase(BasicTestCase):
+    def test_predictions_broadcaster(self):
+        self.db.add_user(0, is_staff=True)
+        for user_id in range(1, 6):
+            self.db.add_user(user_id, to_notify_by_experts=user_id != 4)
+        self.session_db.add_session(2)
+        self.session_db.set_count(2, 0)
+        self.session_db.add_session(3)
+        self.db.add_prediction(
+            0, 'RUB', 'USD', 0.007, utils.dt.get_now().replace(year=2120)
+        )
+        sent = []
+        broadcaster = models.broadcast.PredictionsBroadcaster(
+            models.send_queue.SendQueue(chat_burst=10),
+            lambda chat_id, text: sent.append((chat_id, text)),
+            lambda pred, user, has_notifications: {
+                'text': pred.value if has_notifications else None
+            },
+            db_name=configs.settings.DB_NAME, batch_size=2
+        )
+        # restarted after the first batch
+        broadcast_id = broadcaster.db.add_broadcast(1, utils.dt.get_now())
+        broadcaster.db.checkpoint(broadcast_id, 2, [1])
+        broadcaster.resume()[0].join()
+        self.assertListEqual(sorted(sent), [(3, 0.007), (5, 0.007)])
+        self.assertEqual(
+            self.session_db.fetch_count(3),
+            configs.settings.DEFAULT_EXPERT_PREDICTIONS_NOTIFICATIONS_NUMBER - 1
+        )
+        self.assertListEqual(broadcaster.db.get_unfinished_broadcasts(), [])
+        self.assertEqual(
+            broadcaster.db.get_broadcast(broadcast_id)['sent_count'], 3
+        )
+        sent.clear()
+        broadcaster.start(1).join()
+        self.assertListEqual(
+            sorted(sent, key=lambda x: x[0]),
+            [(1, 0.007), (2, None), (3, 0.007), (5, 0.007)]
+        )
+        self.assertEqual(self.session_db.fetch_count(2), 0)
+
+    def test_broadcast_db_setup(self):
+        db_name = 'broadcast_' + configs.settings.DB_NAME
+        db = models.db.BroadcastDBHandler(db_name)
+        try:
+            self.assertListEqual(db.get_recipients(), [])
+            broadcast_id = db.add_broadcast(1, utils.dt.get_now())
+            self.assertTrue(db.checkpoint(broadcast_id, 1, [1]))
+        finally:
+            db.close()
+            os.remove(db_name)
+
+
 class UtilsTestCase(unittest.TestCase):
     def test_merge_dicts(self):
         self.assertDictEqual(
@@ -752,6 +1501,74 @@ class SessionModelTestCase(BasicTestCase):
             configs.settings.DEFAULT_EXPERT_PREDICTIONS_NOTIFICATIONS_NUMBER-1
         )
 
+    def test_load_or_create_session(self):
+        session = models.user.Session.load_or_create(0)
+        self.assertTrue(models.user.Session.exists(0))
+        user = models.user.User(0)
+        self.assertEqual(session.user.rates, user.rates)
+        self.assertSetEqual(
+            set(session.user.rates), set(configs.settings.CURRENCIES)
+        )
+        self.assertEqual(list(session.user), list(user))
+        count = self.db.pool.executed_count
+        session = models.user.Session.load_or_create(0)
+        # existing session is loaded in one query
+        self.assertEqual(self.db.pool.executed_count - count, 1)
+        self.assertEqual(list(session.user), list(user))
+        # the session is added to existing user
+        models.user.User(1).add_rate('BRENT', value=55.0)
+        self.assertFalse(models.user.Session.exists(1))
+        session = models.user.Session.load_or_create(1)
+        self.assertTrue(models.user.Session.exists(1))
+        self.assertIn('BRENT', session.user.rates)
+
+    def test_sessions_cache(self):
+        cache = models.user.SessionCache(max_size=2, ttl=0.2, max_age=0.5)
+        sessions = [models.user.Session(i) for i in range(3)]
+        self.assertIsNone(cache.get(0))
+        cache.set(0, sessions[0])
+        cache.set(1, sessions[1])
+        self.assertIs(cache.get(0), sessions[0])
+        # 1 is the least recently used
+        cache.set(2, sessions[2])
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(1))
+        self.assertIs(cache.get(2), sessions[2])
+        time.sleep(0.3)
+        self.assertIsNone(cache.get(0))
+        cache.set(0, sessions[0])
+        self.assertEqual(len(cache), 1)
+        for i in range(3):
+            time.sleep(0.15)
+            self.assertIs(cache.get(0), sessions[0])
+        # reloaded after `max_age` even if used
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(0))
+        stats = cache.stats
+        self.assertEqual(stats['hits'], 5)
+        self.assertEqual(stats['misses'], 4)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['expirations'], 3)
+
+    def test_sessions_cache_invalidation(self):
+        cache = models.user.SessionCache()
+        models.user.User.add_change_callback(cache.on_user_change)
+        self.addCleanup(
+            models.user.User.change_callbacks.remove, cache.on_user_change
+        )
+        session = models.user.Session(0)
+        cache.set(0, session)
+        session.user.update(language='ru')
+        self.assertIs(cache.get(0), session)
+        # the cached user is stale after changes made through another object
+        models.user.User(0).init_premium(True)
+        self.assertIsNone(cache.get(0))
+        self.assertEqual(cache.stats['invalidations'], 1)
+        self.assertTrue(models.user.Session(0).user.is_pro)
+        cache.set(0, session)
+        self.assertTrue(cache.invalidate(0))
+        self.assertFalse(cache.invalidate(0))
+
 
 
 if __name__ == '__main__':
@@ -7,7 +7,7 @@ from configs import settings
 from . import decorators, agent, dt, telegram, translator
 
 
-proxy_fetcher = Proxy()
+proxy_fetcher = None  # created on first use, since it fetches proxies
 
 __all__ = [
     'merge_dicts', 'prettify_utcoffset', 'get_json_config', 
@@ -39,7 +39,13 @@ def get_json_config():
 
 
 def get_proxy_list():
-    return [':'.join(x[:2]) for x in proxy_fetcher.fetch_proxies()]
+    global proxy_fetcher
+    if proxy_fetcher is None:
+        proxy_fetcher = Proxy()
+        proxies = proxy_fetcher.proxies
+    else:
+        proxies = proxy_fetcher.fetch_proxies()
+    return [':'.join(x[:2]) for x in proxies]
 
 
 def get_default_rates(*args, to_print: bool = True):
@@ -1,7 +1,216 @@
+import threading
+import time
+
+import telebot
 from telebot import types
+from telebot.handler_backends import MemoryHandlerBackend
+
+
+__all__ = ['CallbackRouter', 'TeleBot', 'kbs', 'inline_kbs']
+
+
+
+class LockedMemoryHandlerBackend(MemoryHandlerBackend):
+    """
+    MemoryHandlerBackend safe to use from many threads
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def register_handler(self, handler_group_id, handler):
+        with self._lock:
+            super().register_handler(handler_group_id, handler)
+
+    def clear_handlers(self, handler_group_id):
+        with self._lock:
+            super().clear_handlers(handler_group_id)
+
+    def get_handlers(self, handler_group_id):
+        with self._lock:
+            return super().get_handlers(handler_group_id)
+
+
+class CallbackRouter(object):
+    """
+    A table of callback query handlers by the prefix of callback data.
+    Callback data is the prefix and arguments joined by SEPARATOR,
+    so the handler is found by one lookup of the prefix
+
+    :attributes:
+        MAX_DATA_SIZE(int): max size of callback data in bytes (Telegram)
+        SEPARATOR(str): separator of the prefix and arguments
+        routes(dict[str, tuple[Callable, tuple]]): 
+            prefix: handler and types of its arguments
+        aliases(dict[str, str]): data of old format: prefix
+    """
+    MAX_DATA_SIZE = 64
+    SEPARATOR = ':'
+
+    def __init__(self):
+        self.routes = {}
+        self.aliases = {}
+
+    def register(self, prefix:str, *types, aliases:tuple=()):
+        """
+        Register the decorated function as the handler of callback data 
+        with the prefix, called with the callback query and arguments
+
+        :arguments:
+            prefix(str): prefix of callback data
+            *types(Callable[[str], Any]): types of arguments
+        :keyword arguments:
+            aliases(tuple[str])=(): prefixes of data of old format 
+                `<alias>_<argument>` or whole data without arguments
+        :raise:
+            AssertionError: if the prefix or an alias is registered
+        :return:
+            decorator(Callable)
+        """
+        assert self.SEPARATOR not in prefix, 'prefix contains separator'
+        assert prefix not in self.routes, f'prefix {prefix} is registered'
+        for alias in aliases:
+            assert alias not in self.aliases, f'alias {alias} is registered'
+
+        def decorator(handler):
+            self.routes[prefix] = (handler, types)
+            self.aliases.update(dict.fromkeys(aliases, prefix))
+            return handler
+        return decorator
+
+    def encode(self, prefix:str, *args) -> str:
+        """
+        Make callback data of the prefix and arguments
+
+        :arguments:
+            prefix(str): prefix of a registered handler
+            *args: arguments of the handler
+        :raise:
+            ValueError: if data is longer than MAX_DATA_SIZE
+        :return:
+            data(str)
+        """
+        data = self.SEPARATOR.join([prefix, *map(str, args)])
+        if len(data.encode('utf-8')) > self.MAX_DATA_SIZE:
+            raise ValueError(
+                f"callback data {data!r} is longer "
+                f"than {self.MAX_DATA_SIZE} bytes"
+            )
+        return data
+
+    def decode(self, data:str):
+        """
+        Find the handler of callback data and its arguments
+
+        :arguments:
+            data(str): callback data
+        :return:
+            route(tuple[Callable, list] | None): handler and arguments,
+                None if no handler matches
+        """
+        if not data:
+            return None
+        if self.SEPARATOR in data:
+            prefix, *args = data.split(self.SEPARATOR)
+        elif data in self.routes:
+            prefix, args = data, []
+        elif (prefix := self.aliases.get(data)) is not None:
+            args = []
+        else:
+            alias, _, arg = data.rpartition('_')
+            prefix, args = self.aliases.get(alias), [arg]
+        if (route := self.routes.get(prefix)) is None:
+            return None
+        handler, types = route
+        if len(args) != len(types):
+            return None
+        try:
+            return handler, [type_(arg) for type_, arg in zip(types, args)]
+        except ValueError:
+            return None
+
+
+class TeleBot(telebot.TeleBot):
+    """
+    TeleBot keeping `session` of the handled update per thread,
+    so updates can be handled by many threads at once.
+    Next step and reply handlers are kept in thread safe backends, 
+    latency of every handler is measured (see `handlers_stats`),
+    callback queries are routed by CallbackRouter first
+
+    :attributes:
+        callback_router(CallbackRouter): routes of callback queries
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('next_step_backend', LockedMemoryHandlerBackend())
+        kwargs.setdefault('reply_backend', LockedMemoryHandlerBackend())
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+        self.callback_router = CallbackRouter()
+        self._handlers_latencies = {}  # name: [count, total, max]
+        self._stats_lock = threading.Lock()
+
+    @property
+    def session(self):
+        return getattr(self._local, 'session', None)
+
+    @session.setter
+    def session(self, value):
+        self._local.session = value
+
+    def callback_route(self, prefix:str, *types, aliases:tuple=()):
+        """
+        Register the decorated function as the handler of callback queries,
+        see CallbackRouter.register
+        """
+        return self.callback_router.register(prefix, *types, aliases=aliases)
+
+    def callback_data(self, prefix:str, *args) -> str:
+        """
+        Make callback data routed to the handler, see CallbackRouter.encode
+        """
+        return self.callback_router.encode(prefix, *args)
+
+    def process_new_callback_query(self, new_callback_querys):
+        unrouted = []
+        for call in new_callback_querys:
+            if (route := self.callback_router.decode(call.data)) is None:
+                unrouted.append(call)
+                continue
+            handler, args = route
+            self._exec_task(handler, call, *args)
+        if unrouted:
+            super().process_new_callback_query(unrouted)
 
+    def _exec_task(self, task, *args, **kwargs):
+        if self.threaded:
+            return super()._exec_task(task, *args, **kwargs)
+        start = time.monotonic()
+        try:
+            task(*args, **kwargs)
+        finally:
+            latency = time.monotonic() - start
+            name = getattr(task, '__name__', repr(task))
+            with self._stats_lock:
+                stats = self._handlers_latencies.setdefault(name, [0, 0, 0])
+                stats[0] += 1
+                stats[1] += latency
+                stats[2] = max(stats[2], latency)
 
-__all__ = ['kbs', 'inline_kbs']
+    @property
+    def handlers_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                name: {
+                    'count': count,
+                    'avg_latency': total / count,
+                    'max_latency': max_latency
+                }
+                for name, (count, total, max_latency) 
+                in self._handlers_latencies.items()
+            }
 
 
 def kbs(buttons, one_time_keyboard=True, row_width:int=None):